@@ -2,6 +2,10 @@
 ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with uvicorn workers to run the async endpoints (pos.async_views)
+natively:
+
+    gunicorn backend.asgi:application -k uvicorn.workers.UvicornWorker --workers 4
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
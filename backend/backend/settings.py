@@ -1,8 +1,10 @@
 import os 
 from pathlib import Path
 from datetime import timedelta
+import tempfile
 import os
 from decouple import config
+from corsheaders.defaults import default_headers
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -40,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "pos.metrics.MetricsMiddleware",
+    "pos.profiling.ProfilingMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -48,6 +52,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    "pos.middleware.ReplicaRoutingMiddleware",
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -72,13 +77,78 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
+#
+# DB_ENGINE=sqlite (default) keeps the stock single-file setup for development.
+# DB_ENGINE=sqlite-tuned is the supported single-box mode for small branches
+# (WAL, busy timeout, BEGIN IMMEDIATE — see pos.backends.sqlite3).
+# DB_ENGINE=postgres is the production profile.
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+DB_ENGINE = config("DB_ENGINE", default="sqlite")
+
+if DB_ENGINE == "postgres":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": config("DB_NAME", default="mangunas_pos"),
+            "USER": config("DB_USER", default="postgres"),
+            "PASSWORD": config("DB_PASSWORD", default=""),
+            "HOST": config("DB_HOST", default="localhost"),
+            "PORT": config("DB_PORT", default="5432"),
+            # Persistent connections, pinged before reuse so a restarted
+            # server or pooler doesn't surface as a failed request.
+            "CONN_MAX_AGE": config("DB_CONN_MAX_AGE", default=600, cast=int),
+            "CONN_HEALTH_CHECKS": True,
+            # Server-side cursors stay on for streaming reads; pos.db.stream()
+            # wraps them in a transaction so they also work behind
+            # transaction-mode pgbouncer. Set to True only for poolers that
+            # can't hold a cursor even inside a transaction.
+            "DISABLE_SERVER_SIDE_CURSORS": config("DB_DISABLE_SERVER_SIDE_CURSORS", default=False, cast=bool),
+            "OPTIONS": {
+                "connect_timeout": config("DB_CONNECT_TIMEOUT", default=5, cast=int),
+                "application_name": "mangunas-pos",
+            },
+        }
     }
-}
+elif DB_ENGINE == "sqlite-tuned":
+    DATABASES = {
+        "default": {
+            "ENGINE": "pos.backends.sqlite3",
+            "NAME": config("DB_NAME", default=str(BASE_DIR / "db.sqlite3")),
+            "OPTIONS": {
+                "pragmas": {
+                    "busy_timeout": config("DB_SQLITE_BUSY_TIMEOUT", default=5000, cast=int),
+                },
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config("DB_NAME", default=str(BASE_DIR / 'db.sqlite3')),
+        }
+    }
+
+# Optional read replica for dashboards, order history and other reports (see
+# pos.routers). DB_REPLICA_HOST points a PostgreSQL profile at a streaming
+# replica; DB_REPLICA_NAME sets a second SQLite file (or database name) for
+# trying the routing locally with two aliases.
+DB_REPLICA_HOST = config("DB_REPLICA_HOST", default="")
+DB_REPLICA_NAME = config("DB_REPLICA_NAME", default="")
+
+if DB_REPLICA_HOST or DB_REPLICA_NAME:
+    DATABASES["replica"] = dict(DATABASES["default"], TEST={"MIRROR": "default"})
+    if DB_REPLICA_HOST:
+        DATABASES["replica"]["HOST"] = DB_REPLICA_HOST
+        DATABASES["replica"]["PORT"] = config("DB_REPLICA_PORT", default=DATABASES["default"].get("PORT", ""))
+    if DB_REPLICA_NAME:
+        DATABASES["replica"]["NAME"] = DB_REPLICA_NAME
+
+DATABASE_ROUTERS = ["pos.routers.ReplicaRouter"]
+DATABASE_REPLICA_ALIAS = "replica"
+DATABASE_REPLICA_MAX_LAG = config("DB_REPLICA_MAX_LAG", default=5, cast=float)  # seconds
+DATABASE_REPLICA_LAG_CHECK_INTERVAL = 2  # seconds between lag probes per process
+DATABASE_REPLICA_PIN_SECONDS = config("DB_REPLICA_PIN_SECONDS", default=5, cast=int)
 
 
 # Password validation
@@ -113,16 +183,96 @@ STATIC_ROOT = BASE_DIR / "staticfiles"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Product image thumbnails (longest edge, px), rendered by a job
+PRODUCT_IMAGE_SIZES = (64, 160, 320, 640)
+
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# ─── Cache ────────────────────────────────────────────────────────────────────
+# locmem is per process. With several gunicorn workers use a shared backend so
+# data versions agree between them, e.g. on a single box
+#   CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache
+#   CACHE_LOCATION=/var/tmp/mangunas-cache
+# or CACHE_BACKEND=django.core.cache.backends.redis.RedisCache with a redis URL.
+CACHES = {
+    "default": {
+        "BACKEND": config("CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": config("CACHE_LOCATION", default="mangunas-pos"),
+    }
+}
+# Cached responses are invalidated by data versions; the timeout only bounds memory
+RESPONSE_CACHE_TIMEOUT = config("RESPONSE_CACHE_TIMEOUT", default=3600, cast=int)
+# Open till carts stay in the cache for a shift; the Cart table is the fallback
+CART_CACHE_TIMEOUT = config("CART_CACHE_TIMEOUT", default=8 * 60 * 60, cast=int)
+
+# ─── Metrics ──────────────────────────────────────────────────────────────────
+# Per-worker snapshots for /api/metrics/ when running several workers (see pos.metrics)
+METRICS_DIR = config("METRICS_DIR", default="") or None
+METRICS_FLUSH_SECONDS = config("METRICS_FLUSH_SECONDS", default=5, cast=float)
+# Prometheus scrapes with `Authorization: Bearer <METRICS_TOKEN>`; staff users can always read it
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
+
+# Queries at least this slow are logged with their EXPLAIN plan (see pos.profiling)
+SLOW_QUERY_MS = config("SLOW_QUERY_MS", default=200, cast=float)
+# Fraction of requests profiled; staff can also ask for one with `X-Profile: 1`
+PROFILE_SAMPLE_RATE = config("PROFILE_SAMPLE_RATE", default=0.0, cast=float)
+PROFILE_DIR = config("PROFILE_DIR", default=os.path.join(tempfile.gettempdir(), "mangunas-profiles"))
+PROFILE_MAX_FILES = config("PROFILE_MAX_FILES", default=500, cast=int)
+
+# ─── Jobs ─────────────────────────────────────────────────────────────────────
+# Background jobs live in the database and run under `manage.py run_workers`
+# (see pos.jobs). Inline, a job runs in the process that queued it once its
+# transaction commits, so development and tests need no worker.
+JOBS_INLINE = config("JOBS_INLINE", default=DEBUG, cast=bool)
+JOB_POLL_SECONDS = config("JOB_POLL_SECONDS", default=1.0, cast=float)
+# Retry delays double from JOB_BACKOFF_SECONDS (or the task's own) up to JOB_BACKOFF_MAX
+JOB_BACKOFF_SECONDS = config("JOB_BACKOFF_SECONDS", default=10, cast=float)
+JOB_BACKOFF_MAX = config("JOB_BACKOFF_MAX", default=600, cast=float)
+# Finished jobs are pruned after this many days; failed ones are kept
+JOB_RETENTION_DAYS = config("JOB_RETENTION_DAYS", default=7, cast=int)
+
+# ─── Loyalty ──────────────────────────────────────────────────────────────────
+# One point per LOYALTY_SPEND_PER_POINT paid; a point tendered is worth
+# LOYALTY_POINT_VALUE. Run `manage.py recompute_loyalty` after changing either.
+LOYALTY_SPEND_PER_POINT = config("LOYALTY_SPEND_PER_POINT", default=100, cast=float)
+LOYALTY_POINT_VALUE = config("LOYALTY_POINT_VALUE", default=1, cast=float)
+# Ledger entries are folded into balances this long after the first unfolded one, in batches
+LOYALTY_FOLD_DELAY = config("LOYALTY_FOLD_DELAY", default=30, cast=float)
+LOYALTY_FOLD_BATCH = config("LOYALTY_FOLD_BATCH", default=1000, cast=int)
+
+# ─── Archive ──────────────────────────────────────────────────────────────────
+# `manage.py archive_history` moves closed orders and stock movements older
+# than this out of the hot tables (see pos.archive)
+ARCHIVE_AFTER_DAYS = config("ARCHIVE_AFTER_DAYS", default=365, cast=int)
+# Orders (or movements) moved per transaction
+ARCHIVE_BATCH = config("ARCHIVE_BATCH", default=1000, cast=int)
+
+# ─── Product import ───────────────────────────────────────────────────────────
+# Rows of an imported catalog applied per transaction (see pos.imports)
+IMPORT_BATCH = config("IMPORT_BATCH", default=2000, cast=int)
+
+# ─── Stores ───────────────────────────────────────────────────────────────────
+# Requests that don't name a store (X-Store header or ?store=) work on this one
+DEFAULT_STORE = config("DEFAULT_STORE", default="main")
+DEFAULT_STORE_NAME = config("DEFAULT_STORE_NAME", default="Main branch")
+
 # ─── REST Framework ───────────────────────────────────────────────────────────
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "pos.authentication.CachedJWTAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
     ],
+    "DEFAULT_RENDERER_CLASSES": [
+        "pos.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "pos.renderers.ORJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 20,
 }
@@ -133,12 +283,17 @@ SIMPLE_JWT = {
     "REFRESH_TOKEN_LIFETIME": timedelta(days=7),
 }
 
+# Resolved users are cached per process; saves evict locally, other workers
+# see a change once their entry expires
+AUTH_USER_CACHE_SECONDS = config("AUTH_USER_CACHE_SECONDS", default=30, cast=int)
+
 # ─── CORS ─────────────────────────────────────────────────────────────────────
 CORS_ALLOWED_ORIGINS = config(
     "CORS_ALLOWED_ORIGINS",
     default="http://localhost:5173,http://localhost:3000"
 ).split(",")
 CORS_ALLOW_CREDENTIALS = True
+CORS_ALLOW_HEADERS = (*default_headers, "x-store")
 
 # ─── M-Pesa ───────────────────────────────────────────────────────────────────
 MPESA_ENVIRONMENT = config("MPESA_ENVIRONMENT", default="sandbox")
@@ -146,4 +301,8 @@ MPESA_CONSUMER_KEY = config("MPESA_CONSUMER_KEY", default="")
 MPESA_CONSUMER_SECRET = config("MPESA_CONSUMER_SECRET", default="")
 MPESA_SHORTCODE = config("MPESA_SHORTCODE", default="174379")
 MPESA_PASSKEY = config("MPESA_PASSKEY", default="")
-MPESA_CALLBACK_URL = config("MPESA_CALLBACK_URL", default="https://yourdomain.com/api/payments/mpesa/callback/")
\ No newline at end of file
+MPESA_CALLBACK_URL = config("MPESA_CALLBACK_URL", default="https://yourdomain.com/api/payments/mpesa/callback/")
+
+# /api/async/payments/<id>/status/?wait=N re-reads a pending payment this often, for at most this long
+PAYMENT_STATUS_POLL_SECONDS = config("PAYMENT_STATUS_POLL_SECONDS", default=1.0, cast=float)
+PAYMENT_STATUS_MAX_WAIT = config("PAYMENT_STATUS_MAX_WAIT", default=30.0, cast=float)
@@ -4,6 +4,7 @@ from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework_simplejwt.views import TokenRefreshView
 
+from pos.images import serve_media
 from pos.views import CashPaymentView, MpesaSTKPushView, MpesaCallbackView, MpesaQueryView
 
 urlpatterns = [
@@ -13,4 +14,4 @@ urlpatterns = [
     path("api/payments/mpesa/callback/", MpesaCallbackView.as_view()),                   # ← add
     path("api/", include("pos.urls")),
     path("api/auth/token/refresh/", TokenRefreshView.as_view(), name="token-refresh"),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+] + static(settings.MEDIA_URL, view=serve_media, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
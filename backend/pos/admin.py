@@ -1,6 +1,19 @@
 from django.contrib import admin
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
 from django.utils.html import format_html
-from .models import Category, Product, Customer, Order, OrderItem, Payment, StockMovement
+from .models import (
+    Category, Product, Customer, Order, OrderItem, Payment, StockMovement, Cart, Promotion, LoyaltyEntry,
+    CustomerSegment, Store, StockLevel, ArchivedOrder, GoodsReceipt, GoodsReceiptItem,
+)
+from . import loyalty
+
+
+@admin.register(Store)
+class StoreAdmin(admin.ModelAdmin):
+    list_display = ["code", "name", "is_active", "created_at"]
+    list_filter = ["is_active"]
+    search_fields = ["code", "name"]
 
 
 @admin.register(Category)
@@ -8,25 +21,54 @@ class CategoryAdmin(admin.ModelAdmin):
     list_display = ["name", "product_count", "created_at"]
     search_fields = ["name"]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            active_product_count=Count("products", filter=Q(products__is_active=True))
+        )
+
     def product_count(self, obj):
-        return obj.products.filter(is_active=True).count()
+        return obj.active_product_count
     product_count.short_description = "Products"
 
 
+class StockLevelInline(admin.TabularInline):
+    model = StockLevel
+    extra = 0
+    readonly_fields = ["updated_at"]
+
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ["name", "barcode", "category", "price", "stock_quantity", "stock_status", "is_active"]
-    list_filter = ["category", "is_active"]
+    list_display = ["name", "barcode", "category", "price", "stock_status", "is_active"]
+    list_filter = ["category", "tax_class", "is_active"]
     search_fields = ["name", "barcode"]
     list_editable = ["price", "is_active"]
+    inlines = [StockLevelInline]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            total_stock=Sum("stock_levels__quantity"),
+            low_stores=Count("stock_levels", filter=Q(stock_levels__quantity__lte=F("low_stock_threshold"))),
+        )
 
     def stock_status(self, obj):
-        if obj.is_low_stock:
-            return format_html('<span style="color:red;font-weight:bold;">Low Stock ({})</span>', obj.stock_quantity)
-        return format_html('<span style="color:green;">{}</span>', obj.stock_quantity)
+        # Across all stores; red when any store is running low
+        if obj.low_stores:
+            return format_html(
+                '<span style="color:red;font-weight:bold;">{} (low at {} store(s))</span>', obj.total_stock, obj.low_stores
+            )
+        return format_html('<span style="color:green;">{}</span>', obj.total_stock or 0)
     stock_status.short_description = "Stock"
 
 
+@admin.register(Promotion)
+class PromotionAdmin(admin.ModelAdmin):
+    list_display = ["name", "kind", "product", "category", "starts_at", "ends_at", "is_active"]
+    list_filter = ["kind", "is_active"]
+    search_fields = ["name", "product__name", "category__name"]
+    raw_id_fields = ["product"]
+
+
 @admin.register(Customer)
 class CustomerAdmin(admin.ModelAdmin):
     list_display = ["name", "phone", "email", "loyalty_points", "created_at"]
@@ -46,13 +88,23 @@ class PaymentInline(admin.TabularInline):
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ["order_number", "customer", "cashier", "status", "total_amount", "created_at"]
-    list_filter = ["status", "created_at"]
+    list_display = ["order_number", "store", "customer", "cashier", "status", "total_amount", "created_at"]
+    list_filter = ["store", "status", "created_at"]
     search_fields = ["order_number", "customer__name"]
     readonly_fields = ["order_number", "subtotal", "tax_amount", "total_amount"]
     inlines = [OrderItemInline, PaymentInline]
     date_hierarchy = "created_at"
 
+    @transaction.atomic
+    def delete_model(self, request, obj):
+        loyalty.orders_deleted(Order.objects.filter(pk=obj.pk))
+        obj.delete()
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        loyalty.orders_deleted(queryset)
+        queryset.delete()
+
 
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
@@ -64,16 +116,89 @@ class PaymentAdmin(admin.ModelAdmin):
 
 @admin.register(StockMovement)
 class StockMovementAdmin(admin.ModelAdmin):
-    list_display = ["product", "movement_type", "quantity", "previous_stock", "new_stock", "reference", "created_at"]
-    list_filter = ["movement_type", "created_at"]
+    list_display = ["product", "store", "movement_type", "quantity", "previous_stock", "new_stock", "reference", "created_at"]
+    list_filter = ["store", "movement_type", "created_at"]
     search_fields = ["product__name", "reference"]
-    readonly_fields = ["product", "movement_type", "quantity", "previous_stock", "new_stock", "reference", "created_by", "created_at"]
+    readonly_fields = ["store", "product", "movement_type", "quantity", "previous_stock", "new_stock", "reference", "created_by", "created_at"]
 
     def has_add_permission(self, request):
         return False  # Movements are created programmatically
 
 
+class GoodsReceiptItemInline(admin.TabularInline):
+    model = GoodsReceiptItem
+    extra = 0
+    readonly_fields = ["product", "quantity", "unit_cost"]
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(GoodsReceipt)
+class GoodsReceiptAdmin(admin.ModelAdmin):
+    list_display = ["grn_number", "store", "supplier", "supplier_reference", "total_cost", "received_by", "created_at"]
+    list_filter = ["store", "created_at"]
+    search_fields = ["grn_number", "supplier", "supplier_reference"]
+    readonly_fields = ["grn_number", "store", "supplier", "supplier_reference", "total_cost", "received_by", "created_at"]
+    inlines = [GoodsReceiptItemInline]
+
+    def has_add_permission(self, request):
+        return False  # Booked through /api/goods-receipts/, which moves the stock
+
+
+@admin.register(LoyaltyEntry)
+class LoyaltyEntryAdmin(admin.ModelAdmin):
+    list_display = ["customer", "kind", "points", "order", "note", "created_at"]
+    list_filter = ["kind", "created_at"]
+    search_fields = ["customer__name", "customer__phone", "order__order_number"]
+    readonly_fields = ["customer", "order", "kind", "points", "note", "batch", "created_by", "created_at"]
+
+    def has_add_permission(self, request):
+        return False  # The ledger is append-only; adjustments go through pos.loyalty
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 # Customize admin site
 admin.site.site_header = "Mangunas Supermarket POS"
 admin.site.site_title = "Mangunas POS"
-admin.site.index_title = "POS Administration"
\ No newline at end of file
+admin.site.index_title = "POS Administration"
+
+@admin.register(Cart)
+class CartAdmin(admin.ModelAdmin):
+    list_display = ["id", "store", "cashier", "customer", "subtotal", "updated_at"]
+    list_filter = ["store", "cashier"]
+    readonly_fields = ["store", "cashier", "customer", "discount_amount", "lines", "subtotal", "version", "created_at", "updated_at"]
+
+    def has_add_permission(self, request):
+        return False  # Carts are opened by the tills; admin is for clearing abandoned ones
+
+
+@admin.register(CustomerSegment)
+class CustomerSegmentAdmin(admin.ModelAdmin):
+    list_display = ["customer", "segment", "recency_score", "frequency_score", "monetary_score", "last_order_at", "computed_at"]
+    list_filter = ["segment"]
+    search_fields = ["customer__name", "customer__phone"]
+    list_select_related = ["customer"]
+
+    def has_add_permission(self, request):
+        return False  # Rebuilt by segment_customers
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ["order_number", "store", "status", "total_amount", "created_at", "archived_at"]
+    list_filter = ["store", "status"]
+    search_fields = ["order_number"]
+    date_hierarchy = "created_at"
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False  # Moved here by archive_history
+
+    def has_change_permission(self, request, obj=None):
+        return False
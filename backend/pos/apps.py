@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class PosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'pos'
+
+    def ready(self):
+        from .authentication import connect_user_signals
+        from .caching import connect_signals
+        from .images import connect_image_signals
+        from .metrics import connect_metrics
+        from .models import Category, Customer, Product, Promotion, StockLevel, Store
+
+        connect_signals(Category, Product, Customer, Promotion, StockLevel, Store)
+        connect_user_signals()
+        connect_image_signals()
+        connect_metrics()
@@ -0,0 +1,163 @@
+"""
+Hot/cold split of the order and stock history.
+
+Tills and the everyday reports only look at the last few weeks, but orders,
+their items and payments, and stock movements grow without bound.
+`manage.py archive_history` moves closed orders (anything but pending) and
+stock movements older than ARCHIVE_AFTER_DAYS into archive tables with the
+same columns and primary keys (pos.models.Archived*), so the hot tables and
+their indexes stay the size of the working set.
+
+The move is set-based: per batch of ARCHIVE_BATCH orders (or movements), one
+INSERT ... SELECT per table into the archive and one DELETE per table out of
+the hot one, in a transaction of its own, so tills are only ever held up for
+the length of one batch. A batch is a fixed, locked set of ids, so what is
+deleted is exactly what was copied.
+
+History endpoints read the archive when asked for an old range (see
+ArchiveReadMixin): a list whose ?date_from= or ?date_to= falls on or before
+the newest archived row reads both tables as one UNION, and an order that's
+no longer hot is looked up in the archive. Lists without a date range only
+read the hot tables. Loyalty ledger entries of archived orders keep their
+points and their order id (the column has no constraint); RFM segments and
+loyalty recomputes only see the hot orders.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+
+from .caching import bump_version, data_version
+from .db import delete_rows, insert_select
+from .models import (
+    ArchivedOrder, ArchivedOrderItem, ArchivedPayment, ArchivedStockMovement, Order, OrderItem, Payment,
+    StockMovement,
+)
+from .stores import current_store
+
+HORIZON_KEY = "archive-horizon:{}:{}:{}"
+
+
+def _copy(model, archive_model, queryset, using):
+    fields = [field.name for field in model._meta.concrete_fields]
+    return insert_select(archive_model, fields, queryset.values(*fields).order_by(), using)
+
+
+def _batches(queryset, batch_size, using):
+    """
+    The ids of `queryset` a batch at a time, each batch locked inside its
+    own transaction: a row can't change (an order be refunded, say) between
+    being copied and deleted.
+    """
+    while True:
+        with transaction.atomic(using=using):
+            ids = list(queryset.select_for_update().order_by("id").values_list("id", flat=True)[:batch_size])
+            if not ids:
+                return
+            yield ids
+
+
+def archive_orders(before, batch_size=None, using="default"):
+    """Move closed orders created before `before`, with their items and payments, to the archive."""
+    counts = {"orders": 0, "items": 0, "payments": 0}
+    closed = Order.objects.using(using).filter(created_at__lt=before).exclude(status=Order.StatusChoices.PENDING)
+    for ids in _batches(closed, batch_size or settings.ARCHIVE_BATCH, using):
+        orders = Order.objects.using(using).filter(id__in=ids)
+        items = OrderItem.objects.using(using).filter(order_id__in=ids)
+        payments = Payment.objects.using(using).filter(order_id__in=ids)
+        counts["orders"] += _copy(Order, ArchivedOrder, orders, using)
+        counts["items"] += _copy(OrderItem, ArchivedOrderItem, items, using)
+        counts["payments"] += _copy(Payment, ArchivedPayment, payments, using)
+        # Refunds only ever point at payments of the same order; loyalty entries keep the order id
+        delete_rows(items)
+        delete_rows(payments)
+        delete_rows(orders)
+    if counts["orders"]:
+        bump_version(ArchivedOrder, using=using)
+    return counts
+
+
+def archive_movements(before, batch_size=None, using="default"):
+    """Move stock movements created before `before` to the archive."""
+    moved = 0
+    old = StockMovement.objects.using(using).filter(created_at__lt=before)
+    for ids in _batches(old, batch_size or settings.ARCHIVE_BATCH, using):
+        movements = StockMovement.objects.using(using).filter(id__in=ids)
+        moved += _copy(StockMovement, ArchivedStockMovement, movements, using)
+        delete_rows(movements)
+    if moved:
+        bump_version(ArchivedStockMovement, using=using)
+    return moved
+
+
+def archive(days=None, batch_size=None, using="default"):
+    """Archive everything older than `days` (ARCHIVE_AFTER_DAYS). Returns the rows moved per table."""
+    before = timezone.now() - timedelta(days=settings.ARCHIVE_AFTER_DAYS if days is None else days)
+    counts = archive_orders(before, batch_size, using)
+    counts["movements"] = archive_movements(before, batch_size, using)
+    return counts
+
+
+def horizon(archive_model, store):
+    """created_at of `store`'s newest row in `archive_model`, or None. Cached until the next archive run."""
+    key = HORIZON_KEY.format(archive_model._meta.model_name, store.pk, data_version(archive_model))
+    return cache.get_or_set(
+        key, lambda: archive_model.objects.filter(store=store).aggregate(newest=Max("created_at"))["newest"], None
+    )
+
+
+def date_range(request):
+    """
+    The request's ?date_from= and ?date_to= as dates (None when not given).
+    Raises ValidationError for one that isn't a real date.
+    """
+    days = []
+    for param in ("date_from", "date_to"):
+        value = request.query_params.get(param)
+        if not value:
+            days.append(None)
+            continue
+        try:
+            day = parse_date(value)
+        except ValueError:  # well formed, but no such day
+            day = None
+        if day is None:
+            raise ValidationError({param: ["Enter a valid date (YYYY-MM-DD)."]})
+        days.append(day)
+    return tuple(days)
+
+
+class ArchiveReadMixin:
+    """
+    For FastReadMixin history views. `filter_history(queryset)` applies the
+    request's filters and must work on the hot and the archive model alike.
+    """
+    archive_model = None
+
+    def get_archive_queryset(self):
+        return self.filter_history(self.archive_model.objects.filter(store=current_store(self.request)))
+
+    def reads_archive(self):
+        days = [day for day in date_range(self.request) if day is not None]
+        if not days:
+            return False
+        newest = horizon(self.archive_model, current_store(self.request))
+        return newest is not None and min(days) <= timezone.localdate(newest)
+
+    def get_rows(self, builder):
+        if self.action == "list" and self.reads_archive():
+            return builder.prepare_union(self.filter_queryset(self.get_queryset()), self.get_archive_queryset())
+        return super().get_rows(builder)
+
+    def get_row(self, builder, key):
+        values = super().get_row(builder, key)
+        if values is None:
+            # No longer hot
+            values = builder.prepare(self.get_archive_queryset()).filter(**{self.lookup_field: key}).first()
+        return values
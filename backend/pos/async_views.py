@@ -0,0 +1,230 @@
+"""
+Async read endpoints for the tills' hot paths.
+
+Served natively when the app runs under ASGI (uvicorn backend.asgi:application):
+the ORM calls go through Django's async API, so a request waiting on the
+database — or a till long-polling a payment — holds no worker. Under WSGI
+the same views still work; Django runs each one to completion on the
+worker thread.
+
+DRF has no async views, so these are plain Django views. They produce the
+same rows as the DRF endpoints they shadow (through pos.rows), authenticate
+the same JWTs through the cached user lookup, and return errors in the
+API's shapes:
+
+  GET /api/async/scan/<barcode>/                product by barcode, with the store's stock
+  GET /api/async/catalog/?since=<iso datetime>  full or delta catalog sync for the store
+  GET /api/async/customers/lookup/?phone=|q=    customer type-ahead
+  GET /api/async/payments/<id>/status/?wait=N   payment status, long-polled
+  GET /api/async/dashboard/                     same payload as /api/dashboard/
+"""
+
+import asyncio
+import functools
+import math
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count, F, Q, Sum
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+
+from .authentication import CachedJWTAuthentication
+from .customers import phone_lookup, type_ahead
+from .metrics import stage
+from .models import Customer, Order, Payment, Product, StockLevel
+from .renderers import ORJSONRenderer
+from .rows import CustomerRows, OrderRows, ProductRows
+from .stores import current_store, with_stock
+
+LOOKUP_LIMIT = 10
+# A product written just before a sync but committed after it would be missed
+# by the next one; re-sending the last few seconds' changes covers that
+SYNC_OVERLAP = timedelta(seconds=30)
+
+_renderer = ORJSONRenderer()
+
+
+def _json(data, status=200):
+    return HttpResponse(_renderer.render(data), status=status, content_type="application/json")
+
+
+def _unauthorized(detail):
+    response = _json(detail if isinstance(detail, dict) else {"detail": detail}, status=401)
+    response["WWW-Authenticate"] = 'Bearer realm="api"'
+    return response
+
+
+def async_endpoint(replica_reads=False, store=False):
+    """
+    GET-only, JWT-authenticated async view. `replica_reads` marks the view
+    for ReplicaRoutingMiddleware, like the attribute on DRF views. With
+    `store`, the request's store is resolved up front, so the view's
+    current_store(request) is a plain attribute read.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method != "GET":
+                response = _json({"detail": f'Method "{request.method}" not allowed.'}, status=405)
+                response["Allow"] = "GET"
+                return response
+            auth = CachedJWTAuthentication()
+            header = auth.get_header(request)
+            raw_token = auth.get_raw_token(header) if header is not None else None
+            if raw_token is None:
+                return _unauthorized("Authentication credentials were not provided.")
+            try:
+                request.user = await auth.aget_user(auth.get_validated_token(raw_token))
+            except AuthenticationFailed as exc:
+                return _unauthorized(exc.detail)
+            if store:
+                try:
+                    await sync_to_async(current_store)(request)
+                except ValidationError as exc:
+                    return _json(exc.detail, status=400)
+            return await view(request, *args, **kwargs)
+
+        wrapper.replica_reads = replica_reads
+        return wrapper
+    return decorator
+
+
+def _release_connections():
+    for connection in connections.all(initialized_only=True):
+        if not connection.in_atomic_block:
+            connection.close()
+
+
+async def _rows(builder, queryset):
+    values = [v async for v in builder.prepare(queryset)]
+    with stage("serialize"):
+        return builder.build(values)
+
+
+@async_endpoint(store=True)
+async def scan(request, barcode):
+    builder = ProductRows(request)
+    values = await builder.prepare(
+        with_stock(Product.objects.filter(barcode=barcode, is_active=True), current_store(request))
+    ).afirst()
+    if values is None:
+        return _json({"error": "Product not found"}, status=404)
+    with stage("serialize"):
+        row = builder.row(values)
+    return _json(row)
+
+
+@async_endpoint(replica_reads=True, store=True)
+async def catalog(request):
+    """
+    The whole active catalog with the store's stock, or with `?since=` every
+    product changed, or whose stock at the store changed, after that time
+    (less SYNC_OVERLAP), deactivated ones included so tills can drop them.
+    Pass the response's `synced_at` as the next `since`.
+    """
+    since = request.GET.get("since")
+    synced_at = timezone.now()
+    store = current_store(request)
+    queryset = with_stock(Product.objects.order_by("id"), store)
+    if since:
+        try:
+            since = parse_datetime(since)
+        except ValueError:
+            since = None
+        if since is None:
+            return _json({"error": "since must be an ISO 8601 datetime"}, status=400)
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        since -= SYNC_OVERLAP
+        restocked = StockLevel.objects.filter(store=store, updated_at__gt=since).values("product")
+        queryset = queryset.filter(Q(updated_at__gt=since) | Q(pk__in=restocked))
+    else:
+        queryset = queryset.filter(is_active=True)
+
+    builder = ProductRows(request)
+    products = await _rows(builder, queryset)
+    return _json({"synced_at": builder.datetime(synced_at), "full": not since, "products": products})
+
+
+@async_endpoint()
+async def customer_lookup(request):
+    """
+    The customer with `?phone=` in any format, or the first customers whose
+    name or number starts with `?q=` (see pos.customers).
+    """
+    phone = request.GET.get("phone", "").strip()
+    term = request.GET.get("q", "").strip()
+    if phone:
+        queryset = Customer.objects.filter(phone_lookup(phone))
+    elif term:
+        queryset = Customer.objects.filter(type_ahead(term))
+    else:
+        return _json({"error": "phone or q is required"}, status=400)
+    results = await _rows(CustomerRows(request), queryset.order_by("name_key", "id")[:LOOKUP_LIMIT])
+    return _json({"results": results})
+
+
+@async_endpoint()
+async def payment_status(request, pk):
+    """
+    The payment in PaymentSerializer's shape plus its order's status. With
+    `?wait=N` a pending payment is re-read every PAYMENT_STATUS_POLL_SECONDS
+    until it settles or N seconds (at most PAYMENT_STATUS_MAX_WAIT) pass, so
+    a till waiting on an M-Pesa callback makes one request instead of many.
+    """
+    try:
+        wait = float(request.GET.get("wait", 0))
+    except ValueError:
+        wait = math.nan
+    if math.isnan(wait):
+        return _json({"error": "wait must be a number of seconds"}, status=400)
+    wait = min(max(wait, 0.0), settings.PAYMENT_STATUS_MAX_WAIT)
+    deadline = time.monotonic() + wait
+    queryset = Payment.objects.filter(pk=pk).values(*OrderRows.payment_values, "order__status")
+
+    while True:
+        values = await queryset.afirst()
+        if values is None:
+            return _json({"error": "Payment not found"}, status=404)
+        remaining = deadline - time.monotonic()
+        if values["status"] != Payment.StatusChoices.PENDING or remaining <= 0:
+            break
+        # Don't hold a database connection while sleeping
+        await sync_to_async(_release_connections)()
+        await asyncio.sleep(min(settings.PAYMENT_STATUS_POLL_SECONDS, remaining))
+
+    with stage("serialize"):
+        row = OrderRows(request).payment(values)
+    row["order_status"] = values["order__status"]
+    return _json(row)
+
+
+@async_endpoint(replica_reads=True, store=True)
+async def dashboard(request):
+    store = current_store(request)
+    today = timezone.now().date()
+    orders = Order.objects.filter(store=store)
+    today_stats = await orders.filter(
+        created_at__date=today, status=Order.StatusChoices.COMPLETED
+    ).aaggregate(total=Sum("total_amount"), count=Count("id"))
+    product_stats = await with_stock(Product.objects.filter(is_active=True), store).aaggregate(
+        total=Count("id"),
+        low_stock=Count("id", filter=Q(stock_quantity__lte=F("low_stock_threshold"))),
+    )
+    recent_orders = await _rows(
+        OrderRows(request, OrderRows.SUMMARY_FIELDS), orders.order_by("-created_at")[:10]
+    )
+    return _json({
+        "today_sales": float(today_stats["total"] or 0),
+        "today_orders": today_stats["count"],
+        "low_stock_count": product_stats["low_stock"],
+        "total_products": product_stats["total"],
+        "recent_orders": recent_orders,
+    })
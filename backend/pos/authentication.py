@@ -0,0 +1,121 @@
+"""
+JWT authentication without the per-request user query.
+
+simplejwt's JWTAuthentication loads the User row on every call. Tills make
+several calls per scan, so CachedJWTAuthentication keeps the users it has
+resolved in a small per-process cache for AUTH_USER_CACHE_SECONDS. Saving or
+deleting a user (deactivation, password change, group changes) evicts the
+entry at once and again on commit; other processes pick the change up when
+their entry expires, so keep the timeout short.
+"""
+
+import copy
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+class UserCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        # Bumped on every eviction so a load that raced a write isn't stored
+        self.generation = 0
+
+    def get(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is None or entry[1] < time.monotonic():
+            return None
+        return entry[0]
+
+    def set(self, user_id, user, generation):
+        timeout = getattr(settings, "AUTH_USER_CACHE_SECONDS", 30)
+        with self._lock:
+            if generation == self.generation:
+                self._entries[user_id] = (user, time.monotonic() + timeout)
+
+    def evict(self, user_id):
+        with self._lock:
+            self.generation += 1
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+
+users = UserCache()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        user_id = self.user_id(validated_token)
+        user = users.get(user_id)
+        if user is None:
+            generation = users.generation
+            user = super().get_user(validated_token)
+            users.set(user_id, user, generation)
+            return copy.copy(user)
+        return self.cached_user(validated_token, user)
+
+    async def aget_user(self, validated_token):
+        """get_user for async views: only a cache miss goes to the database, on a thread."""
+        user = users.get(self.user_id(validated_token))
+        if user is None:
+            return await sync_to_async(self.get_user)(validated_token)
+        return self.cached_user(validated_token, user)
+
+    def user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+    def cached_user(self, validated_token, user):
+        if api_settings.CHECK_REVOKE_TOKEN and (
+            validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password)
+        ):
+            raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        # Views get their own instance: the cached one is shared between threads
+        return copy.copy(user)
+
+
+def _evict(user_id):
+    def evict():
+        users.evict(user_id)
+
+    evict()
+    transaction.on_commit(evict)
+
+
+def _evict_on_change(sender, instance, **kwargs):
+    _evict(getattr(instance, api_settings.USER_ID_FIELD))
+
+
+def _evict_on_m2m_change(sender, instance, **kwargs):
+    # user.groups.add(...) passes the user, group.user_set.add(...) the group
+    if isinstance(instance, get_user_model()):
+        _evict(getattr(instance, api_settings.USER_ID_FIELD))
+    else:
+        users.clear()
+
+
+def connect_user_signals():
+    User = get_user_model()
+    post_save.connect(_evict_on_change, sender=User, dispatch_uid="auth-cache-save")
+    post_delete.connect(_evict_on_change, sender=User, dispatch_uid="auth-cache-delete")
+    for field in ("groups", "user_permissions"):
+        through = getattr(User, field, None)
+        if through is not None:
+            m2m_changed.connect(_evict_on_m2m_change, sender=through.through, dispatch_uid=f"auth-cache-{field}")
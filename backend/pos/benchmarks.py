@@ -0,0 +1,125 @@
+"""
+Helpers shared by the bench_* management commands.
+
+Every benchmark runs against a throwaway database created from the active
+DATABASES profile (the same way the test runner does it), so the numbers for
+SQLite and PostgreSQL come from running the same command under
+DB_ENGINE=sqlite and DB_ENGINE=postgres.
+"""
+
+import os
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+
+from .models import Category, Product
+from .stock import set_levels
+from .stores import get_store
+
+
+@contextmanager
+def scratch_database(verbosity=0):
+    """
+    Create an empty, migrated copy of the default database and tear it down
+    afterwards. SQLite gets an on-disk file rather than the test runner's
+    in-memory default so journaling and locking behave like production.
+    """
+    settings.DEBUG = False  # don't keep every query in connection.queries
+    old_name = connection.settings_dict["NAME"]
+    tmpdir = None
+    if connection.vendor == "sqlite":
+        tmpdir = tempfile.mkdtemp(prefix="mangunas-bench-")
+        connection.settings_dict.setdefault("TEST", {})["NAME"] = os.path.join(tmpdir, "bench.sqlite3")
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        if tmpdir:
+            os.rmdir(tmpdir)
+
+
+def seed_catalog(products=500, stock=1_000_000):
+    """Bulk-create a catalog large enough that checkouts never run out of stock."""
+    cashier = User.objects.create_user("bench-cashier", password="bench")
+    categories = Category.objects.bulk_create(
+        [Category(name=f"Bench category {i}") for i in range(20)]
+    )
+    Product.objects.bulk_create([
+        Product(
+            name=f"Bench product {i:06d}",
+            barcode=f"BENCH{i:08d}",
+            category=categories[i % len(categories)],
+            price=Decimal(50 + i % 500),
+            cost_price=Decimal(30 + i % 400),
+        )
+        for i in range(products)
+    ])
+    catalog = list(Product.objects.values_list("id", "price"))
+    set_levels(get_store(settings.DEFAULT_STORE), {pk: stock for pk, _ in catalog})
+    return cashier, catalog
+
+
+def basket(catalog, size, offset=0):
+    """Deterministic basket of `size` distinct lines from the seeded catalog."""
+    lines = []
+    for n in range(size):
+        product_id, price = catalog[(offset * 7 + n * 13) % len(catalog)]
+        lines.append({"product": product_id, "quantity": 1 + n % 3, "unit_price": str(price), "discount": "0"})
+    return lines
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def summarize(samples, wall_time=None):
+    """Latency percentiles (ms) and throughput for a list of per-call durations (s)."""
+    ordered = sorted(samples)
+    count = len(ordered)
+    wall_time = wall_time if wall_time is not None else sum(ordered)
+
+    def pct(p):
+        return round(ordered[min(count - 1, int(p * count))] * 1000, 3)
+
+    return {
+        "count": count,
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+        "throughput_per_s": round(count / wall_time, 2) if wall_time else None,
+    }
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Line up two {scale: {scenario: summary}} result sets. A scenario has
+    regressed when its p95 is more than `tolerance` (a fraction) above the
+    baseline's. Returns one row per scenario present in both.
+    """
+    rows = []
+    for scale, scenarios in results.items():
+        for name, current in scenarios.items():
+            before = baseline.get(scale, {}).get(name)
+            if not before or not before.get("p95_ms") or "p95_ms" not in current:
+                continue
+            change = current["p95_ms"] / before["p95_ms"] - 1
+            rows.append({
+                "scale": scale,
+                "scenario": name,
+                "baseline_p95_ms": before["p95_ms"],
+                "p95_ms": current["p95_ms"],
+                "change": round(change, 3),
+                "regressed": change > tolerance,
+            })
+    return rows
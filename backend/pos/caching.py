@@ -0,0 +1,97 @@
+"""
+Versioned response cache for catalog and reference endpoints.
+
+Every cached model has a data version in the cache. Saves and deletes bump it
+through signals; set-based writes (queryset.update, bulk_create) call
+bump_version() themselves. Cached responses are keyed on the endpoint, its
+query parameters, the store and the current versions of every model the
+response is built from, so a write makes the old entries unreachable at
+once — no TTL guessing — and untouched entries keep being served without
+touching the ORM.
+
+Versions are bumped twice: immediately, so nothing cached before the write
+is served inside the writing transaction, and again on commit, so nothing a
+concurrent reader cached from pre-commit data outlives the commit.
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from rest_framework.response import Response
+
+VERSION_KEY = "dataver:{}"
+
+
+def _version_key(model):
+    return VERSION_KEY.format(model._meta.label_lower)
+
+
+def data_version(*models):
+    keys = [_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, time.time_ns(), None)
+        versions.update(cache.get_many(missing))
+    return ".".join(str(versions.get(key, 0)) for key in keys)
+
+
+def bump_version(*models, using=None):
+    def bump():
+        cache.set_many({_version_key(model): time.time_ns() for model in models}, None)
+
+    bump()
+    transaction.on_commit(bump, using=using)
+
+
+def response_cache_key(request, models):
+    params = sorted((k, sorted(v)) for k, v in request.query_params.lists())
+    # Stock levels differ per store (pos.stores)
+    store = request.headers.get("X-Store", "")
+    raw = f"{request.get_host()}|{request.path}|{params}|{store}|{data_version(*models)}"
+    return "resp:" + hashlib.sha1(raw.encode()).hexdigest()
+
+
+class CachedResponseMixin:
+    """
+    Serve `list` and `retrieve` from the response cache. Views declare every
+    model their representation reads from in `cache_models`.
+    """
+    cache_models = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        # Read the data versions before the ORM so a racing write can only
+        # make this entry unreachable, never stale
+        key = response_cache_key(request, self.cache_models)
+        data = cache.get(key)
+        if data is not None:
+            response = Response(data)
+            response["X-Cache"] = "HIT"
+            return response
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.RESPONSE_CACHE_TIMEOUT)
+        response["X-Cache"] = "MISS"
+        return response
+
+
+def _bump_on_change(sender, using=None, **kwargs):
+    bump_version(sender, using=using)
+
+
+def connect_signals(*models):
+    for model in models:
+        post_save.connect(_bump_on_change, sender=model, dispatch_uid=f"caching-save-{model._meta.label_lower}")
+        post_delete.connect(_bump_on_change, sender=model, dispatch_uid=f"caching-delete-{model._meta.label_lower}")
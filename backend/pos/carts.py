@@ -0,0 +1,247 @@
+"""
+Server-side carts.
+
+A cart lives in the cache while the till is scanning and is written through
+to its Cart row on every change, so a cache eviction or a restarted worker
+loses nothing. Lines are keyed by product and carry the price captured when
+the product was scanned; the cart keeps a running subtotal, so adding,
+changing or removing a line adjusts the totals by that line's difference
+instead of re-summing the basket.
+
+Promotions and tax are applied per line as it changes (pos.pricing), so
+the running totals already include them.
+
+Checkout turns the already-priced lines into an order at the cart's store
+in one transaction: one bulk_create of items, one set-based stock deduction
+(pos.stock) and the totals copied from the cart.
+"""
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import TAX_RATES, VAT_RATE, Cart, Order, OrderItem, Product
+from .pricing import get_engine
+from .rows import money
+from .stock import deduct_stock
+
+CART_KEY = "cart:{}"
+
+
+class CartError(Exception):
+    """Raised when a cart operation can't be applied."""
+
+
+class CartConflict(CartError):
+    """The cart was changed or checked out by another request."""
+
+
+def _key(cart_id):
+    return CART_KEY.format(cart_id)
+
+
+def _cache(cart):
+    cache.set(_key(cart.pk), cart, getattr(settings, "CART_CACHE_TIMEOUT", 8 * 60 * 60))
+
+
+def _net_unit_price(line):
+    unit_price = Decimal(line["unit_price"])
+    discount = Decimal(line["discount"])
+    return unit_price * (1 - discount / 100) if discount else unit_price
+
+
+def line_total(line):
+    return _net_unit_price(line) * line["quantity"] - Decimal(line.get("promotion_discount", "0"))
+
+
+def line_tax(line):
+    return line_total(line) * Decimal(line.get("tax_rate", str(VAT_RATE)))
+
+
+def _price(line):
+    """Apply the best running promotion to a line for its current quantity."""
+    priced = get_engine().price_line(
+        line["product"], line.get("category"), line["quantity"], _net_unit_price(line),
+        Decimal(line.get("tax_rate", str(VAT_RATE))),
+    )
+    return {**line, "promotion": priced.promotion, "promotion_discount": str(priced.promotion_discount)}
+
+
+def totals(cart):
+    subtotal, tax = cart.subtotal, cart.tax_amount
+    return subtotal, tax, subtotal + tax - cart.discount_amount
+
+
+def open_cart(user, store, customer=None, discount_amount=Decimal("0")):
+    cart = Cart.objects.create(
+        store=store, cashier=user, customer=customer, discount_amount=discount_amount,
+        subtotal=Decimal("0"), tax_amount=Decimal("0"),
+    )
+    _cache(cart)
+    return cart
+
+
+def get_cart(cart_id, user):
+    """The user's cart from the cache, falling back to the database. None if there's no such cart."""
+    cart = cache.get(_key(cart_id))
+    if cart is None:
+        cart = Cart.objects.filter(pk=cart_id).first()
+        if cart is None:
+            return None
+        _cache(cart)
+    if cart.cashier_id != user.id and not user.is_staff:
+        return None
+    return cart
+
+
+def _save(cart, **changes):
+    """Write-through with an optimistic version check against concurrent edits."""
+    updated = Cart.objects.filter(pk=cart.pk, version=cart.version).update(
+        version=cart.version + 1, updated_at=timezone.now(), **changes
+    )
+    if not updated:
+        cache.delete(_key(cart.pk))
+        raise CartConflict("Cart was changed or checked out in another request, reload it")
+    cart.version += 1
+    _cache(cart)
+    return cart
+
+
+def _set_line(cart, product_id, line):
+    """Replace (or with line=None remove) a product's line, adjusting the totals by the difference."""
+    key = str(product_id)
+    previous = cart.lines.get(key)
+    if previous is not None:
+        cart.subtotal -= line_total(previous)
+        cart.tax_amount -= line_tax(previous)
+    if line is None:
+        cart.lines.pop(key, None)
+    else:
+        line = cart.lines[key] = _price(line)
+        cart.subtotal += line_total(line)
+        cart.tax_amount += line_tax(line)
+    return _save(cart, lines=cart.lines, subtotal=cart.subtotal, tax_amount=cart.tax_amount)
+
+
+def add_item(cart, quantity=1, product_id=None, barcode=None):
+    """Scan `quantity` of a product into the cart. The price is captured the first time it's scanned."""
+    line = cart.lines.get(str(product_id)) if product_id is not None else None
+    if line is None:
+        products = Product.objects.filter(is_active=True)
+        products = products.filter(pk=product_id) if product_id is not None else products.filter(barcode=barcode)
+        product = products.values("id", "name", "price", "category_id", "tax_class").first()
+        if product is None:
+            raise CartError("Product not found")
+        product_id = product["id"]
+        line = cart.lines.get(str(product_id)) or {
+            "product": product_id,
+            "name": product["name"],
+            "quantity": 0,
+            "unit_price": str(product["price"]),
+            "discount": "0",
+            "category": product["category_id"],
+            "tax_rate": str(TAX_RATES[product["tax_class"]]),
+        }
+    _set_line(cart, product_id, {**line, "quantity": line["quantity"] + quantity})
+    return cart.lines[str(product_id)]
+
+
+def set_quantity(cart, product_id, quantity, discount=None):
+    line = cart.lines.get(str(product_id))
+    if line is None:
+        raise CartError("Product is not in the cart")
+    if quantity == 0:
+        _set_line(cart, product_id, None)
+        return None
+    line = {**line, "quantity": quantity}
+    if discount is not None:
+        line["discount"] = str(discount)
+    _set_line(cart, product_id, line)
+    return cart.lines[str(product_id)]
+
+
+def remove_item(cart, product_id):
+    if str(product_id) not in cart.lines:
+        raise CartError("Product is not in the cart")
+    _set_line(cart, product_id, None)
+
+
+def update_cart(cart, **changes):
+    """Set the customer and/or order-level discount."""
+    if "customer" in changes:
+        cart.customer = changes.pop("customer")
+        changes["customer_id"] = cart.customer_id
+    if "discount_amount" in changes:
+        cart.discount_amount = changes["discount_amount"]
+    return _save(cart, **changes)
+
+
+def discard_cart(cart):
+    Cart.objects.filter(pk=cart.pk).delete()
+    cache.delete(_key(cart.pk))
+
+
+@transaction.atomic
+def checkout(cart, user):
+    """Commit the cart's priced lines as a pending order and close the cart."""
+    # The row is the source of truth here: locking it stops a double checkout
+    cart = Cart.objects.select_for_update().filter(pk=cart.pk).first()
+    if cart is None:
+        raise CartConflict("Cart was already checked out")
+    if not cart.lines:
+        raise CartError("Cart is empty")
+
+    subtotal, tax, total = totals(cart)
+    order = Order.objects.create(
+        store_id=cart.store_id, cashier=user, customer_id=cart.customer_id, discount_amount=cart.discount_amount,
+        subtotal=subtotal, tax_amount=tax, total_amount=total,
+    )
+    items = OrderItem.objects.bulk_create([
+        OrderItem(
+            order=order, product_id=line["product"], quantity=line["quantity"],
+            unit_price=Decimal(line["unit_price"]), discount=Decimal(line["discount"]),
+            promotion_id=line.get("promotion"), promotion_discount=Decimal(line.get("promotion_discount", "0")),
+            tax_rate=Decimal(line.get("tax_rate", str(VAT_RATE))),
+        )
+        for line in cart.lines.values()
+    ])
+    deduct_stock(order, items, user)
+
+    key = _key(cart.pk)
+    cart.delete()
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+    return order
+
+
+def line_data(line):
+    return {
+        "product": line["product"],
+        "name": line["name"],
+        "quantity": line["quantity"],
+        "unit_price": money(Decimal(line["unit_price"])),
+        "discount": money(Decimal(line["discount"])),
+        "promotion": line.get("promotion"),
+        "promotion_discount": money(Decimal(line.get("promotion_discount", "0"))),
+        "total_price": money(line_total(line)),
+    }
+
+
+def totals_data(cart):
+    subtotal, tax, total = totals(cart)
+    return {
+        "id": str(cart.pk),
+        "customer": cart.customer_id,
+        "item_count": len(cart.lines),
+        "discount_amount": money(cart.discount_amount),
+        "subtotal": money(subtotal),
+        "tax_amount": money(tax),
+        "total_amount": money(total),
+    }
+
+
+def cart_data(cart):
+    return {**totals_data(cart), "lines": [line_data(line) for line in cart.lines.values()]}
@@ -0,0 +1,56 @@
+"""
+Customer lookup keys.
+
+Cashiers type phone numbers as 0712 345 678, +254712345678 or 254712345678;
+customers are looked up by a normalized copy of the number (254712345678)
+and a normalized copy of the name (lowercase, no accents, single spaces),
+both indexed and kept up to date by Customer.save(). A till lookup by phone
+is one index hit whatever format was typed, and type-ahead is a prefix
+range on one of the two indexes.
+"""
+
+import re
+import unicodedata
+
+from django.db.models import Q
+
+from .db import startswith
+
+COUNTRY_CODE = "254"
+NON_DIGITS = re.compile(r"\D")
+
+
+def normalize_phone(phone):
+    """
+    "0712 345 678", "+254-712-345678" and "712345678" all become
+    "254712345678". Works on a prefix as well: "07" becomes "2547".
+    Returns "" when there are no digits.
+    """
+    digits = NON_DIGITS.sub("", str(phone or ""))
+    if digits.startswith("0"):
+        return COUNTRY_CODE + digits[1:]
+    if len(digits) == 9 and digits[0] in "17":
+        return COUNTRY_CODE + digits
+    return digits
+
+
+def name_key(name):
+    decomposed = unicodedata.normalize("NFKD", name or "")
+    plain = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(plain.lower().split())
+
+
+def phone_lookup(phone):
+    """Q matching customers with this phone number, in any format."""
+    digits = normalize_phone(phone)
+    return Q(phone_normalized=digits) if digits else Q(pk__in=[])
+
+
+def type_ahead(term, using="default"):
+    """Q matching customers whose name, or phone number, starts with `term`."""
+    query = startswith("name_key", name_key(term), using)
+    digits = normalize_phone(term)
+    # Only terms that look like a number search phones: "Anne 2" shouldn't match every 2547...
+    if digits and not re.search(r"[^\d\s+()-]", term):
+        query |= startswith("phone_normalized", digits, using)
+    return query
@@ -0,0 +1,124 @@
+"""
+Database helpers shared by views, jobs and management commands.
+"""
+
+from django.db import connections, transaction
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.constants import OnConflict
+
+STREAM_CHUNK_SIZE = 2000
+
+
+def stream(queryset, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Iterate over a large queryset without loading it into memory.
+
+    On PostgreSQL `.iterator()` uses a server-side cursor. Those only survive
+    for the length of a transaction when connections go through pgbouncer in
+    transaction mode, so the whole iteration is wrapped in one. SQLite reads
+    stay in autocommit: a transaction there would be BEGIN IMMEDIATE under
+    the tuned backend and block the tills for the length of the scan.
+    """
+    if vendor(queryset.db) != "postgresql":
+        yield from queryset.iterator(chunk_size=chunk_size)
+        return
+    with transaction.atomic(using=queryset.db):
+        yield from queryset.iterator(chunk_size=chunk_size)
+
+
+def vendor(using="default"):
+    return connections[using].vendor
+
+
+def startswith(field, prefix, using="default"):
+    """
+    Q(<field> starts with `prefix`) that a plain index on the field serves.
+    PostgreSQL's LIKE 'x%' uses the varchar_pattern_ops index Django adds for
+    db_index=True; SQLite only uses an index for LIKE on NOCASE columns, so
+    there it's the equivalent range, which compares code points like LIKE.
+    """
+    if vendor(using) == "postgresql":
+        return Q(**{f"{field}__startswith": prefix})
+    return Q(**{f"{field}__gte": prefix, f"{field}__lt": prefix + "\U0010ffff"})
+
+
+def case_by_pk(mapping, output_field=None):
+    """
+    CASE WHEN pk=<k> THEN <v> ... END, for applying a different increment to
+    every row of a set-based UPDATE, e.g.
+    StockLevel.objects.filter(id__in=qty).update(quantity=F("quantity") + case_by_pk(qty))
+    Integers unless `output_field` says otherwise.
+    """
+    return Case(
+        *[When(pk=pk, then=Value(value)) for pk, value in mapping.items()],
+        default=Value(0),
+        output_field=output_field or IntegerField(),
+    )
+
+
+def insert_rows(model, fields, rows, using="default", unique_fields=None, update_fields=None):
+    """
+    Multi-row INSERT of plain tuples, one value per name in `fields`, for
+    loads where building model instances for bulk_create costs more than the
+    database does. No signals, no defaults: every NOT NULL column without a
+    database default has to be listed. Values the drivers can't take as they
+    are (aware datetimes on SQLite, JSON, ...) are prepared by their fields,
+    so they're stored as the ORM would store them. With `update_fields`, a
+    row that conflicts on `unique_fields` updates those columns of the
+    existing row instead, like bulk_create(update_conflicts=True).
+    """
+    connection = connections[using]
+    fields = [model._meta.get_field(name) for name in fields]
+    columns = ", ".join(connection.ops.quote_name(field.column) for field in fields)
+    table = connection.ops.quote_name(model._meta.db_table)
+    suffix = ""
+    if update_fields:
+        suffix = " " + connection.ops.on_conflict_suffix_sql(
+            fields, OnConflict.UPDATE,
+            [model._meta.get_field(name).column for name in update_fields],
+            [model._meta.get_field(name).column for name in unique_fields],
+        )
+    placeholder = "(" + ", ".join(["%s"] * len(fields)) + ")"
+    batch = connection.ops.bulk_batch_size(fields, rows) or len(rows)
+    prepare = [(index, field) for index, field in enumerate(fields) if field.get_internal_type() in (
+        "DateTimeField", "DateField", "TimeField", "UUIDField", "JSONField",
+    )]
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch):
+            chunk = rows[start:start + batch]
+            params = []
+            for row in chunk:
+                if prepare:
+                    row = list(row)
+                    for index, field in prepare:
+                        row[index] = field.get_db_prep_save(row[index], connection)
+                params.extend(row)
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) VALUES {', '.join([placeholder] * len(chunk))}{suffix}", params
+            )
+
+
+def insert_select(model, fields, queryset, using="default"):
+    """
+    INSERT INTO <model> (<fields>) SELECT ..., for copying rows the database
+    can compute itself without fetching them. `queryset` must be a values()
+    query selecting one column per name in `fields`, in that order. Returns
+    the number of rows inserted.
+    """
+    connection = connections[using]
+    columns = ", ".join(connection.ops.quote_name(model._meta.get_field(name).column) for name in fields)
+    sql, params = queryset.query.get_compiler(using).as_sql()
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {connection.ops.quote_name(model._meta.db_table)} ({columns}) {sql}", params)
+        return cursor.rowcount
+
+
+def delete_rows(queryset):
+    """
+    DELETE ... WHERE, without the collector: no instances fetched, no
+    signals, no cascades or SET NULLs. For set-based moves whose caller has
+    already dealt with every row referencing the deleted ones. Returns the
+    number of rows deleted.
+    """
+    return queryset._raw_delete(queryset.db)
@@ -0,0 +1,131 @@
+"""
+Product image pipeline.
+
+Uploaded originals are stored content-addressed, under
+products/<first two hex digits>/<sha256>.<ext>, so the same picture uploaded
+twice (or re-seeded) is kept once. Saving a new image queues a job (on the
+"images" queue, see pos.jobs) that renders WebP thumbnails for every size in
+PRODUCT_IMAGE_SIZES next to the original as <sha256>-<size>.webp, and the
+product's `image_sizes` records which are ready. Because a file's name is
+its content hash, anything under these names can be cached by browsers and
+proxies forever (serve_media adds the headers in development; see the
+README for nginx).
+
+Rendering works on local files, so it expects a FileSystemStorage.
+"""
+
+import hashlib
+import os
+import re
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db.models.signals import post_init, post_save
+from django.utils.deconstruct import deconstructible
+from django.views.static import serve
+
+from .jobs import task
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+CONTENT_ADDRESSED = re.compile(r"(^|/)[0-9a-f]{64}(-\d+\.webp|\.\w+)$")
+
+
+def image_sizes():
+    return tuple(getattr(settings, "PRODUCT_IMAGE_SIZES", (64, 160, 320, 640)))
+
+
+def thumbnail_name(name, size):
+    return f"{os.path.splitext(name)[0]}-{size}.webp"
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage that names files after the SHA-256 of their content."""
+
+    def save(self, name, content, max_length=None):
+        digest = hashlib.sha256()
+        if hasattr(content, "seek"):
+            content.seek(0)
+        for chunk in content.chunks() if hasattr(content, "chunks") else iter(lambda: content.read(65536), b""):
+            digest.update(chunk)
+        if hasattr(content, "seek"):
+            content.seek(0)
+
+        digest = digest.hexdigest()
+        directory = os.path.dirname(name)
+        ext = os.path.splitext(name)[1].lower()
+        name = os.path.join(directory, digest[:2], digest + ext).replace("\\", "/")
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
+
+
+def render_thumbnails(path, sizes):
+    """
+    Write a WebP thumbnail of the image at `path` for each size (longest
+    edge, never upscaled). Only touches the filesystem, so process_images can
+    run it in a process pool. Returns the sizes it wrote.
+    """
+    from PIL import Image, ImageOps
+
+    done = []
+    with Image.open(path) as original:
+        original = ImageOps.exif_transpose(original)
+        if original.mode not in ("RGB", "RGBA"):
+            original = original.convert("RGBA" if "transparency" in original.info else "RGB")
+        for size in sizes:
+            target = thumbnail_name(path, size)
+            if not os.path.exists(target):
+                image = original.copy()
+                image.thumbnail((size, size), Image.LANCZOS)
+                tmp = f"{target}.{os.getpid()}.tmp"
+                image.save(tmp, "WEBP", quality=80, method=4)
+                os.replace(tmp, target)  # readers never see a half-written file
+            done.append(size)
+    return done
+
+
+@task(queue="images", max_attempts=3, timeout=600)
+def render_product_thumbnails(name):
+    """Render thumbnails for the stored image `name` and record them on its products."""
+    from .caching import bump_version
+    from .models import Product
+
+    storage = Product._meta.get_field("image").storage
+    sizes = render_thumbnails(storage.path(name), image_sizes())
+    Product.objects.filter(image=name).update(image_sizes=sizes)
+    bump_version(Product)
+
+
+def _remember_image(sender, instance, **kwargs):
+    # Read the raw attribute: touching a deferred field would cost a query
+    image = instance.__dict__.get("image")
+    instance._stored_image = getattr(image, "name", image) or None
+
+
+def _image_saved(sender, instance, raw=False, **kwargs):
+    name = instance.image.name or None
+    if raw or name == getattr(instance, "_stored_image", None):
+        return
+    instance._stored_image = name
+    if instance.image_sizes:
+        # The old thumbnails belong to the old image
+        instance.image_sizes = []
+        sender.objects.filter(pk=instance.pk).update(image_sizes=[])
+    if name:
+        render_product_thumbnails.delay(name=name)
+
+
+def connect_image_signals():
+    from .models import Product
+
+    post_init.connect(_remember_image, sender=Product, dispatch_uid="images-init")
+    post_save.connect(_image_saved, sender=Product, dispatch_uid="images-save")
+
+
+def serve_media(request, path, document_root=None, show_indexes=False):
+    """django.views.static.serve plus far-future caching for content-addressed files."""
+    response = serve(request, path, document_root=document_root, show_indexes=show_indexes)
+    if CONTENT_ADDRESSED.search(path):
+        response["Cache-Control"] = IMMUTABLE
+    return response
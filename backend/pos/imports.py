@@ -0,0 +1,314 @@
+"""
+Bulk product import: supplier catalogs and price files.
+
+A CSV or XLSX file with a header row is read a row at a time and applied in
+batches of IMPORT_BATCH rows, each in its own transaction: one query for
+the batch's existing products, one for its categories, one INSERT ... ON
+CONFLICT (barcode) DO UPDATE of the columns the file has, and a read and one
+upsert of stock levels when it has a stock_quantity column. Products are matched by
+barcode; a file only needs the columns it changes, and an empty cell leaves
+that value as it is. New products need a name and a price.
+
+Rows that don't validate are skipped and reported with their line number;
+the rest of their batch is applied. Rows that change nothing, stock level
+included, aren't written, so re-importing a price file only touches the
+prices that moved. A file that can't be read stops the import at that row:
+the batches before it stay imported.
+
+XLSX needs openpyxl; CSV has no extra dependency.
+"""
+
+import csv
+import io
+import os
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .caching import bump_version
+from .db import insert_rows
+from .models import Category, Product, StockLevel
+from .stock import set_levels
+
+COLUMNS = (
+    "barcode", "name", "category", "price", "cost_price", "low_stock_threshold", "tax_class", "is_active",
+    "stock_quantity",
+)
+PRODUCT_FIELDS = ("name", "category", "price", "cost_price", "low_stock_threshold", "tax_class", "is_active")
+DEFAULTS = {name: Product._meta.get_field(name).get_default() for name in PRODUCT_FIELDS}
+NEW_PRODUCT_REQUIRES = ("name", "price")
+MAX_ERRORS = 1000  # reported; every failing row is still counted
+CENTS = Decimal("0.01")
+MAX_MONEY = Decimal("99999999.99")  # DecimalField(max_digits=10, decimal_places=2)
+MIN_INTEGER, MAX_INTEGER = -2147483648, 2147483647  # IntegerField
+TRUE, FALSE = {"1", "true", "yes", "y"}, {"0", "false", "no", "n"}
+TAX_CLASSES = {
+    **{value: value for value in Product.TaxClass.values},
+    **{label.lower(): value for value, label in Product.TaxClass.choices},
+    "zero rated": Product.TaxClass.ZERO_RATED, "zero-rated": Product.TaxClass.ZERO_RATED,
+}
+
+
+class CatalogImportError(Exception):
+    """Raised when a file can't be imported at all (as opposed to a bad row)."""
+
+
+# ─── Reading ──────────────────────────────────────────────────────────────────
+
+def read_rows(file, name):
+    """
+    Header names and then one tuple per row of the uploaded `file` (a binary
+    file object), streamed rather than loaded whole.
+    """
+    extension = os.path.splitext(name)[1].lower()
+    if extension in (".csv", ".txt"):
+        return _csv_rows(file)
+    if extension == ".xlsx":
+        return _xlsx_rows(file)
+    raise CatalogImportError(f"Unsupported file type {extension or name!r}: upload CSV or XLSX")
+
+
+def _csv_rows(file):
+    reader = csv.reader(io.TextIOWrapper(file, encoding="utf-8-sig", newline=""))
+    try:
+        yield from reader
+    except UnicodeDecodeError:
+        raise CatalogImportError("The file isn't UTF-8 text: save it as CSV UTF-8") from None
+    except csv.Error as exc:
+        raise CatalogImportError(f"Row {reader.line_num}: {exc}") from None
+
+
+def _xlsx_rows(file):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise CatalogImportError("XLSX import needs openpyxl installed; upload CSV instead") from None
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def _header(row):
+    names = [str(cell or "").strip().lower().replace(" ", "_") for cell in row]
+    unknown = [name for name in names if name and name not in COLUMNS]
+    if unknown:
+        raise CatalogImportError(f"Unknown column(s): {', '.join(unknown)}. Columns: {', '.join(COLUMNS)}")
+    if "barcode" not in names:
+        raise CatalogImportError("The file needs a barcode column")
+    return names
+
+
+# ─── Validation ───────────────────────────────────────────────────────────────
+
+def _text(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)  # spreadsheets store barcodes as numbers
+    return "" if value is None else str(value).strip()
+
+
+def _number(value):
+    try:
+        number = Decimal(_text(value).replace(",", ""))
+    except InvalidOperation:
+        number = None
+    if number is None or not number.is_finite():
+        raise ValueError("A valid number is required.")
+    return number
+
+
+def _money(value):
+    amount = _number(value)
+    if not 0 <= amount <= MAX_MONEY:
+        raise ValueError(f"Must be between 0 and {MAX_MONEY}.")
+    return amount.quantize(CENTS)
+
+
+def _integer(value):
+    try:
+        number = _number(value)
+    except ValueError:
+        number = None
+    if number is None or number != number.to_integral_value():
+        raise ValueError("A valid integer is required.")
+    if not MIN_INTEGER <= number <= MAX_INTEGER:
+        raise ValueError(f"Must be between {MIN_INTEGER} and {MAX_INTEGER}.")
+    return int(number)
+
+
+def _boolean(value):
+    text = _text(value).lower()
+    if text in TRUE or value is True:
+        return True
+    if text in FALSE or value is False:
+        return False
+    raise ValueError("Must be true or false.")
+
+
+def _tax_class(value):
+    try:
+        return TAX_CLASSES[_text(value).lower()]
+    except KeyError:
+        raise ValueError(f"Must be one of {', '.join(Product.TaxClass.values)}.") from None
+
+
+def _limited(length):
+    def parse(value):
+        text = _text(value)
+        if len(text) > length:
+            raise ValueError(f"Ensure this field has no more than {length} characters.")
+        return text
+    return parse
+
+
+PARSERS = {
+    "barcode": _limited(Product._meta.get_field("barcode").max_length),
+    "name": _limited(Product._meta.get_field("name").max_length),
+    "category": _limited(Category._meta.get_field("name").max_length),
+    "price": _money,
+    "cost_price": _money,
+    "low_stock_threshold": _integer,
+    "tax_class": _tax_class,
+    "is_active": _boolean,
+    "stock_quantity": _integer,
+}
+
+
+def parse_row(names, row):
+    """({column: value} for the row's non-empty cells, {column: [error]})."""
+    values, errors = {}, {}
+    for name, cell in zip(names, row):
+        if not name or cell is None or (isinstance(cell, str) and not cell.strip()):
+            continue
+        try:
+            values[name] = PARSERS[name](cell)
+        except ValueError as exc:
+            errors[name] = [str(exc)]
+    if "barcode" not in values and "barcode" not in errors:
+        errors["barcode"] = ["This field is required."]
+    return values, errors
+
+
+# ─── Applying ─────────────────────────────────────────────────────────────────
+
+class ProductImport:
+    """
+    One import into `store` (stock levels go there). Feed it rows with
+    run(); `report` has the counts and the first MAX_ERRORS row errors.
+    """
+
+    def __init__(self, store, batch_size=None):
+        self.store = store
+        self.batch_size = batch_size or settings.IMPORT_BATCH
+        self.seen = {}  # barcode -> line, for duplicates
+        self.report = {"rows": 0, "created": 0, "updated": 0, "unchanged": 0, "failed": 0, "errors": []}
+
+    def error(self, line, errors, barcode=None):
+        self.report["failed"] += 1
+        if len(self.report["errors"]) < MAX_ERRORS:
+            self.report["errors"].append({"row": line, "barcode": barcode, "errors": errors})
+
+    def run(self, rows):
+        rows = iter(rows)
+        names = _header(next(rows, ()))
+        # Columns written on conflict; updated_at so tills' catalog syncs pick the changes up
+        self.fields = [
+            name for name in dict.fromkeys(names) if name and name not in ("barcode", "stock_quantity")
+        ] + ["updated_at"]
+        batch = []
+        for line, row in enumerate(rows, 2):
+            if not any(cell not in (None, "") for cell in row):
+                continue  # blank line
+            self.report["rows"] += 1
+            values, errors = parse_row(names, row)
+            barcode = values.get("barcode")
+            if barcode in self.seen:
+                errors["barcode"] = [f"Duplicate of row {self.seen[barcode]}."]
+            if errors:
+                self.error(line, errors, barcode)
+                continue
+            self.seen[barcode] = line
+            batch.append((line, values))
+            if len(batch) >= self.batch_size:
+                self.apply(batch)
+                batch = []
+        if batch:
+            self.apply(batch)
+        return self.report
+
+    def categories(self, batch):
+        names = {values["category"] for _, values in batch if "category" in values}
+        if not names:
+            return {}
+        ids = dict(Category.objects.filter(name__in=names).values_list("name", "id"))
+        if len(ids) < len(names):
+            Category.objects.bulk_create([Category(name=name) for name in names - ids.keys()], ignore_conflicts=True)
+            ids = dict(Category.objects.filter(name__in=names).values_list("name", "id"))
+            bump_version(Category)
+        return ids
+
+    def levels(self, batch, existing):
+        """{barcode: quantity} at the store of the batch's existing products that have a stock count."""
+        barcodes = [v["barcode"] for _, v in batch if "stock_quantity" in v and v["barcode"] in existing]
+        if not barcodes:
+            return {}
+        return dict(
+            StockLevel.objects.filter(store=self.store, product__barcode__in=barcodes)
+            .values_list("product__barcode", "quantity")
+        )
+
+    @transaction.atomic
+    def apply(self, batch):
+        existing = {
+            product["barcode"]: product
+            for product in Product.objects.filter(barcode__in=[v["barcode"] for _, v in batch])
+            .values("barcode", *PRODUCT_FIELDS).order_by()
+        }
+        categories = self.categories(batch)
+        levels = self.levels(batch, existing)
+        now = timezone.now()
+        upserts, stock = [], {}
+        for line, values in batch:
+            barcode = values["barcode"]
+            product = existing.get(barcode)
+            changed = product is None
+            if changed:
+                missing = [name for name in NEW_PRODUCT_REQUIRES if name not in values]
+                if missing:
+                    self.error(line, {name: ["Required for a new product."] for name in missing}, barcode)
+                    continue
+                product = dict(DEFAULTS)
+            quantity = values.pop("stock_quantity", None)
+            if quantity is not None and (changed or quantity != levels.get(barcode, 0)):
+                stock[barcode] = quantity
+            if "category" in values:
+                values["category"] = categories[values["category"]]
+            for name, value in values.items():
+                if name != "barcode" and product[name] != value:
+                    product[name] = value
+                    changed = True
+            if not changed and barcode not in stock:
+                self.report["unchanged"] += 1
+                continue
+            self.report["updated" if barcode in existing else "created"] += 1
+            if changed:
+                upserts.append((barcode, *[product[name] for name in PRODUCT_FIELDS], [], now, now))
+
+        if upserts:
+            # Rows whose barcode exists update the file's columns; the rest are inserted whole
+            insert_rows(
+                Product, ["barcode", *PRODUCT_FIELDS, "image_sizes", "created_at", "updated_at"], upserts,
+                unique_fields=["barcode"], update_fields=self.fields,
+            )
+            bump_version(Product)
+        if stock:
+            ids = dict(Product.objects.filter(barcode__in=stock).values_list("barcode", "id"))
+            set_levels(self.store, {ids[barcode]: quantity for barcode, quantity in stock.items()})
+
+
+def import_products(file, name, store, batch_size=None):
+    """Import an uploaded CSV/XLSX catalog into `store`. Returns the report."""
+    return ProductImport(store, batch_size).run(read_rows(file, name))
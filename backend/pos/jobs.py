@@ -0,0 +1,272 @@
+"""
+Background jobs, stored in the project's own database.
+
+    from pos.jobs import task
+
+    @task(queue="payments", max_attempts=3, timeout=60)
+    def send_stk_push(payment_id):
+        ...
+
+    send_stk_push.delay(payment_id=payment.id)
+
+`delay()` inserts a Job row in the caller's transaction, so a job exists
+exactly when the data it refers to does, and returns at once;
+`python manage.py run_workers` runs it. Arguments must be JSON-serializable.
+
+Claiming. Where the database has SELECT ... FOR UPDATE SKIP LOCKED
+(PostgreSQL), a worker locks the next due rows, skipping any another worker
+holds, and leases them in the same transaction: concurrent workers never
+wait on each other. SQLite has no row locks; there a worker reads candidate
+ids and leases them with a conditional UPDATE that re-checks they are still
+due. SQLite's single write lock serializes those updates, and a worker that
+lost a race simply finds fewer rows carrying its claim token.
+
+Leases. A claim holds a job for its `timeout` seconds (the visibility
+timeout). A worker that dies mid-job leaves the lease to expire and the job
+is claimed again, so tasks must be safe to run more than once. A failed
+attempt is retried after an exponential, jittered backoff until
+max_attempts, then the job is marked failed and the task's `on_failure`
+hook runs.
+
+With JOBS_INLINE (the default when DEBUG is on) `delay()` runs the task in
+the calling process once the transaction commits, so development needs no
+worker.
+"""
+
+import importlib
+import logging
+import os
+import random
+import socket
+import threading
+import traceback
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connections, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+# Not `from .models import Job`: pos.models imports pos.images, which declares tasks
+from . import models
+
+logger = logging.getLogger(__name__)
+
+registry = {}
+
+
+class Task:
+    def __init__(self, func, name, queue, max_attempts, timeout, backoff, on_failure):
+        self.func = func
+        self.name = name
+        self.queue = queue
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.backoff = backoff
+        self.on_failure = on_failure
+        self.__doc__ = func.__doc__
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def delay(self, **kwargs):
+        return enqueue(self.name, kwargs)
+
+    def retry_in(self, attempts):
+        """Seconds before the next attempt: exponential, capped, with jitter."""
+        base = settings.JOB_BACKOFF_SECONDS if self.backoff is None else self.backoff
+        return min(base * 2 ** (attempts - 1), settings.JOB_BACKOFF_MAX) * random.uniform(0.5, 1.0)
+
+
+def task(queue="default", max_attempts=5, timeout=300, backoff=None, on_failure=None, name=None):
+    """
+    Register a function as a task. `backoff` is the first retry delay in
+    seconds (JOB_BACKOFF_SECONDS by default); `on_failure(kwargs, error)`
+    runs once the last attempt has failed.
+    """
+    def decorator(func):
+        registered = Task(func, name or f"{func.__module__}.{func.__name__}", queue, max_attempts, timeout,
+                          backoff, on_failure)
+        registry[registered.name] = registered
+        return registered
+    return decorator
+
+
+def get_task(name):
+    if name not in registry:
+        # Tasks register on import; a worker may not have imported the module yet
+        module = name.rpartition(".")[0]
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            return None
+    return registry.get(name)
+
+
+def enqueue(name, kwargs=None, run_at=None, using="default"):
+    registered = get_task(name)
+    if registered is None:
+        raise LookupError(f"Unknown task {name}")
+    kwargs = kwargs or {}
+    if settings.JOBS_INLINE:
+        transaction.on_commit(lambda: run_inline(registered, kwargs), using=using)
+        return None
+    return models.Job.objects.using(using).create(
+        queue=registered.queue, task=name, kwargs=kwargs, run_at=run_at or timezone.now(),
+        max_attempts=registered.max_attempts, timeout=registered.timeout,
+    )
+
+
+def run_inline(registered, kwargs):
+    try:
+        registered.func(**kwargs)
+    except Exception:
+        logger.exception("Task %s failed", registered.name)
+        if registered.on_failure is not None:
+            registered.on_failure(kwargs, traceback.format_exc())
+
+
+def _due(now):
+    return (Q(status=models.Job.StatusChoices.QUEUED, run_at__lte=now)
+            | Q(status=models.Job.StatusChoices.RUNNING, locked_until__lt=now))
+
+
+def claim(worker, queues=None, limit=1):
+    """Lease up to `limit` due jobs for `worker`, oldest first."""
+    now = timezone.now()
+    due = models.Job.objects.filter(_due(now))
+    if queues:
+        due = due.filter(queue__in=queues)
+    due = due.order_by("run_at", "id")
+    token = f"{worker}/{uuid.uuid4().hex[:12]}"
+
+    if connections[due.db].features.has_select_for_update_skip_locked:
+        with transaction.atomic(using=due.db):
+            candidates = list(due.select_for_update(skip_locked=True).values_list("id", "timeout")[:limit])
+            _lease(candidates, token, now)
+    else:
+        _lease(list(due.values_list("id", "timeout")[:limit]), token, now)
+    return list(models.Job.objects.filter(locked_by=token, status=models.Job.StatusChoices.RUNNING).order_by("run_at", "id"))
+
+
+def _lease(candidates, token, now):
+    by_timeout = defaultdict(list)
+    for pk, timeout in candidates:
+        by_timeout[timeout].append(pk)
+    for timeout, ids in by_timeout.items():
+        # The due condition again: on SQLite another worker may have leased them since they were read
+        models.Job.objects.filter(_due(now), pk__in=ids).update(
+            status=models.Job.StatusChoices.RUNNING, locked_by=token, locked_until=now + timedelta(seconds=timeout),
+            attempts=F("attempts") + 1,
+        )
+
+
+def _still_ours(job):
+    return models.Job.objects.filter(pk=job.pk, locked_by=job.locked_by, status=models.Job.StatusChoices.RUNNING)
+
+
+def execute(job):
+    """Run a leased job and record the outcome. Returns True if it succeeded."""
+    registered = get_task(job.task)
+    if registered is None:
+        _fail(job, None, f"Unknown task {job.task}")
+        return False
+    if job.attempts > job.max_attempts:
+        # The lease of the last attempt expired: the worker died running it
+        _fail(job, registered, "Lease expired on the last attempt")
+        return False
+    try:
+        registered.func(**job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            _fail(job, registered, error)
+        else:
+            delay = registered.retry_in(job.attempts)
+            logger.warning("Job %s (%s) failed, attempt %s of %s; retrying in %.0fs",
+                           job.pk, job.task, job.attempts, job.max_attempts, delay)
+            _still_ours(job).update(
+                status=models.Job.StatusChoices.QUEUED, run_at=timezone.now() + timedelta(seconds=delay),
+                locked_by="", locked_until=None, last_error=error,
+            )
+        return False
+    _still_ours(job).update(
+        status=models.Job.StatusChoices.DONE, finished_at=timezone.now(), locked_by="", locked_until=None,
+    )
+    return True
+
+
+def _fail(job, registered, error):
+    logger.error("Job %s (%s) failed for good after %s attempt(s):\n%s", job.pk, job.task, job.attempts, error)
+    updated = _still_ours(job).update(
+        status=models.Job.StatusChoices.FAILED, finished_at=timezone.now(), locked_by="", locked_until=None,
+        last_error=error,
+    )
+    if updated and registered is not None and registered.on_failure is not None:
+        try:
+            registered.on_failure(job.kwargs, error)
+        except Exception:
+            logger.exception("on_failure hook of %s raised", job.task)
+
+
+def release(jobs):
+    """Hand leased jobs that weren't started back to the queue."""
+    for job in jobs:
+        _still_ours(job).update(
+            status=models.Job.StatusChoices.QUEUED, locked_by="", locked_until=None, attempts=F("attempts") - 1,
+        )
+
+
+def prune(days=None):
+    """Delete jobs that finished successfully more than `days` (JOB_RETENTION_DAYS) ago."""
+    days = settings.JOB_RETENTION_DAYS if days is None else days
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted, _ = models.Job.objects.filter(status=models.Job.StatusChoices.DONE, finished_at__lt=cutoff).delete()
+    return deleted
+
+
+def queue_depths():
+    """{(queue, status): count} over everything in the table."""
+    rows = models.Job.objects.order_by().values_list("queue", "status").annotate(n=Count("id"))
+    return {(queue, status): n for queue, status, n in rows}
+
+
+class Worker:
+    """Claims and runs jobs until `stop` is set (or, in burst mode, until nothing is due)."""
+
+    def __init__(self, name=None, queues=None, batch=1, poll=None, stop=None):
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+        self.queues = queues
+        self.batch = batch
+        self.poll = settings.JOB_POLL_SECONDS if poll is None else poll
+        self.stop = stop or threading.Event()
+
+    def run_once(self):
+        """Claim one batch and run it; returns how many jobs were claimed."""
+        close_old_connections()
+        jobs = claim(self.name, self.queues, self.batch)
+        for index, job in enumerate(jobs):
+            if self.stop.is_set():
+                release(jobs[index:])
+                break
+            execute(job)
+        return len(jobs)
+
+    def run(self, burst=False):
+        try:
+            while not self.stop.is_set():
+                try:
+                    claimed = self.run_once()
+                except DatabaseError:
+                    logger.exception("Worker %s lost the database; retrying", self.name)
+                    connections.close_all()
+                    self.stop.wait(self.poll * 5)
+                    continue
+                if not claimed:
+                    if burst:
+                        return
+                    self.stop.wait(self.poll)
+        finally:
+            connections.close_all()
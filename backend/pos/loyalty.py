@@ -0,0 +1,266 @@
+"""
+Loyalty points.
+
+Every change to a customer's points is an entry in an append-only ledger
+(LoyaltyEntry): points earned when an order completes, spent when they are
+tendered as a payment, taken back when goods are returned and given back
+when a redemption is undone. Writing an entry never touches the customer
+row, so tills completing sales for the same customer don't queue on it.
+
+Customer.loyalty_points is the ledger folded up to the last fold. A fold job
+(fold_ledger, on the "loyalty" queue) claims unfolded entries in batches and
+adds them to the balances with one set-based UPDATE per batch; it is queued
+LOYALTY_FOLD_DELAY seconds after the first unfolded entry, so the sales of
+that window share it. Redemption checks the balance plus whatever is still
+unfolded.
+
+The rule: a customer earns one point per LOYALTY_SPEND_PER_POINT of money
+paid on the order, net of refunds; points tendered don't earn points. A
+point is worth LOYALTY_POINT_VALUE when redeemed. After changing the rule,
+`python manage.py recompute_loyalty` rebuilds the earned points of every
+order and every balance.
+"""
+
+import uuid
+from datetime import timedelta
+from decimal import ROUND_DOWN, Decimal
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import DecimalField, F, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, Floor, Least
+from django.utils import timezone
+
+from .caching import bump_version
+from .db import case_by_pk, insert_select
+from .jobs import enqueue, task
+from .models import Customer, Job, LoyaltyEntry, Order, Payment
+
+CENTS = Decimal("0.01")
+EARNING_STATUSES = (
+    Order.StatusChoices.COMPLETED, Order.StatusChoices.PARTIALLY_REFUNDED, Order.StatusChoices.REFUNDED,
+)
+
+
+class LoyaltyError(Exception):
+    """Raised when points can't be redeemed against an order."""
+
+
+def spend_per_point():
+    return Decimal(str(settings.LOYALTY_SPEND_PER_POINT))
+
+
+def point_value():
+    return Decimal(str(settings.LOYALTY_POINT_VALUE))
+
+
+def points_for(amount, per_point=None):
+    """Points earned on `amount` of money paid."""
+    per_point = per_point or spend_per_point()
+    return int(max(amount, Decimal("0")) // per_point)
+
+
+def _money_paid():
+    # Completed payments less refunds, leaving out points tendered and refunded as points
+    money = ~Q(payments__method=Payment.MethodChoices.LOYALTY)
+    paid = Sum("payments__amount", filter=money & Q(payments__status=Payment.StatusChoices.COMPLETED))
+    refunded = Sum("payments__amount", filter=money & Q(payments__status=Payment.StatusChoices.REFUNDED))
+    zero = Value(Decimal("0"), output_field=DecimalField())
+    return Least(Coalesce(paid, zero) - Coalesce(refunded, zero), F("total_amount"))
+
+
+def earned_points(order):
+    """Points `order` earns as things stand."""
+    if order.status not in EARNING_STATUSES:
+        return 0
+    paid = Order.objects.filter(pk=order.pk).annotate(paid=_money_paid()).values_list("paid", flat=True).get()
+    return points_for(paid or Decimal("0"))
+
+
+def available_points(customer_id):
+    """The folded balance plus entries not folded yet."""
+    balance = Customer.objects.filter(pk=customer_id).values_list("loyalty_points", flat=True).get()
+    pending = LoyaltyEntry.objects.filter(customer_id=customer_id, batch=None).aggregate(total=Sum("points"))["total"]
+    return balance + (pending or 0)
+
+
+def _add(order, kind, points, user=None, note=""):
+    if not points:
+        return None
+    entry = LoyaltyEntry.objects.create(
+        customer_id=order.customer_id, order=order, kind=kind, points=points, created_by=user, note=note,
+    )
+    schedule_fold()
+    return entry
+
+
+def order_completed(order, user=None):
+    """Credit the points a just-completed order earned. Safe to call twice."""
+    if order.customer_id is None:
+        return
+    points = earned_points(order)
+    if points > 0:
+        # The constraint allows one earn entry per order: a replayed callback adds nothing
+        LoyaltyEntry.objects.bulk_create([LoyaltyEntry(
+            customer_id=order.customer_id, order=order, kind=LoyaltyEntry.Kind.EARN, points=points, created_by=user,
+        )], ignore_conflicts=True)
+        schedule_fold()
+
+
+def order_refunded(order, refunds, user=None):
+    """Take back points earned on returned goods; give back points refunded as points."""
+    if order.customer_id is None:
+        return
+    note = f"Refund {', '.join(str(refund.pk) for refund in refunds)}"
+    earned = order.loyalty_entries.filter(
+        kind__in=(LoyaltyEntry.Kind.EARN, LoyaltyEntry.Kind.REVERSE)
+    ).aggregate(total=Sum("points"))["total"] or 0
+    _add(order, LoyaltyEntry.Kind.REVERSE, min(earned_points(order) - earned, 0), user, note)
+    for refund in refunds:
+        if refund.method == Payment.MethodChoices.LOYALTY:
+            points = int((refund.amount / point_value()).to_integral_value(ROUND_DOWN))
+            _add(order, LoyaltyEntry.Kind.REFUND, points, user, f"Refund {refund.pk}")
+
+
+def orders_deleted(orders):
+    """
+    Unlink the ledger from `orders` (a queryset) before they are deleted.
+    The column has no constraint (archived orders keep their entries, see
+    pos.archive), so nothing else would; the points stay where they are.
+    """
+    LoyaltyEntry.objects.filter(order__in=orders.values("id")).update(order=None)
+
+
+def order_cancelled(order, user=None):
+    """Give back the points tendered on an order that was cancelled before completing."""
+    cancelled = order.payments.filter(
+        method=Payment.MethodChoices.LOYALTY, status=Payment.StatusChoices.COMPLETED
+    ).update(status=Payment.StatusChoices.CANCELLED)
+    if not cancelled or order.customer_id is None:
+        return
+    outstanding = order.loyalty_entries.filter(
+        kind__in=(LoyaltyEntry.Kind.REDEEM, LoyaltyEntry.Kind.REFUND)
+    ).aggregate(total=Sum("points"))["total"] or 0
+    _add(order, LoyaltyEntry.Kind.REFUND, -outstanding, user, "Order cancelled")
+
+
+def redeem(order, points, user):
+    """Tender `points` as a payment on a pending order. Returns the Payment."""
+    if points <= 0:
+        raise LoyaltyError("Points must be positive")
+    with transaction.atomic():
+        order = Order.objects.select_for_update().get(pk=order.pk)
+        if order.status != Order.StatusChoices.PENDING:
+            raise LoyaltyError("Points can only be tendered on a pending order")
+        if order.customer_id is None:
+            raise LoyaltyError("The order has no customer")
+        # Serializes redemptions for the customer; earning never takes this lock
+        Customer.objects.select_for_update().filter(pk=order.customer_id).values_list("id").get()
+        available = available_points(order.customer_id)
+        if points > available:
+            raise LoyaltyError(f"Customer has {available} point(s)")
+
+        paid = order.payments.filter(status=Payment.StatusChoices.COMPLETED).aggregate(total=Sum("amount"))["total"]
+        due = order.total_amount - (paid or Decimal("0"))
+        amount = (points * point_value()).quantize(CENTS)
+        if amount > due:
+            raise LoyaltyError(f"{points} point(s) are worth {amount}, more than the {due} due")
+
+        payment = Payment.objects.create(
+            order=order, method=Payment.MethodChoices.LOYALTY, amount=amount, status=Payment.StatusChoices.COMPLETED,
+        )
+        _add(order, LoyaltyEntry.Kind.REDEEM, -points, user)
+        if amount == due:
+            order.status = Order.StatusChoices.COMPLETED
+            order.save(update_fields=["status", "updated_at"])
+            order_completed(order, user)
+    return payment
+
+
+# ─── Folding ──────────────────────────────────────────────────────────────────
+
+def schedule_fold():
+    """Queue a fold unless one is already waiting; it will pick this entry up too."""
+    if not settings.JOBS_INLINE and Job.objects.filter(task=fold_ledger.name, status=Job.StatusChoices.QUEUED).exists():
+        return
+    enqueue(fold_ledger.name, run_at=timezone.now() + timedelta(seconds=settings.LOYALTY_FOLD_DELAY))
+
+
+def fold_batch(size=None):
+    """Fold up to `size` unfolded entries into the balances. Returns how many it found."""
+    size = size or settings.LOYALTY_FOLD_BATCH
+    token = uuid.uuid4()
+    with transaction.atomic():
+        ids = list(LoyaltyEntry.objects.filter(batch=None).order_by("id").values_list("id", flat=True)[:size])
+        if not ids:
+            return 0
+        # Claim before summing: a concurrent fold that read the same ids claims none of them
+        LoyaltyEntry.objects.filter(id__in=ids, batch=None).update(batch=token)
+        totals = dict(
+            LoyaltyEntry.objects.filter(batch=token).order_by().values_list("customer_id").annotate(Sum("points"))
+        )
+        Customer.objects.filter(id__in=totals).update(loyalty_points=F("loyalty_points") + case_by_pk(totals))
+        bump_version(Customer)
+    return len(ids)
+
+
+@task(queue="loyalty", timeout=600)
+def fold_ledger(batch_size=None):
+    """Fold every unfolded entry, a batch per transaction."""
+    while fold_batch(batch_size):
+        pass
+
+
+# ─── Recompute ────────────────────────────────────────────────────────────────
+
+def recompute(per_point=None, using="default"):
+    """
+    Rebuild every order's earned points under the current rule and set every
+    balance to its ledger total, in one transaction and a handful of
+    statements, whatever the number of orders: the rule is evaluated by the
+    database for all orders at once (INSERT ... SELECT) rather than order by
+    order. Redemptions, refunds of points, manual adjustments and the entries
+    of archived orders are kept as they are. Returns {"orders": n, "points": n, "customers": n}.
+    """
+    per_point = Decimal(str(per_point)) if per_point else spend_per_point()
+    token = uuid.uuid4()
+    now = timezone.now()
+    with transaction.atomic(using=using):
+        if connections[using].vendor == "postgresql":
+            # Tills may be appending entries; stop them while the ledger is rebuilt
+            with connections[using].cursor() as cursor:
+                cursor.execute(f"LOCK TABLE {LoyaltyEntry._meta.db_table} IN SHARE ROW EXCLUSIVE MODE")
+        entries = LoyaltyEntry.objects.using(using)
+        # Entries of archived orders (pos.archive) have no order to recompute from
+        hot = Order.objects.using(using).values("id")
+        entries.filter(kind__in=(LoyaltyEntry.Kind.EARN, LoyaltyEntry.Kind.REVERSE), order__in=hot).delete()
+
+        earning = (
+            Order.objects.using(using)
+            .filter(status__in=EARNING_STATUSES, customer__isnull=False)
+            .annotate(
+                e_customer=F("customer_id"),
+                e_order=F("id"),
+                e_kind=Value(LoyaltyEntry.Kind.EARN),
+                e_points=Cast(Floor(_money_paid() / Value(per_point)), IntegerField()),
+                e_note=Value("Recomputed"),
+                e_batch=Value(token, output_field=LoyaltyEntry._meta.get_field("batch")),
+                e_created_at=Value(now, output_field=LoyaltyEntry._meta.get_field("created_at")),
+            )
+            .filter(e_points__gt=0)
+            .values("e_customer", "e_order", "e_kind", "e_points", "e_note", "e_batch", "e_created_at")
+            .order_by()
+        )
+        orders = insert_select(
+            LoyaltyEntry, ["customer", "order", "kind", "points", "note", "batch", "created_at"], earning, using,
+        )
+
+        # Whatever else is unfolded is part of the new balances as well
+        entries.filter(batch=None).update(batch=token)
+        folded = entries.filter(customer=OuterRef("pk")).order_by().values("customer").annotate(total=Sum("points"))
+        customers = Customer.objects.using(using).update(
+            loyalty_points=Coalesce(Subquery(folded.values("total")), 0)
+        )
+        bump_version(Customer, using=using)
+        points = entries.filter(batch=token, kind=LoyaltyEntry.Kind.EARN).aggregate(total=Sum("points"))["total"]
+    return {"orders": orders, "points": points or 0, "customers": customers}
@@ -0,0 +1,37 @@
+"""
+Management command: archive_history
+Usage:
+    python manage.py archive_history
+    python manage.py archive_history --days 180 --batch 5000
+
+Moves closed orders, with their items and payments, and stock movements older
+than ARCHIVE_AFTER_DAYS (or --days) into the archive tables (see
+pos.archive). Each batch of --batch orders or movements is its own short
+transaction, so it can run while the shop trades; schedule it nightly.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from pos.archive import archive
+
+
+class Command(BaseCommand):
+    help = "Move old orders and stock movements out of the hot tables into the archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.ARCHIVE_AFTER_DAYS,
+                            help="Archive what's older than this many days (ARCHIVE_AFTER_DAYS)")
+        parser.add_argument("--batch", type=int, default=settings.ARCHIVE_BATCH,
+                            help="Orders or movements per transaction (ARCHIVE_BATCH)")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        counts = archive(options["days"], options["batch"])
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(f"  Archived in {elapsed:.1f}s (older than {options['days']} days):")
+        for table, count in counts.items():
+            self.stdout.write(f"  {table:<12}{count:>10}")
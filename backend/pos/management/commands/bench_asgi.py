@@ -0,0 +1,321 @@
+"""
+Management command: bench_asgi
+Usage:
+    python manage.py bench_asgi
+    python manage.py bench_asgi --connections 10,50,100,200,400 --seconds 15 --workers 4
+    python manage.py bench_asgi --servers asgi --long-poll 5 --json asgi.json
+
+How many concurrent till connections one box sustains under the current
+WSGI deployment (gunicorn sync workers) and under ASGI (uvicorn workers
+serving backend/asgi.py). Both servers run the same code with the same worker
+count against the same scratch database, loaded with generate_data's
+small history, and get the same traffic at each --connections level:
+clients looping over the async endpoints (pos.async_views) — barcode
+scans, customer lookups, the dashboard and, for --long-poll-share of the
+requests, a payment status long-poll that waits --long-poll seconds on an
+M-Pesa payment that never settles.
+
+A level is sustained when no request fails and the p95 of the other
+requests stays within --target-p95-ms. The load generator is a single
+asyncio process; at high levels check it isn't the bottleneck (its CPU
+near 100%) before reading too much into the numbers.
+"""
+
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from pos.benchmarks import scratch_database, summarize
+from pos.models import Customer, Order, Payment, Product, Store
+from pos.synthetic import HistoryGenerator
+
+DATA = {"stores": 1, "days": 7, "orders_per_day": 50, "products": 500, "customers": 200}
+SERVERS = {
+    "wsgi": ["gunicorn", "backend.wsgi:application", "--workers", "{workers}", "--bind", "127.0.0.1:{port}",
+             "--timeout", "120", "--log-level", "warning"],
+    # uvicorn's own --workers supervisor adds ~40 ms to keep-alive requests on small boxes;
+    # gunicorn managing uvicorn workers doesn't, and keeps the process model the same as WSGI's
+    "asgi": ["gunicorn", "backend.asgi:application", "--worker-class", "uvicorn.workers.UvicornWorker",
+             "--workers", "{workers}", "--bind", "127.0.0.1:{port}", "--timeout", "120", "--log-level", "warning"],
+}
+# Share of the non-long-poll requests going to each endpoint
+MIX = (("scan", 0.6), ("customer_lookup", 0.3), ("dashboard", 0.1))
+
+
+class HTTPClient:
+    """A keep-alive HTTP/1.1 connection that reconnects when the server closes it."""
+
+    def __init__(self, port, headers):
+        self.port = port
+        self.headers = headers
+        self.reader = self.writer = None
+
+    async def get(self, path):
+        for attempt in (1, 2):
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.open_connection("127.0.0.1", self.port)
+                fresh = True
+            else:
+                fresh = False
+            self.writer.write(
+                f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n{self.headers}\r\n".encode()
+            )
+            await self.writer.drain()
+            status_line = await self.reader.readline()
+            if status_line or fresh:
+                break
+            self.close()  # the server dropped an idle keep-alive connection; retry on a new one
+        if not status_line:
+            raise ConnectionError("connection closed without a response")
+
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if "content-length" in headers:
+            await self.reader.readexactly(int(headers["content-length"]))
+        elif headers.get("transfer-encoding") == "chunked":
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                await self.reader.readexactly(size + 2)
+                if not size:
+                    break
+        else:
+            await self.reader.read()
+            headers["connection"] = "close"
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return int(status_line.split()[1])
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class Traffic:
+    """Picks each client's next request; the same seed gives every server the same sequence."""
+
+    def __init__(self, barcodes, phones, payment_id, long_poll, long_poll_share):
+        self.barcodes = barcodes
+        self.phones = phones
+        self.payment_id = payment_id
+        self.long_poll = long_poll
+        self.long_poll_share = long_poll_share
+
+    def next(self, rng):
+        if rng.random() < self.long_poll_share:
+            return "payment_status", f"/api/async/payments/{self.payment_id}/status/?wait={self.long_poll}"
+        pick, total = rng.random(), 0.0
+        for name, share in MIX:
+            total += share
+            if pick < total:
+                break
+        if name == "scan":
+            return name, f"/api/async/scan/{rng.choice(self.barcodes)}/"
+        if name == "customer_lookup":
+            return name, "/api/async/customers/lookup/?" + urlencode({"phone": rng.choice(self.phones)})
+        return name, "/api/async/dashboard/"
+
+
+async def run_level(port, headers, traffic, clients, seconds, timeout, seed):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + seconds
+    samples = {}
+    errors = []
+
+    async def client(index):
+        http = HTTPClient(port, headers)
+        rng = random.Random(seed * 100_003 + index)
+        try:
+            while loop.time() < deadline:
+                name, path = traffic.next(rng)
+                start = time.perf_counter()
+                try:
+                    status = await asyncio.wait_for(http.get(path), timeout)
+                except (OSError, EOFError, ValueError, asyncio.TimeoutError) as exc:
+                    http.close()
+                    errors.append(f"{name}: {type(exc).__name__} {exc}".strip())
+                    continue
+                if status != 200:
+                    errors.append(f"{name}: HTTP {status}")
+                    continue
+                samples.setdefault(name, []).append(time.perf_counter() - start)
+        finally:
+            http.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(clients)))
+    return samples, errors, time.perf_counter() - started
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Server:
+    """One of SERVERS, running as a subprocess against the scratch database."""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.port = free_port()
+        command = [arg.format(workers=workers, port=self.port) for arg in SERVERS[name]]
+        env = dict(os.environ, DB_NAME=str(connection.settings_dict["NAME"]))
+        self.log = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", *command], cwd=settings.BASE_DIR, env=env,
+            stdout=subprocess.DEVNULL, stderr=self.log,
+        )
+
+    def wait_until_ready(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise CommandError(f"{self.name} server exited:\n{self.output()}")
+            try:
+                with socket.create_connection(("127.0.0.1", self.port), timeout=1):
+                    return
+            except OSError:
+                time.sleep(0.2)
+        self.stop()
+        raise CommandError(f"{self.name} server didn't start within {timeout}s:\n{self.output()}")
+
+    def output(self):
+        self.log.seek(0)
+        return self.log.read().decode(errors="replace")[-2000:]
+
+    def stop(self):
+        self.process.send_signal(signal.SIGTERM)
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.log.close()
+
+
+class Command(BaseCommand):
+    help = "Compare concurrent-connection capacity of the WSGI and ASGI deployments"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--servers", type=str, default="wsgi,asgi", help=", ".join(SERVERS))
+        parser.add_argument("--workers", type=int, default=2, help="Worker processes per server")
+        parser.add_argument("--connections", type=str, default="10,50,100,200",
+                            help="Comma-separated concurrent connection counts")
+        parser.add_argument("--seconds", type=float, default=10, help="Duration of each level")
+        parser.add_argument("--long-poll", type=float, default=2, help="Seconds a payment status request waits")
+        parser.add_argument("--long-poll-share", type=float, default=0.2, help="Fraction of requests that long-poll")
+        parser.add_argument("--target-p95-ms", type=float, default=500, help="Latency a till can live with")
+        parser.add_argument("--timeout", type=float, default=30, help="Client timeout per request (s)")
+        parser.add_argument("--seed", type=int, default=1, help="Seed for the data and the request mix")
+        parser.add_argument("--json", type=str, help="Write results to this file")
+
+    def handle(self, *args, **options):
+        servers = [name.strip() for name in options["servers"].split(",")]
+        unknown = set(servers) - set(SERVERS)
+        if unknown:
+            raise CommandError(f"Unknown server(s): {', '.join(sorted(unknown))}")
+        levels = [int(n) for n in options["connections"].split(",")]
+
+        with scratch_database():
+            generator = HistoryGenerator(seed=options["seed"], **DATA)
+            generator.seed_reference_data()
+            generator.generate()
+            order = Order.objects.order_by("id").first()
+            payment = Payment.objects.create(order=order, method=Payment.MethodChoices.MPESA, amount=order.total_amount,
+                                             mpesa_phone="254700000000")
+            traffic = Traffic(
+                barcodes=list(Product.objects.filter(is_active=True).values_list("barcode", flat=True)),
+                phones=list(Customer.objects.exclude(phone=None).values_list("phone", flat=True)),
+                payment_id=payment.id, long_poll=options["long_poll"], long_poll_share=options["long_poll_share"],
+            )
+            store_id, cashier_id = generator.branches[0]
+            headers = (
+                f"Authorization: Bearer {RefreshToken.for_user(User.objects.get(pk=cashier_id)).access_token}\r\n"
+                f"X-Store: {Store.objects.get(pk=store_id).code}\r\n"
+            )
+            # The servers open the scratch database themselves
+            connection.close()
+
+            results = {}
+            for name in servers:
+                results[name] = self.bench_server(name, options, levels, traffic, headers)
+
+            output = {
+                "benchmark": "asgi",
+                "vendor": connection.vendor,
+                "engine": connection.settings_dict["ENGINE"],
+                "workers": options["workers"],
+                "long_poll_s": options["long_poll"],
+                "long_poll_share": options["long_poll_share"],
+                "servers": results,
+            }
+
+        self.stdout.write("\nMax sustained connections: " + ", ".join(
+            f"{name} {result['max_sustained_connections']}" for name, result in results.items()
+        ))
+        if options["json"]:
+            with open(options["json"], "w") as f:
+                json.dump(output, f, indent=2)
+
+    def bench_server(self, name, options, levels, traffic, headers):
+        server = Server(name, options["workers"])
+        try:
+            server.wait_until_ready()
+            self.stdout.write(f"{name} ({options['workers']} workers)")
+            # Warm up every worker: imports, connections, the auth cache
+            asyncio.run(run_level(server.port, headers, traffic, options["workers"] * 4, 2, options["timeout"], 0))
+
+            runs = []
+            for clients in levels:
+                samples, errors, wall = asyncio.run(run_level(
+                    server.port, headers, traffic, clients, options["seconds"], options["timeout"],
+                    options["seed"],
+                ))
+                reads = [s for endpoint, values in samples.items() if endpoint != "payment_status" for s in values]
+                polls = samples.get("payment_status", [])
+                run = {
+                    "connections": clients,
+                    "requests": sum(map(len, samples.values())),
+                    "throughput_per_s": round(sum(map(len, samples.values())) / wall, 2),
+                    "errors": len(errors),
+                    "reads": summarize(reads, wall) if reads else {"count": 0},
+                    "long_polls": summarize(polls, wall) if polls else {"count": 0},
+                    "endpoints": {endpoint: summarize(values, wall) for endpoint, values in sorted(samples.items())},
+                }
+                if errors:
+                    run["first_error"] = errors[0]
+                runs.append(run)
+                self.stdout.write(
+                    f"  {clients:>5} conns: {run['throughput_per_s']:>8} req/s  "
+                    f"reads p50 {run['reads'].get('p50_ms', '-'):>8} ms  p95 {run['reads'].get('p95_ms', '-'):>8} ms  "
+                    f"long-poll p95 {run['long_polls'].get('p95_ms', '-'):>8} ms  {len(errors)} error(s)"
+                )
+        finally:
+            server.stop()
+
+        sustained = [
+            r["connections"] for r in runs
+            if not r["errors"] and r["reads"].get("p95_ms", float("inf")) <= options["target_p95_ms"]
+        ]
+        return {"max_sustained_connections": max(sustained) if sustained else 0, "runs": runs}
@@ -0,0 +1,120 @@
+"""
+Management command: bench_checkout
+Usage:
+    python manage.py bench_checkout
+    python manage.py bench_checkout --orders 500 --basket 10 --json results.json
+    python manage.py bench_checkout --tills 1,2,4,8,16
+
+Measures end-to-end checkout throughput (create order + cash payment through
+the API) on a scratch copy of the configured database. Compare engines by
+running it once per profile:
+
+    DB_ENGINE=sqlite        python manage.py bench_checkout --tills 1,4,8
+    DB_ENGINE=sqlite-tuned  python manage.py bench_checkout --tills 1,4,8
+    DB_ENGINE=postgres      python manage.py bench_checkout --tills 1,4,8
+
+With --tills, each till is a thread with its own connection checking out
+concurrently; the run reports the largest till count that completed without
+errors inside the p95 target.
+"""
+
+import json
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from rest_framework.test import APIClient
+
+from pos.benchmarks import basket, scratch_database, seed_catalog, summarize, timed
+
+
+def checkout(client, lines):
+    res = client.post("/api/orders/", {"items": lines}, format="json")
+    if res.status_code >= 400:
+        raise RuntimeError(f"order create failed: {res.status_code}")
+    res = client.post("/api/payments/cash/", {"order_id": res.data["id"], "cash_tendered": 100000}, format="json")
+    if res.status_code >= 400:
+        raise RuntimeError(f"cash payment failed: {res.status_code}")
+
+
+def run_tills(cashier, catalog, tills, orders, basket_size):
+    samples, errors = [], []
+    lock = threading.Lock()
+
+    def till(index):
+        client = APIClient()
+        client.force_authenticate(cashier)
+        try:
+            for n in range(orders):
+                lines = basket(catalog, basket_size, offset=index * orders + n)
+                try:
+                    elapsed, _ = timed(checkout, client, lines)
+                except Exception as exc:
+                    with lock:
+                        errors.append(str(exc))
+                    continue
+                with lock:
+                    samples.append(elapsed)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=till, args=(i,)) for i in range(tills)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+    return samples, errors, wall
+
+
+class Command(BaseCommand):
+    help = "Benchmark checkout throughput against the configured database engine"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=200, help="Checkouts per till")
+        parser.add_argument("--basket", type=int, default=5, help="Lines per basket")
+        parser.add_argument("--products", type=int, default=500, help="Catalog size")
+        parser.add_argument("--tills", type=str, default="1", help="Comma-separated concurrent till counts")
+        parser.add_argument("--target-p95-ms", type=float, default=500, help="Latency a till can live with")
+        parser.add_argument("--json", type=str, help="Write results to this file")
+
+    def handle(self, *args, **options):
+        till_counts = [int(n) for n in options["tills"].split(",")]
+
+        with scratch_database() as connection:
+            cashier, catalog = seed_catalog(options["products"])
+            client = APIClient()
+            client.force_authenticate(cashier)
+            checkout(client, basket(catalog, options["basket"]))  # warm-up
+
+            runs = []
+            for tills in till_counts:
+                samples, errors, wall = run_tills(cashier, catalog, tills, options["orders"], options["basket"])
+                run = {"tills": tills, "errors": len(errors), **(summarize(samples, wall) if samples else {})}
+                if errors:
+                    run["first_error"] = errors[0]
+                runs.append(run)
+                self.stdout.write(
+                    f"  {tills:>3} till(s): {run.get('throughput_per_s', 0)} checkouts/s, "
+                    f"p95 {run.get('p95_ms', '-')} ms, {len(errors)} error(s)"
+                )
+
+            sustained = [
+                r["tills"] for r in runs
+                if not r["errors"] and r.get("p95_ms", float("inf")) <= options["target_p95_ms"]
+            ]
+            result = {
+                "benchmark": "checkout",
+                "vendor": connection.vendor,
+                "engine": connection.settings_dict["ENGINE"],
+                "basket_size": options["basket"],
+                "max_sustained_tills": max(sustained) if sustained else 0,
+                "runs": runs,
+            }
+
+        self.stdout.write(json.dumps(result, indent=2))
+        if options["json"]:
+            with open(options["json"], "w") as f:
+                json.dump(result, f, indent=2)
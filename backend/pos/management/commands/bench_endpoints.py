@@ -0,0 +1,217 @@
+"""
+Management command: bench_endpoints
+Usage:
+    python manage.py bench_endpoints
+    python manage.py bench_endpoints --scales small,medium,large --json endpoints.json
+    python manage.py bench_endpoints --baseline endpoints.json --tolerance 0.25
+
+Latency and throughput of the till's hot paths through the full API stack
+(JWT auth, routing, serializers, renderers): barcode scan, product search,
+checkout at several basket sizes, cash payment, M-Pesa callback, dashboard
+and order history. Each scale gets its own scratch database loaded with
+generate_data's synthetic history, so nothing touches the network or real
+data.
+
+With --baseline, each scenario's p95 is compared with a previous --json run
+and the command fails if any regressed by more than --tolerance.
+"""
+
+import json
+import random
+import time
+from urllib.parse import quote
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from pos.benchmarks import basket, compare, scratch_database, summarize, timed
+from pos.models import Order, Payment, Product, StockLevel, Store
+from pos.synthetic import HistoryGenerator
+
+SCALES = {
+    "small": {"stores": 1, "days": 7, "orders_per_day": 50, "products": 500, "customers": 200},
+    "medium": {"stores": 5, "days": 60, "orders_per_day": 100, "products": 5000, "customers": 5000},
+    "large": {"stores": 20, "days": 365, "orders_per_day": 150, "products": 5000, "customers": 50_000},
+}
+
+
+class Bench:
+    """One scale's database, an authenticated till and the scenarios to run against it."""
+
+    def __init__(self, cashier, store, seed):
+        self.rng = random.Random(seed)
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(cashier).access_token}", HTTP_X_STORE=store.code
+        )
+        self.catalog = list(Product.objects.filter(is_active=True).order_by("id").values_list("id", "price"))
+        self.pages = max(1, min(50, Order.objects.count() // 20))
+        self.days = list(Order.objects.dates("created_at", "day")) or [None]
+        self.sequence = 0
+
+    def check(self, res):
+        if res.status_code >= 400:
+            raise RuntimeError(f"{res.status_code}: {res.content[:200]!r}")
+        return res
+
+    def get(self, url):
+        return self.check(self.client.get(url))
+
+    def post(self, url, data):
+        return self.check(self.client.post(url, data, format="json"))
+
+    def create_order(self, size):
+        self.sequence += 1
+        return self.post("/api/orders/", {"items": basket(self.catalog, size, offset=self.sequence)}).data["id"]
+
+    # Each scenario returns the callable to time, doing any untimed setup first
+
+    def barcode_scan(self):
+        product_id, _ = self.rng.choice(self.catalog)
+        barcode = Product.objects.values_list("barcode", flat=True).get(pk=product_id)
+        return lambda: self.get(f"/api/products/?barcode={barcode}")
+
+    def product_search(self):
+        # A real name less its last digit, so the search finds that product and up to nine more
+        product_id, _ = self.rng.choice(self.catalog)
+        term = Product.objects.values_list("name", flat=True).get(pk=product_id)[:-1].lower()
+        return lambda: self.get(f"/api/products/?search={quote(term)}")
+
+    def checkout(self, size):
+        return lambda: self.create_order(size)
+
+    def cash_payment(self):
+        order_id = self.create_order(5)
+        return lambda: self.post("/api/payments/cash/", {"order_id": order_id, "cash_tendered": 1_000_000})
+
+    def mpesa_callback(self):
+        order = Order.objects.get(pk=self.create_order(5))
+        request_id = f"ws_CO_BENCH{order.pk:010d}"
+        Payment.objects.create(order=order, method=Payment.MethodChoices.MPESA, amount=order.total_amount,
+                               mpesa_phone="254700000000", mpesa_checkout_request_id=request_id)
+        body = {"Body": {"stkCallback": {
+            "MerchantRequestID": f"BENCH-{order.pk}", "CheckoutRequestID": request_id, "ResultCode": 0,
+            "ResultDesc": "The service request is processed successfully.",
+            "CallbackMetadata": {"Item": [
+                {"Name": "Amount", "Value": float(order.total_amount)},
+                {"Name": "MpesaReceiptNumber", "Value": f"BNC{order.pk:07d}"},
+                {"Name": "PhoneNumber", "Value": 254700000000},
+            ]},
+        }}}
+        return lambda: self.post("/api/payments/mpesa/callback/", body)
+
+    def dashboard(self):
+        return lambda: self.get("/api/dashboard/")
+
+    def order_history(self):
+        page = self.rng.randint(1, self.pages)
+        return lambda: self.get(f"/api/orders/?page={page}")
+
+    def order_history_by_day(self):
+        day = self.rng.choice(self.days)
+        return lambda: self.get(f"/api/orders/?date_from={day}&date_to={day}")
+
+    def scenarios(self, basket_sizes):
+        yield "barcode_scan", self.barcode_scan
+        yield "product_search", self.product_search
+        for size in basket_sizes:
+            yield f"checkout_{size}_lines", lambda size=size: self.checkout(size)
+        yield "cash_payment", self.cash_payment
+        yield "mpesa_callback", self.mpesa_callback
+        yield "dashboard", self.dashboard
+        yield "order_history", self.order_history
+        yield "order_history_by_day", self.order_history_by_day
+
+    def run(self, prepare, requests, warmup):
+        for _ in range(warmup):
+            prepare()()
+        samples, errors = [], []
+        wall = 0.0
+        for _ in range(requests):
+            call = prepare()
+            try:
+                elapsed, _ = timed(call)
+            except RuntimeError as exc:
+                errors.append(str(exc))
+                continue
+            samples.append(elapsed)
+            wall += elapsed
+        result = summarize(samples, wall) if samples else {"count": 0}
+        if errors:
+            result.update(errors=len(errors), first_error=errors[0])
+        return result
+
+
+class Command(BaseCommand):
+    help = "Benchmark the POS hot-path endpoints at several data scales"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scales", type=str, default="small,medium", help=", ".join(SCALES))
+        parser.add_argument("--requests", type=int, default=200, help="Timed requests per scenario")
+        parser.add_argument("--warmup", type=int, default=5, help="Untimed requests per scenario")
+        parser.add_argument("--baskets", type=str, default="1,5,20,50", help="Checkout basket sizes")
+        parser.add_argument("--seed", type=int, default=1, help="Seed for the data and the request mix")
+        parser.add_argument("--json", type=str, help="Write results to this file")
+        parser.add_argument("--baseline", type=str, help="Compare with the results in this file")
+        parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed p95 regression (fraction)")
+
+    def handle(self, *args, **options):
+        scales = [name.strip() for name in options["scales"].split(",")]
+        unknown = set(scales) - set(SCALES)
+        if unknown:
+            raise CommandError(f"Unknown scale(s): {', '.join(sorted(unknown))}")
+        basket_sizes = [int(n) for n in options["baskets"].split(",")]
+
+        results = {}
+        for scale in scales:
+            with scratch_database():
+                started = time.perf_counter()
+                generator = HistoryGenerator(seed=options["seed"], **SCALES[scale])
+                generator.seed_reference_data()
+                counts = generator.generate()
+                # Every checkout in the run has to find stock
+                store_id, cashier_id = generator.branches[0]
+                StockLevel.objects.filter(store_id=store_id).update(quantity=10_000_000)
+                cache.clear()
+                self.stdout.write(
+                    f"{scale}: {counts['orders']:,} orders loaded in {time.perf_counter() - started:.0f}s"
+                )
+
+                bench = Bench(User.objects.get(pk=cashier_id), Store.objects.get(pk=store_id), options["seed"])
+                results[scale] = {}
+                for name, prepare in bench.scenarios(basket_sizes):
+                    result = bench.run(prepare, options["requests"], options["warmup"])
+                    results[scale][name] = result
+                    errors = f"  {result['errors']} error(s)" if "errors" in result else ""
+                    self.stdout.write(
+                        f"  {name:<22} p50 {result.get('p50_ms', '-'):>8} ms  p95 {result.get('p95_ms', '-'):>8} ms  "
+                        f"{result.get('throughput_per_s', '-')}/s{errors}"
+                    )
+
+        output = {
+            "benchmark": "endpoints",
+            "vendor": connection.vendor,
+            "engine": connection.settings_dict["ENGINE"],
+            "requests": options["requests"],
+            "scales": results,
+        }
+        if options["json"]:
+            with open(options["json"], "w") as f:
+                json.dump(output, f, indent=2)
+
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)
+            rows = compare(results, baseline["scales"], options["tolerance"])
+            regressed = [row for row in rows if row["regressed"]]
+            self.stdout.write("\nAgainst baseline (p95):")
+            for row in rows:
+                line = (f"  {row['scale']:<7} {row['scenario']:<22} {row['baseline_p95_ms']:>8} -> "
+                        f"{row['p95_ms']:>8} ms ({row['change']:+.0%})")
+                self.stdout.write(self.style.ERROR(line) if row["regressed"] else line)
+            if regressed:
+                raise CommandError(f"{len(regressed)} scenario(s) regressed more than {options['tolerance']:.0%}")
@@ -0,0 +1,119 @@
+"""
+Management command: bench_pricing
+Usage:
+    python manage.py bench_pricing
+    python manage.py bench_pricing --rules 10000 --lines 100 --baskets 500 --json pricing.json
+
+Prices baskets against a large set of running promotions with the compiled
+pricing engine and, for comparison, a naive evaluator that checks every rule
+against every line. Also reports how long compiling the index takes. Runs on
+a scratch database.
+"""
+
+import json
+import random
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from pos.benchmarks import scratch_database, seed_catalog, summarize, timed
+from pos.models import TAX_RATES, Product, Promotion
+from pos.pricing import PricingEngine, Rule
+
+
+def seed_promotions(count, products, categories, rng):
+    kinds = [Promotion.Kind.BOGO, Promotion.Kind.MULTI_BUY, Promotion.Kind.PERCENT_OFF]
+    promotions = []
+    for n in range(count):
+        kind = kinds[n % len(kinds)]
+        # One in ten rules targets a whole category
+        target = {"category_id": rng.choice(categories)} if n % 10 == 0 else {"product_id": rng.choice(products)}
+        promotions.append(Promotion(
+            name=f"Bench promotion {n}", kind=kind,
+            buy_quantity=rng.randint(2, 4), free_quantity=1 if kind == Promotion.Kind.BOGO else 0,
+            bundle_price=Decimal(rng.randint(80, 900)) if kind == Promotion.Kind.MULTI_BUY else None,
+            percent=Decimal(rng.randint(5, 40)) if kind == Promotion.Kind.PERCENT_OFF else None,
+            **target,
+        ))
+    Promotion.objects.bulk_create(promotions, batch_size=2000)
+
+
+def naive_price(rules, lines):
+    """Reference evaluator: every rule is checked against every line."""
+    subtotal = tax = Decimal("0")
+    for product_id, category_id, quantity, unit_price, tax_class in lines:
+        saving = Decimal("0")
+        for rule_product, rule_category, rule in rules:
+            if rule_product == product_id or (rule_product is None and rule_category == category_id):
+                saving = max(saving, rule.discount(quantity, unit_price))
+        total = unit_price * quantity - saving.quantize(Decimal("0.01"))
+        subtotal += total
+        tax += total * TAX_RATES[tax_class]
+    return subtotal, tax
+
+
+class Command(BaseCommand):
+    help = "Benchmark basket pricing against many running promotions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rules", type=int, default=10_000, help="Running promotions")
+        parser.add_argument("--lines", type=int, default=100, help="Lines per basket")
+        parser.add_argument("--baskets", type=int, default=200, help="Baskets to price")
+        parser.add_argument("--products", type=int, default=5000, help="Catalog size")
+        parser.add_argument("--json", type=str, help="Write results to this file")
+
+    def handle(self, *args, **options):
+        rng = random.Random(1)
+
+        with scratch_database():
+            seed_catalog(options["products"])
+            catalog = list(Product.objects.values_list("id", "category_id", "price", "tax_class"))
+            categories = sorted({category_id for _, category_id, _, _ in catalog})
+            seed_promotions(options["rules"], [p[0] for p in catalog], categories, rng)
+
+            compile_samples = [timed(PricingEngine.compile)[0] for _ in range(5)]
+            engine = PricingEngine.compile()
+            rules = [
+                (product_id, category_id, Rule(pk, kind, buy, free, bundle_price, percent))
+                for pk, product_id, category_id, kind, buy, free, bundle_price, percent in
+                Promotion.objects.values_list(
+                    "id", "product_id", "category_id", "kind", "buy_quantity", "free_quantity",
+                    "bundle_price", "percent",
+                )
+            ]
+
+        baskets = [
+            [(product_id, category_id, rng.randint(1, 6), price, tax_class)
+             for product_id, category_id, price, tax_class in rng.sample(catalog, options["lines"])]
+            for _ in range(options["baskets"])
+        ]
+
+        compiled, naive = [], []
+        for lines in baskets:
+            elapsed, (_, subtotal, tax) = timed(engine.price_basket, lines)
+            compiled.append(elapsed)
+            # The naive path is slow enough that a slice of the baskets is plenty
+            if len(naive) < 20:
+                elapsed, expected = timed(naive_price, rules, lines)
+                naive.append(elapsed)
+                if expected != (subtotal, tax):
+                    raise AssertionError(f"engine and naive evaluator disagree: {(subtotal, tax)} != {expected}")
+
+        compiled_stats, naive_stats = summarize(compiled), summarize(naive)
+        result = {
+            "benchmark": "pricing",
+            "rules": options["rules"],
+            "lines_per_basket": options["lines"],
+            "compile": summarize(compile_samples),
+            "compiled_engine": compiled_stats,
+            "naive_scan": naive_stats,
+            "speedup": round(naive_stats["mean_ms"] / compiled_stats["mean_ms"], 1),
+        }
+        self.stdout.write(
+            f"  compile {result['compile']['mean_ms']} ms; basket p95 {compiled_stats['p95_ms']} ms "
+            f"(naive {naive_stats['p95_ms']} ms, {result['speedup']}x)"
+        )
+        self.stdout.write(json.dumps(result, indent=2))
+        if options["json"]:
+            with open(options["json"], "w") as f:
+                json.dump(result, f, indent=2)
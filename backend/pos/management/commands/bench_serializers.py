@@ -0,0 +1,89 @@
+"""
+Management command: bench_serializers
+Usage:
+    python manage.py bench_serializers
+    python manage.py bench_serializers --rows 5000 --repeat 5
+
+Microbenchmark of the read path per row: ModelSerializer + stdlib JSONRenderer
+against the `.values()` row builders + ORJSONRenderer, for products and for
+orders with their nested items and payments. Runs on a scratch database.
+"""
+
+import json
+import random
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from pos.benchmarks import scratch_database, seed_catalog, timed
+from pos.models import Order, OrderItem, Payment, Product
+from pos.renderers import ORJSONRenderer
+from pos.rows import OrderRows, ProductRows
+from pos.serializers import OrderSerializer, ProductSerializer
+from pos.stores import get_store, with_stock
+
+
+def seed_orders(cashier, store, catalog, count, rng):
+    orders = Order.objects.bulk_create([
+        Order(order_number=f"BENCH{n:08d}", store=store, cashier=cashier, status=Order.StatusChoices.COMPLETED,
+              subtotal=Decimal("500"), tax_amount=Decimal("80"), total_amount=Decimal("580"))
+        for n in range(count)
+    ])
+    items, payments = [], []
+    for order in orders:
+        for product_id, price in rng.sample(catalog, 4):
+            items.append(OrderItem(order=order, product_id=product_id, quantity=rng.randint(1, 3), unit_price=price))
+        payments.append(Payment(order=order, method="cash", amount=order.total_amount, status="completed"))
+    OrderItem.objects.bulk_create(items)
+    Payment.objects.bulk_create(payments)
+
+
+class Command(BaseCommand):
+    help = "Per-row cost of ModelSerializer vs the fast values() read path"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=2000, help="Rows per endpoint")
+        parser.add_argument("--repeat", type=int, default=3, help="Take the best of N runs")
+
+    def handle(self, *args, **options):
+        rows, repeat = options["rows"], options["repeat"]
+        request = Request(APIRequestFactory().get("/api/products/"))
+
+        with scratch_database():
+            cashier, catalog = seed_catalog(products=rows)
+            Product.objects.update(image="products/bench.webp")
+            store = get_store(settings.DEFAULT_STORE)
+            seed_orders(cashier, store, catalog, rows, random.Random(1))
+
+            products = with_stock(Product.objects.select_related("category"), store)
+            orders = Order.objects.select_related("customer", "cashier").prefetch_related("items__product", "payments")
+
+            def serializer_path(serializer_class, queryset):
+                data = serializer_class(queryset.all(), many=True, context={"request": request}).data
+                return JSONRenderer().render(data)
+
+            def fast_path(builder_class, queryset):
+                builder = builder_class(request)
+                return ORJSONRenderer().render(builder.build(builder.prepare(queryset.all())))
+
+            results = {}
+            for name, serializer_class, builder_class, queryset in (
+                ("products", ProductSerializer, ProductRows, products),
+                ("orders", OrderSerializer, OrderRows, orders),
+            ):
+                slow = min(timed(serializer_path, serializer_class, queryset)[0] for _ in range(repeat))
+                fast = min(timed(fast_path, builder_class, queryset)[0] for _ in range(repeat))
+                identical = serializer_path(serializer_class, queryset) == fast_path(builder_class, queryset)
+                results[name] = {
+                    "rows": rows,
+                    "serializer_us_per_row": round(slow / rows * 1e6, 2),
+                    "fast_us_per_row": round(fast / rows * 1e6, 2),
+                    "speedup": round(slow / fast, 2),
+                    "byte_identical": identical,
+                }
+
+        self.stdout.write(json.dumps(results, indent=2))
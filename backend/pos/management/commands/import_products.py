@@ -0,0 +1,68 @@
+"""
+Management command: import_products
+Usage:
+    python manage.py import_products catalog.csv
+    python manage.py import_products prices.xlsx --store westlands --batch 5000 --dry-run
+
+Creates and updates products from a CSV or XLSX catalog keyed on barcode
+(see pos.imports for the columns); stock_quantity values are set at --store
+(DEFAULT_STORE). Each batch of --batch rows is one transaction. --dry-run
+reports the outcome and rolls it back.
+"""
+
+import time
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from pos.imports import CatalogImportError, import_products
+from pos.models import Store
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Create and update products from a CSV or XLSX catalog"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV or XLSX file with a header row")
+        parser.add_argument("--store", default=settings.DEFAULT_STORE, help="Store code stock levels go to")
+        parser.add_argument("--batch", type=int, default=settings.IMPORT_BATCH,
+                            help="Rows per transaction (IMPORT_BATCH)")
+        parser.add_argument("--dry-run", action="store_true", help="Report what would change, then roll back")
+
+    def handle(self, *args, **options):
+        try:
+            store = Store.objects.get(code=options["store"])
+        except Store.DoesNotExist:
+            raise CommandError(f"No store {options['store']!r}")
+
+        start = time.perf_counter()
+        try:
+            # A dry run is one transaction, so it can all be rolled back
+            atomic = transaction.atomic() if options["dry_run"] else nullcontext()
+            with open(options["path"], "rb") as file, atomic:
+                report = import_products(file, options["path"], store, options["batch"])
+                if options["dry_run"]:
+                    raise Rollback
+        except Rollback:
+            pass
+        except (OSError, CatalogImportError) as exc:
+            raise CommandError(str(exc))
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            f"  {report['rows']} row(s) in {elapsed:.1f}s: {report['created']} created, "
+            f"{report['updated']} updated, {report['unchanged']} unchanged, {report['failed']} failed"
+        )
+        for error in report["errors"][:20]:
+            problems = "; ".join(f"{field}: {' '.join(messages)}" for field, messages in error["errors"].items())
+            self.stdout.write(self.style.ERROR(f"  Row {error['row']}: {problems}"))
+        if report["failed"] > 20:
+            self.stdout.write(f"  ... and {report['failed'] - 20} more")
+        if options["dry_run"]:
+            self.stdout.write(self.style.WARNING("  Dry run: nothing was changed"))
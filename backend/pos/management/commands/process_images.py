@@ -0,0 +1,84 @@
+"""
+Management command: process_images
+Usage:
+    python manage.py process_images
+    python manage.py process_images --prune
+    python manage.py process_images --workers 8
+
+Brings existing product images into the image pipeline (see pos.images):
+moves every original that isn't stored content-addressed yet to its
+content-addressed name, so duplicates collapse into one file, and renders
+any missing thumbnails in a process pool. With --prune, files under
+media/products that no product references any more are deleted.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from pos.caching import bump_version
+from pos.images import CONTENT_ADDRESSED, image_sizes, render_thumbnails, thumbnail_name
+from pos.models import Product
+
+
+class Command(BaseCommand):
+    help = "Store product images content-addressed, render thumbnails and prune unused files"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Thumbnail processes")
+        parser.add_argument("--prune", action="store_true", help="Delete files no product references")
+
+    def handle(self, *args, **options):
+        storage = Product._meta.get_field("image").storage
+        sizes = image_sizes()
+
+        images, moved = {}, 0
+        for pk, name in Product.objects.exclude(image="").exclude(image__isnull=True).values_list("id", "image"):
+            if not CONTENT_ADDRESSED.search(name):
+                if not storage.exists(name):
+                    self.stdout.write(self.style.WARNING(f"  ⚠  Missing file for product {pk}: {name}"))
+                    continue
+                with storage.open(name) as f:
+                    new_name = storage.save(name, f)
+                Product.objects.filter(pk=pk).update(image=new_name, image_sizes=[])
+                name, moved = new_name, moved + 1
+            images.setdefault(name, []).append(pk)
+        self.stdout.write(f"  Moved {moved} image(s); {len(images)} distinct image(s) in use")
+
+        rendered = 0
+        with ProcessPoolExecutor(max_workers=max(1, options["workers"])) as pool:
+            futures = {pool.submit(render_thumbnails, storage.path(name), sizes): name for name in images}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    done = future.result()
+                except Exception as exc:
+                    self.stdout.write(self.style.WARNING(f"  ⚠  Could not render {name}: {exc}"))
+                    continue
+                Product.objects.filter(image=name).update(image_sizes=done)
+                rendered += 1
+        bump_version(Product)
+        self.stdout.write(f"  Thumbnails ready for {rendered} image(s)")
+
+        if options["prune"]:
+            self.prune(storage, images, sizes)
+
+    def prune(self, storage, images, sizes):
+        keep = set()
+        for name in images:
+            keep.add(name)
+            keep.update(thumbnail_name(name, size) for size in sizes)
+
+        root = os.path.join(settings.MEDIA_ROOT, "products")
+        removed = freed = 0
+        for directory, _dirs, files in os.walk(root):
+            for filename in files:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, "/")
+                if name not in keep:
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+                    removed += 1
+        self.stdout.write(self.style.SUCCESS(f"  Pruned {removed} file(s), {freed / 1_048_576:.1f} MB freed"))
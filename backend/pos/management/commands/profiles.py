@@ -0,0 +1,87 @@
+"""
+Management command: profiles
+Usage:
+    python manage.py profiles                      (slowest profiled requests)
+    python manage.py profiles --endpoint order-list --limit 10
+    python manage.py profiles --show <id>          (hot functions and SQL of one request)
+    python manage.py profiles --queries            (slow queries with their plans)
+    python manage.py profiles --clear
+
+Reads the store written by pos.profiling (PROFILE_DIR). For the full call
+graph of a request, open <PROFILE_DIR>/<id>.prof with snakeviz or pstats.
+"""
+
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pos.profiling import ProfileStore
+
+
+class Command(BaseCommand):
+    help = "List and summarize profiled requests and slow queries"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=20, help="Rows to show")
+        parser.add_argument("--endpoint", type=str, help="Only requests to this URL name")
+        parser.add_argument("--show", type=str, help="Details of one profile")
+        parser.add_argument("--queries", action="store_true", help="Slow queries instead of requests")
+        parser.add_argument("--clear", action="store_true", help="Delete everything in the store")
+
+    def handle(self, *args, **options):
+        store = ProfileStore()
+        if options["clear"]:
+            store.clear()
+            self.stdout.write(self.style.SUCCESS(f"  Cleared {store.directory}"))
+        elif options["show"]:
+            try:
+                record = store.get(options["show"])
+            except FileNotFoundError:
+                raise CommandError(f"No profile {options['show']} in {store.directory}")
+            self.show(record, options["limit"])
+        elif options["queries"]:
+            self.slow_queries(store.records("query"), options["limit"])
+        else:
+            self.requests(store.records("request"), options["endpoint"], options["limit"])
+
+    def requests(self, records, endpoint, limit):
+        if endpoint:
+            records = [r for r in records if r["endpoint"] == endpoint]
+        records.sort(key=lambda r: r["duration_ms"], reverse=True)
+        self.stdout.write(f"{len(records)} profiled request(s); slowest first")
+        for r in records[:limit]:
+            self.stdout.write(
+                f"  {r['duration_ms']:>9.1f} ms  db {r['db_ms']:>8.1f} ms / {len(r['queries']):>3} q  "
+                f"{r['status']}  {r['method']:<6} {r['path'][:60]:<60}  {r['at']}  {r['id']}"
+            )
+
+    def show(self, record, limit):
+        if record["kind"] == "query":
+            return self.slow_queries([record], 1)
+        self.stdout.write(
+            f"{record['method']} {record['path']} -> {record['status']} ({record['endpoint']}), "
+            f"{record['duration_ms']} ms, db {record['db_ms']} ms in {len(record['queries'])} queries, "
+            f"user {record['user']}, {record['trigger']}, {record['at']}"
+        )
+        self.stdout.write("\nHot functions (cumulative):")
+        for f in record["functions"][:limit]:
+            self.stdout.write(f"  {f['cumtime_ms']:>9.1f} ms  {f['tottime_ms']:>8.1f} ms self  "
+                              f"{f['calls']:>7}x  {f['function']}")
+
+        self.stdout.write("\nSQL, slowest first:")
+        for q in sorted(record["queries"], key=lambda q: q["ms"], reverse=True)[:limit]:
+            self.stdout.write(f"  {q['ms']:>9.2f} ms  {q['sql'][:200]}")
+        repeated = [(sql, n) for sql, n in Counter(q["sql"] for q in record["queries"]).most_common() if n > 1]
+        if repeated:
+            self.stdout.write(self.style.WARNING("\nRepeated statements (possible N+1):"))
+            for sql, n in repeated[:5]:
+                self.stdout.write(f"  {n:>4}x  {sql[:200]}")
+
+    def slow_queries(self, records, limit):
+        records.sort(key=lambda r: r["duration_ms"], reverse=True)
+        self.stdout.write(f"{len(records)} slow quer{'y' if len(records) == 1 else 'ies'}; slowest first")
+        for r in records[:limit]:
+            self.stdout.write(f"\n  {r['duration_ms']:.1f} ms on {r['alias']} at {r['at']}  {r['id']}")
+            self.stdout.write(f"  {r['sql']}")
+            for line in r["explain"] or ["(no plan)"]:
+                self.stdout.write(f"    {line}")
@@ -0,0 +1,145 @@
+"""
+Management command: run_workers
+Usage:
+    python manage.py run_workers
+    python manage.py run_workers --threads 4 --queues payments,default
+    python manage.py run_workers --processes 2 --threads 2
+    python manage.py run_workers --burst
+    python manage.py run_workers --status
+    python manage.py run_workers --retry-failed
+
+Runs background jobs (see pos.jobs). Each of --processes forked processes
+runs --threads worker threads, every one claiming up to --batch due jobs at a
+time from --queues (all queues by default). Threads suit the I/O-bound tasks
+(Daraja calls); use processes for CPU-bound ones like thumbnails. SIGTERM or
+Ctrl-C stops claiming, lets running jobs finish and hands claimed but
+unstarted ones back to the queue.
+
+--burst runs until nothing is due and exits, for cron or CI. Finished jobs
+older than JOB_RETENTION_DAYS are pruned at start and hourly after that.
+"""
+
+import os
+import signal
+import socket
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from pos import jobs
+from pos.models import Job
+
+PRUNE_EVERY = 3600
+
+
+class Command(BaseCommand):
+    help = "Run background job workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=1, help="Worker threads per process")
+        parser.add_argument("--processes", type=int, default=1, help="Worker processes (forked)")
+        parser.add_argument("--queues", type=str, default="", help="Comma-separated queues (default: all)")
+        parser.add_argument("--batch", type=int, default=1, help="Jobs a worker claims at a time")
+        parser.add_argument("--poll", type=float, help="Seconds between polls when idle (default JOB_POLL_SECONDS)")
+        parser.add_argument("--burst", action="store_true", help="Exit once no job is due")
+        parser.add_argument("--status", action="store_true", help="Print job counts per queue and exit")
+        parser.add_argument("--retry-failed", action="store_true", help="Queue failed jobs again and exit")
+
+    def handle(self, *args, **options):
+        if options["status"]:
+            return self.status()
+        if options["retry_failed"]:
+            count = Job.objects.filter(status=Job.StatusChoices.FAILED).update(
+                status=Job.StatusChoices.QUEUED, run_at=timezone.now(), attempts=0, finished_at=None,
+            )
+            self.stdout.write(f"  Re-queued {count} failed job(s)")
+            return
+        if options["threads"] < 1 or options["processes"] < 1:
+            raise CommandError("--threads and --processes must be at least 1")
+
+        self.options = options
+        self.queues = [q.strip() for q in options["queues"].split(",") if q.strip()] or None
+        self.stop = threading.Event()
+        self.children = []
+        previous = {sig: signal.signal(sig, self.shutdown) for sig in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            self.run()
+        finally:
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+
+    def run(self):
+        options = self.options
+        pruned = jobs.prune()
+        if pruned:
+            self.stdout.write(f"  Pruned {pruned} finished job(s)")
+        self.stdout.write(
+            f"Running {options['processes']}×{options['threads']} worker(s) on "
+            f"{', '.join(self.queues) if self.queues else 'all queues'}"
+        )
+        if options["processes"] == 1:
+            self.run_threads()
+        else:
+            self.run_processes()
+
+    def shutdown(self, *_):
+        self.stop.set()
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def status(self):
+        depths = jobs.queue_depths()
+        if not depths:
+            self.stdout.write("  No jobs")
+            return
+        statuses = [choice for choice, _ in Job.StatusChoices.choices]
+        self.stdout.write(f"  {'queue':<16}" + "".join(f"{s:>10}" for s in statuses))
+        for queue in sorted({queue for queue, _ in depths}):
+            self.stdout.write(f"  {queue:<16}" + "".join(f"{depths.get((queue, s), 0):>10}" for s in statuses))
+
+    def run_threads(self):
+        host, pid = socket.gethostname(), os.getpid()
+        workers = [
+            jobs.Worker(name=f"{host}:{pid}:{i}", queues=self.queues, batch=self.options["batch"],
+                        poll=self.options["poll"], stop=self.stop)
+            for i in range(self.options["threads"])
+        ]
+        threads = [threading.Thread(target=w.run, kwargs={"burst": self.options["burst"]}, name=w.name)
+                   for w in workers]
+        for thread in threads:
+            thread.start()
+
+        # The main thread keeps receiving signals, and prunes now and then
+        pruned_at = time.monotonic()
+        while any(thread.is_alive() for thread in threads) and not self.stop.wait(1):
+            if not self.options["burst"] and time.monotonic() - pruned_at >= PRUNE_EVERY:
+                jobs.prune()
+                connections.close_all()
+                pruned_at = time.monotonic()
+        for thread in threads:
+            thread.join()
+
+    def run_processes(self):
+        # Children must not share the parent's database connections
+        connections.close_all()
+        for _ in range(self.options["processes"]):
+            pid = os.fork()
+            if pid == 0:
+                self.children = []
+                code = 0
+                try:
+                    self.run_threads()
+                except BaseException:
+                    code = 1
+                finally:
+                    os._exit(code)
+            self.children.append(pid)
+
+        for pid in self.children:
+            os.waitpid(pid, 0)
@@ -10,20 +10,24 @@ Populates:p
   - Products   (60, with images randomly picked from your local folder)
   - Customers  (20)
   - Sample orders (15 completed)
+
+For benchmark-sized data use generate_data instead.
 """
 
 import os
 import random
-import shutil
 from decimal import Decimal
 from pathlib import Path
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.files import File
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 
 from pos.models import Category, Customer, Order, OrderItem, Payment, Product, StockMovement
+from pos.stock import set_levels
+from pos.stores import get_store
 
 
 # ─── Realistic supermarket data ───────────────────────────────────────────────
@@ -168,25 +172,19 @@ def collect_images(images_dir: str) -> list[Path]:
     return images
 
 
-def assign_image(product: Product, image_paths: list[Path], media_products_dir: Path):
+def assign_image(product: Product, image_paths: list[Path]):
     """
-    Copy a randomly chosen image from image_paths into Django's
-    media/products/ directory and assign it to the product.
+    Assign a randomly chosen image from image_paths to the product. Images
+    are stored content-addressed (pos.images), so re-seeding reuses the file
+    that's already in media/products/ instead of copying it again.
     """
     if not image_paths:
         return
 
     src = random.choice(image_paths)
-    dest_name = f"product_{product.id}_{src.name}"
-    dest_path = media_products_dir / dest_name
-
-    # Ensure destination directory exists
-    media_products_dir.mkdir(parents=True, exist_ok=True)
-
     try:
-        shutil.copy2(src, dest_path)
-        with open(dest_path, "rb") as f:
-            product.image.save(dest_name, File(f), save=True)
+        with open(src, "rb") as f:
+            product.image.save(src.name, File(f), save=True)
     except Exception as exc:
         print(f"      ⚠  Could not assign image for {product.name}: {exc}")
 
@@ -239,9 +237,6 @@ class Command(BaseCommand):
                 )
             )
 
-        from django.conf import settings
-        media_products_dir = Path(settings.MEDIA_ROOT) / "products"
-
         # ── Superuser ────────────────────────────────────────────────────────
         self.stdout.write("  👤  Creating superuser (admin / admin1234)…")
         if not User.objects.filter(username="admin").exists():
@@ -280,6 +275,7 @@ class Command(BaseCommand):
 
         # ── Products ─────────────────────────────────────────────────────────
         self.stdout.write("\n  📦  Seeding products…")
+        store = get_store(settings.DEFAULT_STORE)
         product_objs: list[Product] = []
         for name, cat_name, price, cost, stock, bcode_sfx in PRODUCTS:
             barcode = f"5900000{bcode_sfx}"
@@ -290,17 +286,18 @@ class Command(BaseCommand):
                     category=cat_map.get(cat_name),
                     price=Decimal(str(price)),
                     cost_price=Decimal(str(cost)),
-                    stock_quantity=stock,
                     low_stock_threshold=10,
                     is_active=True,
                 ),
             )
             product_objs.append(prod)
+            if created:
+                set_levels(store, {prod.pk: stock})
 
             # Assign image if we have some and the product has none yet
             if created or not prod.image:
                 if image_paths:
-                    assign_image(prod, image_paths, media_products_dir)
+                    assign_image(prod, image_paths)
                     self.stdout.write(f"     + {name}  🖼")
                 else:
                     self.stdout.write(f"     + {name}")
@@ -340,6 +337,7 @@ class Command(BaseCommand):
                 for attempt in range(5):
                     try:
                         order = Order.objects.create(
+                            store=store,
                             customer=customer,
                             cashier=admin_user,
                             status=Order.StatusChoices.PENDING,
@@ -0,0 +1,32 @@
+"""
+Management command: segment_customers
+Usage:
+    python manage.py segment_customers
+
+Scores every customer on recency, frequency and monetary value and rebuilds
+their RFM segments (see pos.segments). Meant to run nightly from cron; the
+work is a handful of set-based statements in one transaction, so hundreds
+of thousands of customers take seconds, and readers see the old segments
+until it commits.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from pos.models import CustomerSegment
+from pos.segments import rebuild
+
+
+class Command(BaseCommand):
+    help = "Rebuild the RFM segments of every customer"
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        counts = rebuild()
+        elapsed = time.perf_counter() - start
+
+        labels = dict(CustomerSegment.Segment.choices)
+        self.stdout.write(f"  {sum(counts.values())} customer(s) segmented in {elapsed:.1f}s")
+        for segment, count in counts.items():
+            self.stdout.write(f"  {labels[segment]:<14}{count:>10}")
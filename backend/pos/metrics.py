@@ -0,0 +1,278 @@
+"""
+Per-request performance metrics.
+
+MetricsMiddleware times every request and splits the time into stages:
+
+  db         queries on any connection (count and time), via an execute
+             wrapper installed on each new connection
+  serialize  building response rows (pos.rows) and rendering JSON, less any
+             queries that ran inside
+  external   calls out to Daraja
+  app        everything else
+
+The split goes back to the client as a Server-Timing header (visible in the
+browser's network panel) and into per-endpoint histograms, exposed in the
+Prometheus text format at /api/metrics/. Recording is a few perf_counter
+calls and a bisect per request, cheap enough to leave on.
+
+Histograms live in process memory. With several workers, set METRICS_DIR:
+each worker then writes a snapshot there every METRICS_FLUSH_SECONDS, and
+/api/metrics/ adds up the snapshots of every worker that has run.
+"""
+
+import bisect
+import contextvars
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from rest_framework import permissions
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+HISTOGRAMS = {
+    "pos_request_duration_seconds": "Time to handle a request, end to end",
+    "pos_request_db_seconds": "Time spent in database queries per request",
+    "pos_request_serialize_seconds": "Time spent building and rendering responses per request",
+    "pos_request_external_seconds": "Time spent calling external services per request",
+}
+COUNTERS = {
+    "pos_requests_total": "Requests handled",
+    "pos_db_queries_total": "Database queries run",
+}
+
+_current = contextvars.ContextVar("request_timings", default=None)
+
+
+class Timings:
+    __slots__ = ("start", "queries", "db", "serialize", "external", "sql")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db = self.serialize = self.external = 0.0
+        self.sql = None  # a list while the request is being profiled (see pos.profiling)
+
+
+def current_timings():
+    return _current.get()
+
+
+def _timed_execute(execute, sql, params, many, context):
+    start, failed = time.perf_counter(), True
+    try:
+        result = execute(sql, params, many, context)
+        failed = False
+        return result
+    finally:
+        elapsed = time.perf_counter() - start
+        timings = _current.get()
+        if timings is not None:
+            timings.db += elapsed
+            timings.queries += 1
+            if timings.sql is not None:
+                timings.sql.append((sql, params, many, elapsed))
+        if not failed and elapsed * 1000 >= settings.SLOW_QUERY_MS:
+            from .profiling import log_slow_query
+            log_slow_query(context["connection"], sql, params, many, elapsed)
+
+
+def _install_wrapper(sender, connection, **kwargs):
+    if _timed_execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_timed_execute)
+
+
+def connect_metrics():
+    connection_created.connect(_install_wrapper, dispatch_uid="metrics-db")
+
+
+@contextmanager
+def stage(name):
+    """Count the time inside the block towards `name` ("serialize" or "external")."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start, db = time.perf_counter(), timings.db
+    try:
+        yield
+    finally:
+        # Queries run inside are already counted as db time
+        elapsed = time.perf_counter() - start - (timings.db - db)
+        setattr(timings, name, getattr(timings, name) + elapsed)
+
+
+class Registry:
+    """Histograms and counters keyed by (metric, labels)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = defaultdict(lambda: [[0] * (len(BUCKETS) + 1), 0.0])
+        self.counters = defaultdict(float)
+        self.flushed = 0.0
+
+    def observe(self, name, labels, value):
+        histogram = self.histograms[(name, labels)]
+        histogram[0][bisect.bisect_left(BUCKETS, value)] += 1
+        histogram[1] += value
+
+    def record(self, endpoint, method, status, total, timings):
+        labels = (("endpoint", endpoint), ("method", method))
+        with self.lock:
+            self.observe("pos_request_duration_seconds", labels, total)
+            self.observe("pos_request_db_seconds", labels, timings.db)
+            self.observe("pos_request_serialize_seconds", labels, timings.serialize)
+            self.observe("pos_request_external_seconds", labels, timings.external)
+            self.counters[("pos_requests_total", labels + (("status", str(status)),))] += 1
+            self.counters[("pos_db_queries_total", labels)] += timings.queries
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "histograms": [[name, labels, counts[:], total] for (name, labels), (counts, total) in
+                               self.histograms.items()],
+                "counters": [[name, labels, value] for (name, labels), value in self.counters.items()],
+            }
+
+    def flush(self, directory):
+        """Write this worker's snapshot to `directory`, atomically."""
+        self.flushed = time.monotonic()
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".metrics-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, os.path.join(directory, f"worker-{os.getpid()}.json"))
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+registry = Registry()
+
+
+def _merged_snapshots():
+    directory = getattr(settings, "METRICS_DIR", None)
+    own = registry.snapshot()
+    if not directory:
+        return [own]
+    snapshots, mine = [own], f"worker-{os.getpid()}.json"
+    for filename in sorted(os.listdir(directory)):
+        if filename.startswith("worker-") and filename != mine:
+            try:
+                with open(os.path.join(directory, filename)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # a worker mid-write or a stray file
+    return snapshots
+
+
+def _labels(pairs):
+    return ",".join(f'{key}="{value}"' for key, value in pairs)
+
+
+def exposition():
+    """All metrics, summed across workers, in the Prometheus text format."""
+    histograms = defaultdict(lambda: [[0] * (len(BUCKETS) + 1), 0.0])
+    counters = defaultdict(float)
+    for snapshot in _merged_snapshots():
+        for name, labels, counts, total in snapshot["histograms"]:
+            merged = histograms[(name, tuple(map(tuple, labels)))]
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+        for name, labels, value in snapshot["counters"]:
+            counters[(name, tuple(map(tuple, labels)))] += value
+
+    lines = []
+    for name, help_text in HISTOGRAMS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for (metric, labels), (counts, total) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{_labels(labels + (("le", bound),))}}} {cumulative}')
+            lines.append(f"{name}_sum{{{_labels(labels)}}} {total:.6f}")
+            lines.append(f"{name}_count{{{_labels(labels)}}} {cumulative}")
+    for name, help_text in COUNTERS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{name}{{{_labels(labels)}}} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+def server_timing(timings, total):
+    app = max(total - timings.db - timings.serialize - timings.external, 0.0)
+    return ", ".join([
+        f'db;dur={timings.db * 1000:.1f};desc="{timings.queries} queries"',
+        f"serialize;dur={timings.serialize * 1000:.1f}",
+        f"external;dur={timings.external * 1000:.1f}",
+        f"app;dur={app * 1000:.1f}",
+        f"total;dur={total * 1000:.1f}",
+    ])
+
+
+class MetricsMiddleware:
+    """
+    Times each request, adds the Server-Timing header and records the
+    request in the histograms under its URL name (e.g. order-list), so
+    cardinality stays bounded however many ids pass through.
+    """
+
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timings = Timings()
+        token = _current.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = Timings()
+        token = _current.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings)
+
+    def finish(self, request, response, timings):
+        total = time.perf_counter() - timings.start
+        match = request.resolver_match
+        endpoint = (match.view_name or match.url_name) if match else "unmatched"
+        response["Server-Timing"] = server_timing(timings, total)
+        registry.record(endpoint, request.method, response.status_code, total, timings)
+
+        directory = getattr(settings, "METRICS_DIR", None)
+        if directory and time.monotonic() - registry.flushed >= settings.METRICS_FLUSH_SECONDS:
+            registry.flush(directory)
+        return response
+
+
+class MetricsTokenOrStaff(permissions.BasePermission):
+    """Staff users, or a scraper sending `Authorization: Bearer <METRICS_TOKEN>`."""
+
+    def has_permission(self, request, view):
+        token = getattr(settings, "METRICS_TOKEN", "")
+        if token and request.META.get("HTTP_AUTHORIZATION") == f"Bearer {token}":
+            return True
+        return bool(request.user and request.user.is_staff)
@@ -0,0 +1,75 @@
+import hashlib
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+
+from .routers import _replica_reads, replica_alias
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def _client_key(request):
+    # The Authorization header identifies a till session without touching the DB
+    ident = request.META.get("HTTP_AUTHORIZATION") or request.META.get("REMOTE_ADDR", "")
+    return "replica-pin:" + hashlib.sha1(ident.encode()).hexdigest()
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Serve safe requests to views with `replica_reads = True` from the read
+    replica. A client that has just written is pinned to the primary for
+    DATABASE_REPLICA_PIN_SECONDS so it always reads its own writes.
+    """
+
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+            # Django would run a sync process_view on a thread for every request
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            self.reset(request)
+
+        if request.method not in SAFE_METHODS and replica_alias():
+            cache.set(_client_key(request), 1, getattr(settings, "DATABASE_REPLICA_PIN_SECONDS", 5))
+        return response
+
+    async def __acall__(self, request):
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.reset(request)
+
+        if request.method not in SAFE_METHODS and replica_alias():
+            await cache.aset(_client_key(request), 1, getattr(settings, "DATABASE_REPLICA_PIN_SECONDS", 5))
+        return response
+
+    def reset(self, request):
+        token = getattr(request, "_replica_token", None)
+        if token is not None:
+            _replica_reads.reset(token)
+
+    def wants_replica(self, request, view_func):
+        # DRF views carry the flag on their class, async views (pos.async_views) on the function
+        view = getattr(view_func, "cls", view_func)
+        return request.method in SAFE_METHODS and getattr(view, "replica_reads", False) and replica_alias()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if self.wants_replica(request, view_func) and not cache.get(_client_key(request)):
+            request._replica_token = _replica_reads.set(True)
+        return None
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        if self.wants_replica(request, view_func) and not await cache.aget(_client_key(request)):
+            request._replica_token = _replica_reads.set(True)
+        return None
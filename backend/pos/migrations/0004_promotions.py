@@ -0,0 +1,69 @@
+# Generated by Django 5.0.4 on 2026-10-19 06:27
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import F
+
+
+def cart_tax(apps, schema_editor):
+    # Carts opened before tax classes were all standard-rated
+    Cart = apps.get_model("pos", "Cart")
+    Cart.objects.update(tax_amount=F("subtotal") * Decimal("0.16"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0003_cart'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='tax_amount',
+            field=models.DecimalField(decimal_places=10, default=0, max_digits=20),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='promotion_discount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='tax_rate',
+            field=models.DecimalField(decimal_places=4, default=Decimal('0.16'), max_digits=5),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='tax_class',
+            field=models.CharField(choices=[('standard', 'Standard (16%)'), ('zero_rated', 'Zero-rated'), ('exempt', 'Exempt')], default='standard', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='Promotion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('kind', models.CharField(choices=[('bogo', 'Buy X get Y free'), ('multi_buy', 'X for a fixed price'), ('percent_off', 'Percent off')], max_length=20)),
+                ('buy_quantity', models.PositiveIntegerField(default=1)),
+                ('free_quantity', models.PositiveIntegerField(default=0)),
+                ('bundle_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('percent', models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True)),
+                ('starts_at', models.DateTimeField(blank=True, null=True)),
+                ('ends_at', models.DateTimeField(blank=True, null=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='promotions', to='pos.category')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='promotions', to='pos.product')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='promotion',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_items', to='pos.promotion'),
+        ),
+        migrations.RunPython(cart_tax, migrations.RunPython.noop),
+    ]
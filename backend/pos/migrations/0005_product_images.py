@@ -0,0 +1,24 @@
+# Generated by Django 5.0.4 on 2026-10-19 06:31
+
+import pos.images
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0004_promotions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_sizes',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=pos.images.ContentAddressedStorage(), upload_to='products/'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.0.4 on 2026-10-19 07:13
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+def opening_balances(apps, schema_editor):
+    # Points given out before the ledger existed become one folded adjustment
+    # per customer, so the ledger adds up to the balances it starts from
+    Customer = apps.get_model("pos", "Customer")
+    LoyaltyEntry = apps.get_model("pos", "LoyaltyEntry")
+    batch = uuid.uuid4()
+    balances = Customer.objects.exclude(loyalty_points=0).values_list("id", "loyalty_points").iterator(chunk_size=2000)
+    LoyaltyEntry.objects.bulk_create(
+        (LoyaltyEntry(customer_id=pk, kind="adjust", points=points, note="Opening balance", batch=batch)
+         for pk, points in balances),
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0006_jobs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='method',
+            field=models.CharField(choices=[('cash', 'Cash'), ('mpesa', 'M-Pesa'), ('card', 'Card'), ('split', 'Split'), ('loyalty', 'Loyalty points')], max_length=20),
+        ),
+        migrations.CreateModel(
+            name='LoyaltyEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('earn', 'Earned'), ('redeem', 'Redeemed'), ('reverse', 'Reversed'), ('refund', 'Refunded'), ('adjust', 'Adjustment')], max_length=10)),
+                ('points', models.IntegerField()),
+                ('note', models.CharField(blank=True, max_length=200)),
+                ('batch', models.UUIDField(blank=True, editable=False, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='loyalty_entries', to='pos.customer')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='loyalty_entries', to='pos.order')),
+            ],
+            options={
+                'verbose_name_plural': 'Loyalty entries',
+                'indexes': [models.Index(condition=models.Q(('batch__isnull', True)), fields=['id'], name='loyalty_unfolded_idx'), models.Index(fields=['customer', 'created_at'], name='loyalty_customer_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='loyaltyentry',
+            constraint=models.UniqueConstraint(condition=models.Q(('kind', 'earn')), fields=('order',), name='loyalty_one_earn_per_order'),
+        ),
+        migrations.RunPython(opening_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.0.4 on 2026-10-19 07:18
+
+from django.db import migrations, models
+
+from pos.customers import name_key, normalize_phone
+
+
+def backfill(apps, schema_editor):
+    Customer = apps.get_model("pos", "Customer")
+    batch = []
+    for customer in Customer.objects.only("id", "name", "phone").order_by("id").iterator(chunk_size=2000):
+        customer.phone_normalized = normalize_phone(customer.phone) or None
+        customer.name_key = name_key(customer.name)
+        batch.append(customer)
+        if len(batch) == 2000:
+            Customer.objects.bulk_update(batch, ["phone_normalized", "name_key"])
+            batch = []
+    Customer.objects.bulk_update(batch, ["phone_normalized", "name_key"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0007_loyalty'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='name_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='phone_normalized',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=20, null=True),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.4 on 2026-10-19 07:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0008_customer_lookup_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerSegment',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='segment', serialize=False, to='pos.customer')),
+                ('last_order_at', models.DateTimeField()),
+                ('frequency', models.IntegerField()),
+                ('monetary', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('recency_score', models.PositiveSmallIntegerField(db_default=0)),
+                ('frequency_score', models.PositiveSmallIntegerField(db_default=0)),
+                ('monetary_score', models.PositiveSmallIntegerField(db_default=0)),
+                ('segment', models.CharField(blank=True, choices=[('champions', 'Champions'), ('loyal', 'Loyal'), ('new', 'New'), ('promising', 'Promising'), ('at_risk', 'At risk'), ('hibernating', 'Hibernating'), ('lost', 'Lost')], db_default='', db_index=True, max_length=20)),
+                ('computed_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,132 @@
+# Generated by Django 5.0.4 on 2026-10-19 08:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def default_store(apps, schema_editor):
+    # Everything that exists so far happened at the one branch there was
+    Store = apps.get_model("pos", "Store")
+    Store.objects.get_or_create(code=settings.DEFAULT_STORE, defaults={"name": settings.DEFAULT_STORE_NAME})
+
+
+def copy_stock(apps, schema_editor):
+    Product = apps.get_model("pos", "Product")
+    StockLevel = apps.get_model("pos", "StockLevel")
+    store = apps.get_model("pos", "Store").objects.get(code=settings.DEFAULT_STORE)
+    levels = Product.objects.values_list("id", "stock_quantity").iterator(chunk_size=2000)
+    StockLevel.objects.bulk_create(
+        (StockLevel(store_id=store.pk, product_id=pk, quantity=quantity) for pk, quantity in levels),
+        batch_size=2000,
+    )
+
+
+def copy_stock_back(apps, schema_editor):
+    Product = apps.get_model("pos", "Product")
+    StockLevel = apps.get_model("pos", "StockLevel")
+    levels = StockLevel.objects.filter(store__code=settings.DEFAULT_STORE).values("product").order_by()
+    Product.objects.update(stock_quantity=models.Subquery(
+        levels.filter(product=models.OuterRef("pk")).values("quantity")[:1]
+    ))
+    Product.objects.filter(stock_quantity__isnull=True).update(stock_quantity=0)
+
+
+def assign_default_store(apps, schema_editor):
+    store = apps.get_model("pos", "Store").objects.get(code=settings.DEFAULT_STORE)
+    for name in ("Order", "StockMovement", "Cart"):
+        apps.get_model("pos", name).objects.filter(store=None).update(store=store)
+
+
+class Migration(migrations.Migration):
+    # The backfills commit on their own: PostgreSQL won't ALTER a table with
+    # deferred foreign key checks still pending from rows updated in the same
+    # transaction, which the NOT NULL store columns below would otherwise hit
+    atomic = False
+
+    dependencies = [
+        ('pos', '0009_customer_segments'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Store',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.SlugField(max_length=20, unique=True)),
+                ('name', models.CharField(max_length=100)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['code'],
+            },
+        ),
+        migrations.RunPython(default_store, migrations.RunPython.noop, atomic=True),
+        migrations.CreateModel(
+            name='StockLevel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_levels', to='pos.product')),
+                ('store', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='stock_levels', to='pos.store')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['store', 'updated_at'], name='stock_level_store_updated_idx')],
+                'constraints': [models.UniqueConstraint(fields=('store', 'product'), name='stock_level_store_product')],
+            },
+        ),
+        migrations.RunPython(copy_stock, copy_stock_back, atomic=True),
+        migrations.RemoveField(
+            model_name='product',
+            name='stock_quantity',
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='store',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='orders', to='pos.store'),
+        ),
+        migrations.AddField(
+            model_name='stockmovement',
+            name='store',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='stock_movements', to='pos.store'),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='store',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='carts', to='pos.store'),
+        ),
+        migrations.RunPython(assign_default_store, migrations.RunPython.noop, atomic=True),
+        migrations.AlterField(
+            model_name='order',
+            name='store',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='orders', to='pos.store'),
+        ),
+        migrations.AlterField(
+            model_name='stockmovement',
+            name='store',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='stock_movements', to='pos.store'),
+        ),
+        migrations.AlterField(
+            model_name='cart',
+            name='store',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='carts', to='pos.store'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['store', 'created_at'], name='order_store_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['store', 'status', 'created_at'], name='order_store_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['store', 'created_at'], name='movement_store_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['store', 'product', 'created_at'], name='movement_store_product_idx'),
+        ),
+    ]
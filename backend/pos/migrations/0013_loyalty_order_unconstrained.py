@@ -0,0 +1,19 @@
+# Generated by Django 5.0.4 on 2026-10-19 08:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0012_goods_receipts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='loyaltyentry',
+            name='order',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='loyalty_entries', to='pos.order'),
+        ),
+    ]
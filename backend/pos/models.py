@@ -1,8 +1,32 @@
 from django.db import models
+from django.db.models.functions import Now
 from django.contrib.auth.models import User
 from django.utils import timezone
+from decimal import Decimal
 import uuid
 
+from . import customers
+from .images import ContentAddressedStorage
+
+VAT_RATE = Decimal("0.16")  # 16% VAT Kenya
+
+
+class Store(models.Model):
+    """
+    A branch. Stock levels, orders, carts and stock movements belong to one
+    store; requests pick theirs by code (see pos.stores).
+    """
+    code = models.SlugField(max_length=20, unique=True)
+    name = models.CharField(max_length=100)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["code"]
+
+    def __str__(self):
+        return self.name
+
 
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -18,15 +42,21 @@ class Category(models.Model):
 
 
 class Product(models.Model):
+    class TaxClass(models.TextChoices):
+        STANDARD = "standard", "Standard (16%)"
+        ZERO_RATED = "zero_rated", "Zero-rated"
+        EXEMPT = "exempt", "Exempt"
+
     name = models.CharField(max_length=200)
     barcode = models.CharField(max_length=100, unique=True, blank=True, null=True)
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, related_name="products")
     price = models.DecimalField(max_digits=10, decimal_places=2)
     cost_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
-    stock_quantity = models.IntegerField(default=0)
     low_stock_threshold = models.IntegerField(default=10)
+    tax_class = models.CharField(max_length=20, choices=TaxClass.choices, default=TaxClass.STANDARD)
     is_active = models.BooleanField(default=True)
-    image = models.ImageField(upload_to="products/", blank=True, null=True)
+    image = models.ImageField(upload_to="products/", storage=ContentAddressedStorage(), blank=True, null=True)
+    image_sizes = models.JSONField(default=list, blank=True)  # thumbnail sizes rendered so far (pos.images)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -37,8 +67,69 @@ class Product(models.Model):
         return self.name
 
     @property
-    def is_low_stock(self):
-        return self.stock_quantity <= self.low_stock_threshold
+    def tax_rate(self):
+        return TAX_RATES[self.tax_class]
+
+
+TAX_RATES = {
+    Product.TaxClass.STANDARD: VAT_RATE,
+    Product.TaxClass.ZERO_RATED: Decimal("0"),
+    Product.TaxClass.EXEMPT: Decimal("0"),
+}
+
+
+class StockLevel(models.Model):
+    """
+    A product's stock at one store. A stock change locks and updates only
+    its own store's rows (see pos.stock), so branches never wait on each other.
+    """
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name="stock_levels", db_index=False)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="stock_levels")
+    quantity = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["store", "product"], name="stock_level_store_product"),
+        ]
+        indexes = [
+            # Catalog delta syncs: the store's levels that changed since the last one
+            models.Index(fields=["store", "updated_at"], name="stock_level_store_updated_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.product} @ {self.store}: {self.quantity}"
+
+
+class Promotion(models.Model):
+    """
+    A pricing rule on one product or on every product in a category. Rules
+    are compiled into an index by pos.pricing; each order line gets the
+    single best rule that applies to it.
+    """
+    class Kind(models.TextChoices):
+        BOGO = "bogo", "Buy X get Y free"
+        MULTI_BUY = "multi_buy", "X for a fixed price"
+        PERCENT_OFF = "percent_off", "Percent off"
+
+    name = models.CharField(max_length=200)
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, null=True, blank=True, related_name="promotions")
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, related_name="promotions")
+    buy_quantity = models.PositiveIntegerField(default=1)  # BOGO: pay for; multi-buy: bundle size
+    free_quantity = models.PositiveIntegerField(default=0)  # BOGO only
+    bundle_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)  # multi-buy only
+    percent = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)  # percent-off only
+    starts_at = models.DateTimeField(null=True, blank=True)
+    ends_at = models.DateTimeField(null=True, blank=True)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return self.name
 
 
 class Customer(models.Model):
@@ -46,11 +137,25 @@ class Customer(models.Model):
     phone = models.CharField(max_length=20, unique=True, blank=True, null=True)
     email = models.EmailField(blank=True, null=True)
     loyalty_points = models.IntegerField(default=0)
+    # Lookup keys kept in step with name and phone by save() (see pos.customers)
+    phone_normalized = models.CharField(max_length=20, blank=True, null=True, db_index=True, editable=False)
+    name_key = models.CharField(max_length=200, blank=True, db_index=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return self.name
 
+    def set_lookup_keys(self):
+        self.phone_normalized = customers.normalize_phone(self.phone) or None
+        self.name_key = customers.name_key(self.name)
+
+    def save(self, *args, **kwargs):
+        self.set_lookup_keys()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"name", "phone"} & set(update_fields):
+            kwargs["update_fields"] = {*update_fields, "phone_normalized", "name_key"}
+        super().save(*args, **kwargs)
+
 
 class Order(models.Model):
     class StatusChoices(models.TextChoices):
@@ -58,8 +163,11 @@ class Order(models.Model):
         COMPLETED = "completed", "Completed"
         CANCELLED = "cancelled", "Cancelled"
         REFUNDED = "refunded", "Refunded"
+        PARTIALLY_REFUNDED = "partially_refunded", "Partially Refunded"
 
     order_number = models.CharField(max_length=20, unique=True, editable=False)
+    # Indexed through the composite indexes below, which all lead with the store
+    store = models.ForeignKey(Store, on_delete=models.PROTECT, related_name="orders", db_index=False)
     customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, blank=True, related_name="orders")
     cashier = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name="orders")
     status = models.CharField(max_length=20, choices=StatusChoices.choices, default=StatusChoices.PENDING)
@@ -73,6 +181,10 @@ class Order(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["store", "created_at"], name="order_store_created_idx"),
+            models.Index(fields=["store", "status", "created_at"], name="order_store_status_idx"),
+        ]
 
     def __str__(self):
         return f"Order #{self.order_number}"
@@ -82,11 +194,10 @@ class Order(models.Model):
             self.order_number = f"MNG{timezone.now().strftime('%Y%m%d%H%M%S')}{str(uuid.uuid4().int)[:5]}"
         super().save(*args, **kwargs)
 
-    def calculate_totals(self):
-        from decimal import Decimal
-        items = self.items.all()
+    def calculate_totals(self, items=None):
+        items = self.items.all() if items is None else items
         self.subtotal = sum(item.total_price for item in items)
-        self.tax_amount = self.subtotal * Decimal("0.16")  # 16% VAT Kenya
+        self.tax_amount = sum(item.total_price * item.tax_rate for item in items)
         self.total_amount = self.subtotal + self.tax_amount - self.discount_amount
         self.save(update_fields=["subtotal", "tax_amount", "total_amount"])
 
@@ -97,16 +208,24 @@ class OrderItem(models.Model):
     quantity = models.IntegerField(default=1)
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
     discount = models.DecimalField(max_digits=5, decimal_places=2, default=0)  # percentage
+    returned_quantity = models.IntegerField(default=0)
+    promotion = models.ForeignKey("Promotion", on_delete=models.SET_NULL, null=True, blank=True, related_name="order_items")
+    promotion_discount = models.DecimalField(max_digits=10, decimal_places=2, default=0)  # amount, after `discount`
+    tax_rate = models.DecimalField(max_digits=5, decimal_places=4, default=VAT_RATE)
 
     def __str__(self):
         return f"{self.product.name} x {self.quantity}"
 
+    @property
+    def returnable_quantity(self):
+        return self.quantity - self.returned_quantity
+
     @property
     def total_price(self):
         price = self.unit_price * self.quantity
         if self.discount:
             price = price * (1 - self.discount / 100)
-        return price
+        return price - self.promotion_discount
 
 
 class Payment(models.Model):
@@ -115,6 +234,7 @@ class Payment(models.Model):
         MPESA = "mpesa", "M-Pesa"
         CARD = "card", "Card"
         SPLIT = "split", "Split"
+        LOYALTY = "loyalty", "Loyalty points"
 
     class StatusChoices(models.TextChoices):
         PENDING = "pending", "Pending"
@@ -136,6 +256,8 @@ class Payment(models.Model):
     # Cash specific
     cash_tendered = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     change_given = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    # Refunds point back at the payment they reverse
+    refund_of = models.ForeignKey("self", on_delete=models.SET_NULL, null=True, blank=True, related_name="refunds")
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -151,6 +273,7 @@ class StockMovement(models.Model):
         ADJUSTMENT = "adjustment", "Adjustment"
         RETURN = "return", "Return"
 
+    store = models.ForeignKey(Store, on_delete=models.PROTECT, related_name="stock_movements", db_index=False)
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="stock_movements")
     movement_type = models.CharField(max_length=20, choices=MovementType.choices)
     quantity = models.IntegerField()  # negative for sales/reductions
@@ -160,5 +283,267 @@ class StockMovement(models.Model):
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["store", "created_at"], name="movement_store_created_idx"),
+            models.Index(fields=["store", "product", "created_at"], name="movement_store_product_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.product.name} {self.movement_type} {self.quantity}"
+
+
+class GoodsReceipt(models.Model):
+    """
+    A supplier delivery booked into a store's stock (goods received note).
+    Its lines are restocked together; their RESTOCK movements carry the
+    grn_number as their reference (see pos.receiving).
+    """
+    grn_number = models.CharField(max_length=20, unique=True, editable=False)
+    store = models.ForeignKey(Store, on_delete=models.PROTECT, related_name="goods_receipts", db_index=False)
+    supplier = models.CharField(max_length=200)
+    supplier_reference = models.CharField(max_length=100, blank=True)  # delivery note or invoice number
+    total_cost = models.DecimalField(max_digits=12, decimal_places=2, default=0)  # of the lines with a unit cost
+    received_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name="goods_receipts")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [models.Index(fields=["store", "created_at"], name="receipt_store_created_idx")]
+
+    def __str__(self):
+        return f"GRN #{self.grn_number}"
+
+    def save(self, *args, **kwargs):
+        if not self.grn_number:
+            self.grn_number = f"GRN{timezone.now().strftime('%Y%m%d%H%M%S')}{str(uuid.uuid4().int)[:3]}"
+        super().save(*args, **kwargs)
+
+
+class GoodsReceiptItem(models.Model):
+    receipt = models.ForeignKey(GoodsReceipt, on_delete=models.CASCADE, related_name="items")
+    product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name="receipt_items")
+    quantity = models.IntegerField()
+    unit_cost = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.product.name} x {self.quantity}"
+
+
+class LoyaltyEntry(models.Model):
+    """
+    One change to a customer's points. The ledger is append-only; entries
+    are folded into Customer.loyalty_points in batches (see pos.loyalty).
+    """
+    class Kind(models.TextChoices):
+        EARN = "earn", "Earned"
+        REDEEM = "redeem", "Redeemed"
+        REVERSE = "reverse", "Reversed"  # earned points taken back for returned goods
+        REFUND = "refund", "Refunded"  # tendered points given back
+        ADJUST = "adjust", "Adjustment"
+
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name="loyalty_entries")
+    # No constraint: entries keep the id of an order moved to the archive (see pos.archive)
+    order = models.ForeignKey(
+        Order, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name="loyalty_entries",
+    )
+    kind = models.CharField(max_length=10, choices=Kind.choices)
+    points = models.IntegerField()  # negative when spent or taken back
+    note = models.CharField(max_length=200, blank=True)
+    # The fold that added this entry to the balance; null until then
+    batch = models.UUIDField(null=True, blank=True, editable=False)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name_plural = "Loyalty entries"
+        constraints = [
+            models.UniqueConstraint(fields=["order"], condition=models.Q(kind="earn"), name="loyalty_one_earn_per_order"),
+        ]
+        indexes = [
+            models.Index(fields=["id"], condition=models.Q(batch__isnull=True), name="loyalty_unfolded_idx"),
+            models.Index(fields=["customer", "created_at"], name="loyalty_customer_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.customer} {self.kind} {self.points}"
+
+
+class CustomerSegment(models.Model):
+    """
+    A customer's recency, frequency and monetary scores (1-5, 5 best) and the
+    segment they put them in. Rebuilt for every customer at once by
+    `manage.py segment_customers` (see pos.segments); customers without a
+    completed order have no row.
+    """
+    class Segment(models.TextChoices):
+        CHAMPIONS = "champions", "Champions"
+        LOYAL = "loyal", "Loyal"
+        NEW = "new", "New"
+        PROMISING = "promising", "Promising"
+        AT_RISK = "at_risk", "At risk"
+        HIBERNATING = "hibernating", "Hibernating"
+        LOST = "lost", "Lost"
+
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True, related_name="segment")
+    last_order_at = models.DateTimeField()
+    frequency = models.IntegerField()  # orders
+    monetary = models.DecimalField(max_digits=14, decimal_places=2)  # paid, net of refunds
+    recency_score = models.PositiveSmallIntegerField(db_default=0)
+    frequency_score = models.PositiveSmallIntegerField(db_default=0)
+    monetary_score = models.PositiveSmallIntegerField(db_default=0)
+    segment = models.CharField(max_length=20, choices=Segment.choices, blank=True, db_default="", db_index=True)
+    computed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.customer} {self.segment}"
+
+
+class Cart(models.Model):
+    """
+    A till's open basket with prices snapshotted at scan time. The live copy
+    is kept in the cache (see pos.carts); this row is the fallback when the
+    cache entry is gone.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name="carts")
+    cashier = models.ForeignKey(User, on_delete=models.CASCADE, related_name="carts")
+    customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, blank=True, related_name="carts")
+    discount_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # {"<product id>": {"product", "name", "quantity", "unit_price", "discount"}}
+    lines = models.JSONField(default=dict)
+    # Running sums of line totals and line VAT, exact (price 2dp x percentage
+    # discount 4dp x tax rate 4dp)
+    subtotal = models.DecimalField(max_digits=16, decimal_places=6, default=0)
+    tax_amount = models.DecimalField(max_digits=20, decimal_places=10, default=0)
+    version = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Cart {self.id}"
+
+
+class Job(models.Model):
+    """
+    A unit of background work (see pos.jobs). Enqueued in the same
+    transaction as the data it acts on, so it commits, or doesn't, with it.
+    """
+    class StatusChoices(models.TextChoices):
+        QUEUED = "queued", "Queued"
+        RUNNING = "running", "Running"
+        DONE = "done", "Done"
+        FAILED = "failed", "Failed"
+
+    queue = models.CharField(max_length=50, default="default")
+    task = models.CharField(max_length=200)
+    kwargs = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=StatusChoices.choices, default=StatusChoices.QUEUED)
+    # Not before this time: set on enqueue, pushed back by the retry backoff
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    # Visibility timeout: a running job whose lease expires is claimed again
+    timeout = models.PositiveIntegerField(default=300)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "queue", "run_at"], name="job_claim_idx"),
+            models.Index(fields=["status", "locked_until"], name="job_lease_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.task} [{self.status}]"
+
+
+# Archive: closed orders and stock movements past ARCHIVE_AFTER_DAYS, moved
+# out of the hot tables by `manage.py archive_history` (see pos.archive).
+# Same columns and primary keys as the tables they come from; references
+# outside the archive aren't constrained, so products, customers and users
+# can still be deleted.
+
+def _archived_ref(to, **kwargs):
+    return models.ForeignKey(to, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+", **kwargs)
+
+
+class ArchivedOrder(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order_number = models.CharField(max_length=20, unique=True)
+    store = _archived_ref(Store, db_index=False)
+    customer = _archived_ref(Customer, null=True)
+    cashier = _archived_ref(User, null=True, db_index=False)
+    status = models.CharField(max_length=20, choices=Order.StatusChoices.choices)
+    subtotal = models.DecimalField(max_digits=10, decimal_places=2)
+    discount_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    tax_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    notes = models.TextField(blank=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(db_default=Now())
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [models.Index(fields=["store", "created_at"], name="archived_order_store_idx")]
+
+    def __str__(self):
+        return f"Order #{self.order_number} (archived)"
+
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name="items")
+    product = _archived_ref(Product, db_index=False)
+    quantity = models.IntegerField()
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    discount = models.DecimalField(max_digits=5, decimal_places=2)
+    returned_quantity = models.IntegerField()
+    promotion = _archived_ref(Promotion, null=True, db_index=False)
+    promotion_discount = models.DecimalField(max_digits=10, decimal_places=2)
+    tax_rate = models.DecimalField(max_digits=5, decimal_places=4)
+
+
+class ArchivedPayment(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name="payments")
+    method = models.CharField(max_length=20, choices=Payment.MethodChoices.choices)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=20, choices=Payment.StatusChoices.choices)
+    mpesa_phone = models.CharField(max_length=15, null=True)
+    mpesa_checkout_request_id = models.CharField(max_length=100, null=True)
+    mpesa_merchant_request_id = models.CharField(max_length=100, null=True)
+    mpesa_receipt_number = models.CharField(max_length=50, null=True)
+    mpesa_transaction_date = models.DateTimeField(null=True)
+    cash_tendered = models.DecimalField(max_digits=10, decimal_places=2, null=True)
+    change_given = models.DecimalField(max_digits=10, decimal_places=2, null=True)
+    refund_of = _archived_ref("self", null=True, db_index=False)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+
+
+class ArchivedStockMovement(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    store = _archived_ref(Store, db_index=False)
+    product = _archived_ref(Product, db_index=False)
+    movement_type = models.CharField(max_length=20, choices=StockMovement.MovementType.choices)
+    quantity = models.IntegerField()
+    previous_stock = models.IntegerField()
+    new_stock = models.IntegerField()
+    reference = models.CharField(max_length=100, blank=True)
+    created_by = _archived_ref(User, null=True, db_index=False)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(db_default=Now())
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["store", "created_at"], name="archived_movement_store_idx"),
+            models.Index(fields=["store", "product", "created_at"], name="archived_movement_product_idx"),
+        ]
+
     def __str__(self):
-        return f"{self.product.name} {self.movement_type} {self.quantity}"
\ No newline at end of file
+        return f"{self.product_id} {self.movement_type} {self.quantity} (archived)"
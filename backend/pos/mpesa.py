@@ -0,0 +1,96 @@
+"""
+Daraja (M-Pesa) client calls shared by the payment views and jobs.
+
+STK pushes are sent from a job (see pos.jobs): the view records a pending
+payment, enqueues send_stk_push and returns, and the till follows the
+payment's status (/api/async/payments/<id>/status/) until the callback
+settles it.
+"""
+
+import base64
+import logging
+from datetime import datetime
+
+import requests
+from django.conf import settings
+
+from .jobs import task
+from .metrics import stage
+from .models import Payment
+
+logger = logging.getLogger(__name__)
+
+DARAJA_TIMEOUT = 30
+
+
+def base_url():
+    if settings.MPESA_ENVIRONMENT == "sandbox":
+        return "https://sandbox.safaricom.co.ke"
+    return "https://api.safaricom.co.ke"
+
+
+def get_mpesa_access_token():
+    url = f"{base_url()}/oauth/v1/generate?grant_type=client_credentials"
+    credentials = f"{settings.MPESA_CONSUMER_KEY}:{settings.MPESA_CONSUMER_SECRET}"
+    encoded = base64.b64encode(credentials.encode()).decode()
+    with stage("external"):
+        response = requests.get(url, headers={"Authorization": f"Basic {encoded}"}, timeout=DARAJA_TIMEOUT)
+    return response.json().get("access_token")
+
+
+def generate_password(shortcode, passkey, timestamp):
+    data = f"{shortcode}{passkey}{timestamp}"
+    return base64.b64encode(data.encode()).decode()
+
+
+def _stk_push_failed(kwargs, error):
+    Payment.objects.filter(pk=kwargs["payment_id"], status=Payment.StatusChoices.PENDING).update(
+        status=Payment.StatusChoices.FAILED
+    )
+
+
+@task(queue="payments", max_attempts=3, timeout=90, backoff=2, on_failure=_stk_push_failed)
+def send_stk_push(payment_id):
+    """
+    Ask Daraja to prompt the customer's phone for a pending payment. Network
+    errors raise and are retried; a push Daraja rejects fails the payment.
+    """
+    payment = Payment.objects.select_related("order").get(pk=payment_id)
+    if payment.status != Payment.StatusChoices.PENDING or payment.mpesa_checkout_request_id:
+        return  # settled or already pushed by an earlier attempt
+
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    shortcode = settings.MPESA_SHORTCODE
+    order_number = payment.order.order_number
+    payload = {
+        "BusinessShortCode": shortcode,
+        "Password": generate_password(shortcode, settings.MPESA_PASSKEY, timestamp),
+        "Timestamp": timestamp,
+        "TransactionType": "CustomerPayBillOnline",
+        "Amount": int(payment.amount),
+        "PartyA": payment.mpesa_phone,
+        "PartyB": shortcode,
+        "PhoneNumber": payment.mpesa_phone,
+        "CallBackURL": settings.MPESA_CALLBACK_URL,
+        "AccountReference": order_number,
+        "TransactionDesc": f"Payment for {order_number}",
+    }
+    access_token = get_mpesa_access_token()
+    with stage("external"):
+        response = requests.post(
+            f"{base_url()}/mpesa/stkpush/v1/processrequest",
+            json=payload,
+            headers={"Authorization": f"Bearer {access_token}"},
+            timeout=DARAJA_TIMEOUT,
+        )
+    res_data = response.json()
+
+    if res_data.get("ResponseCode") == "0":
+        Payment.objects.filter(pk=payment_id).update(
+            mpesa_checkout_request_id=res_data.get("CheckoutRequestID"),
+            mpesa_merchant_request_id=res_data.get("MerchantRequestID"),
+        )
+    else:
+        logger.warning("STK push for payment %s rejected: %s", payment_id,
+                       res_data.get("errorMessage") or res_data.get("ResponseDescription"))
+        _stk_push_failed({"payment_id": payment_id}, None)
@@ -0,0 +1,178 @@
+"""
+Promotions and pricing engine.
+
+Active Promotion rows are compiled once into an index keyed by product and
+by category, so pricing a line only looks at the rules that can apply to
+it: a basket is priced in O(lines + matched rules), however many
+promotions are running. Every rule here works on a single line (the same
+product bought several times). Rules don't stack; a line gets the rule that
+saves the customer the most.
+
+The compiled engine is kept per process and rebuilt when the Promotion data
+version changes (see pos.caching) or when a time-boxed rule starts or ends.
+"""
+
+import threading
+from collections import defaultdict
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.utils import timezone
+
+from .caching import data_version
+from .models import TAX_RATES, Promotion
+
+CENTS = Decimal("0.01")
+ZERO = Decimal("0")
+
+
+class Rule:
+    """A compiled promotion: just what's needed to price a line."""
+    __slots__ = ("id", "kind", "buy", "free", "bundle_price", "percent")
+
+    def __init__(self, id, kind, buy_quantity, free_quantity, bundle_price, percent):
+        self.id = id
+        self.kind = kind
+        self.buy = buy_quantity
+        self.free = free_quantity
+        self.bundle_price = bundle_price
+        self.percent = percent
+
+    def discount(self, quantity, unit_price):
+        if self.kind == Promotion.Kind.PERCENT_OFF:
+            return unit_price * quantity * self.percent / 100 if self.percent else ZERO
+        if self.kind == Promotion.Kind.BOGO:
+            # Buy `buy`, get `free` more of the same product for nothing
+            group = self.buy + self.free
+            return (quantity // group) * self.free * unit_price if group and self.free else ZERO
+        if self.kind == Promotion.Kind.MULTI_BUY:
+            # `buy` of the product for `bundle_price`
+            if not self.buy or self.bundle_price is None:
+                return ZERO
+            return max((quantity // self.buy) * (self.buy * unit_price - self.bundle_price), ZERO)
+        return ZERO
+
+
+class PricedLine:
+    __slots__ = ("promotion", "promotion_discount", "tax_rate", "total", "tax")
+
+    def __init__(self, promotion, promotion_discount, tax_rate, total):
+        self.promotion = promotion
+        self.promotion_discount = promotion_discount
+        self.tax_rate = tax_rate
+        self.total = total
+        self.tax = total * tax_rate
+
+
+class PricingEngine:
+    def __init__(self, rules=(), valid_until=None):
+        self.by_product = defaultdict(list)
+        self.by_category = defaultdict(list)
+        for product_id, category_id, rule in rules:
+            if product_id is not None:
+                self.by_product[product_id].append(rule)
+            elif category_id is not None:
+                self.by_category[category_id].append(rule)
+        for index in (self.by_product, self.by_category):
+            for key, bucket in index.items():
+                index[key] = self._prune(bucket)
+        # The next time a time-boxed rule starts or ends; the index is stale after it
+        self.valid_until = valid_until
+
+    @staticmethod
+    def _prune(rules):
+        """
+        Drop rules another rule on the same target always beats: only the
+        deepest percent-off, one BOGO per (buy, free) and the cheapest
+        multi-buy per bundle size can ever win.
+        """
+        best = {}
+        for rule in rules:
+            if rule.kind == Promotion.Kind.PERCENT_OFF:
+                key, rank = (rule.kind,), rule.percent or 0
+            elif rule.kind == Promotion.Kind.BOGO:
+                key, rank = (rule.kind, rule.buy, rule.free), 0
+            else:
+                key, rank = (rule.kind, rule.buy), -(rule.bundle_price or 0)
+            if key not in best or rank > best[key][0]:
+                best[key] = (rank, rule)
+        return [rule for _, rule in best.values()]
+
+    @classmethod
+    def compile(cls, at=None):
+        """Build the index from the promotions running at `at` (default now). One query."""
+        at = at or timezone.now()
+        rules, boundaries = [], []
+        promotions = Promotion.objects.filter(is_active=True).exclude(ends_at__lte=at).values_list(
+            "id", "product_id", "category_id", "kind", "buy_quantity", "free_quantity",
+            "bundle_price", "percent", "starts_at", "ends_at",
+        )
+        for pk, product_id, category_id, kind, buy, free, bundle_price, percent, starts_at, ends_at in promotions:
+            if starts_at is not None and starts_at > at:
+                boundaries.append(starts_at)
+                continue
+            if ends_at is not None:
+                boundaries.append(ends_at)
+            rules.append((product_id, category_id, Rule(pk, kind, buy, free, bundle_price, percent)))
+        return cls(rules, min(boundaries, default=None))
+
+    def best_rule(self, product_id, category_id, quantity, unit_price):
+        best, saving = None, ZERO
+        for rules in (self.by_product.get(product_id, ()), self.by_category.get(category_id, ())):
+            for rule in rules:
+                amount = rule.discount(quantity, unit_price)
+                if amount > saving:
+                    best, saving = rule, amount
+        return best, saving
+
+    def price_line(self, product_id, category_id, quantity, unit_price, tax_rate):
+        """
+        Price `quantity` x `unit_price` (already net of any manual line
+        discount) with the best matching promotion and the product's tax rate.
+        """
+        rule, saving = self.best_rule(product_id, category_id, quantity, unit_price)
+        gross = unit_price * quantity
+        saving = min(saving.quantize(CENTS, ROUND_HALF_UP), gross) if rule else ZERO
+        return PricedLine(rule.id if rule else None, saving, tax_rate, gross - saving)
+
+    def price_basket(self, lines):
+        """
+        Price (product_id, category_id, quantity, unit_price, tax_class)
+        lines. Returns the priced lines and the basket's subtotal and VAT.
+        """
+        priced, subtotal, tax = [], ZERO, ZERO
+        for product_id, category_id, quantity, unit_price, tax_class in lines:
+            line = self.price_line(product_id, category_id, quantity, unit_price, TAX_RATES[tax_class])
+            priced.append(line)
+            subtotal += line.total
+            tax += line.tax
+        return priced, subtotal, tax
+
+
+_lock = threading.Lock()
+_compiled = {}
+
+
+def get_engine():
+    """The compiled engine for the current promotions, rebuilt only when they change."""
+    version = data_version(Promotion)
+    engine = _compiled.get(version)
+    if engine is None or (engine.valid_until is not None and timezone.now() >= engine.valid_until):
+        with _lock:
+            engine = PricingEngine.compile()
+            _compiled.clear()
+            _compiled[version] = engine
+    return engine
+
+
+def apply_promotions(items):
+    """Price unsaved OrderItems (with their products loaded) in place."""
+    engine = get_engine()
+    for item in items:
+        unit_price = item.unit_price * (1 - item.discount / 100) if item.discount else item.unit_price
+        line = engine.price_line(
+            item.product.id, item.product.category_id, item.quantity, unit_price, item.product.tax_rate
+        )
+        item.promotion_id = line.promotion
+        item.promotion_discount = line.promotion_discount
+        item.tax_rate = line.tax_rate
+    return items
@@ -0,0 +1,286 @@
+"""
+On-demand request profiling and the slow-query log.
+
+ProfilingMiddleware profiles a request under cProfile and records every SQL
+statement it runs, with timings, when either
+  - a staff user sends `X-Profile: 1`, or
+  - the request is picked by PROFILE_SAMPLE_RATE (0.0-1.0, default off).
+The header is only honoured once the request's bearer token has been
+checked and found to belong to a staff user, before the profiler starts, so
+anyone else sending it costs no more than a token check.
+
+Independently, every query that takes SLOW_QUERY_MS or longer is logged to
+the `pos.slow_queries` logger with its EXPLAIN plan, whether or not it ran in
+a request.
+
+Profiles and slow queries are written as JSON (plus a .prof file per profile
+for snakeviz/pstats) to PROFILE_DIR, keeping the newest PROFILE_MAX_FILES
+records of each kind, so a burst of slow queries can't push out the request
+profiles or the other way round. `python manage.py profiles` lists and summarizes them.
+"""
+
+import cProfile
+import io
+import itertools
+import json
+import logging
+import os
+import pstats
+import random
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+
+from .authentication import CachedJWTAuthentication
+from .metrics import current_timings
+
+logger = logging.getLogger("pos.slow_queries")
+
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+TOP_FUNCTIONS = 40
+
+_sequence = itertools.count()
+
+
+class ProfileStore:
+    """A directory of JSON records, trimmed to the newest `max_files`."""
+
+    def __init__(self, directory=None, max_files=None):
+        self.directory = directory or settings.PROFILE_DIR
+        self.max_files = max_files or settings.PROFILE_MAX_FILES
+
+    def new_id(self, kind):
+        return f"{time.time_ns() // 1_000_000}-{os.getpid()}-{next(_sequence):06d}-{kind}"
+
+    def save(self, record, profiler=None):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, record["id"])
+        if profiler is not None:
+            profiler.dump_stats(path + ".prof")
+        tmp = f"{path}.json.tmp"
+        with open(tmp, "w") as f:
+            json.dump(record, f, default=str)
+        os.replace(tmp, path + ".json")
+        self.rotate(record["kind"])
+
+    def rotate(self, kind):
+        records = sorted(name for name in os.listdir(self.directory) if name.endswith(f"-{kind}.json"))
+        for name in records[:max(0, len(records) - self.max_files)]:
+            for path in (name, name[:-5] + ".prof"):
+                try:
+                    os.remove(os.path.join(self.directory, path))
+                except FileNotFoundError:
+                    pass
+
+    def records(self, kind=None):
+        if not os.path.isdir(self.directory):
+            return []
+        records = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(".json") and (kind is None or name.endswith(f"-{kind}.json")):
+                try:
+                    with open(os.path.join(self.directory, name)) as f:
+                        records.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        return records
+
+    def get(self, record_id):
+        with open(os.path.join(self.directory, f"{record_id}.json")) as f:
+            return json.load(f)
+
+    def clear(self):
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                os.remove(os.path.join(self.directory, name))
+
+
+def _now():
+    return datetime.now(dt_timezone.utc).isoformat(timespec="milliseconds")
+
+
+def explain(connection, sql, params):
+    """The query plan for `sql`, one line per row, or None if it can't be explained."""
+    if not sql.lstrip()[:6].upper().startswith(EXPLAINABLE):
+        return None
+    query = f"{connection.ops.explain_query_prefix()} {sql}"
+    # Without the execute wrappers the EXPLAIN is neither timed into the
+    # request nor checked for slowness itself
+    wrappers, connection.execute_wrappers = connection.execute_wrappers, []
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql" and connection.in_atomic_block:
+                # An error aborts a PostgreSQL transaction; keep a failed EXPLAIN from breaking the caller's
+                sid = connection.savepoint()
+                try:
+                    cursor.execute(query, params)
+                    rows = cursor.fetchall()
+                except Exception:
+                    connection.savepoint_rollback(sid)
+                    raise
+                connection.savepoint_commit(sid)
+            else:
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+        return [" | ".join(str(value) for value in row) for row in rows]
+    except Exception as exc:
+        return [f"EXPLAIN failed: {exc}"]
+    finally:
+        connection.execute_wrappers = wrappers
+
+
+def log_slow_query(connection, sql, params, many, elapsed):
+    plan = None if many else explain(connection, sql, params)
+    logger.warning(
+        "Slow query (%.1f ms) on %s: %s\n%s", elapsed * 1000, connection.alias, sql, "\n".join(plan or []),
+    )
+    store = ProfileStore()
+    store.save({
+        "id": store.new_id("query"),
+        "kind": "query",
+        "at": _now(),
+        "alias": connection.alias,
+        "duration_ms": round(elapsed * 1000, 3),
+        "sql": sql,
+        "params": repr(params)[:2000],
+        "explain": plan,
+    })
+
+
+def _bearer(request):
+    auth = CachedJWTAuthentication()
+    header = auth.get_header(request)
+    return auth, auth.get_raw_token(header) if header is not None else None
+
+
+def staff_caller(request):
+    """The staff user whose bearer token `request` carries, or None."""
+    auth, raw_token = _bearer(request)
+    if raw_token is None:
+        return None
+    try:
+        user = auth.get_user(auth.get_validated_token(raw_token))
+    except AuthenticationFailed:
+        return None
+    return user if user.is_staff else None
+
+
+async def astaff_caller(request):
+    """staff_caller for async requests: only a user cache miss goes to the database."""
+    auth, raw_token = _bearer(request)
+    if raw_token is None:
+        return None
+    try:
+        user = await auth.aget_user(auth.get_validated_token(raw_token))
+    except AuthenticationFailed:
+        return None
+    return user if user.is_staff else None
+
+
+def top_functions(profiler, limit=TOP_FUNCTIONS):
+    """The profile's most expensive functions by cumulative time."""
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = []
+    for (filename, line, name), (_cc, calls, tottime, cumtime, _callers) in stats.stats.items():
+        rows.append({
+            "function": f"{filename}:{line}({name})",
+            "calls": calls,
+            "tottime_ms": round(tottime * 1000, 3),
+            "cumtime_ms": round(cumtime * 1000, 3),
+        })
+    rows.sort(key=lambda row: row["cumtime_ms"], reverse=True)
+    return rows[:limit]
+
+
+class ProfilingMiddleware:
+    """
+    Place right after MetricsMiddleware, whose per-request timings it reads.
+    Under ASGI the profiler runs on the event loop's thread, so a profile of
+    an async view also holds whatever other requests ran while it awaited.
+    """
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        trigger = self.trigger(request)
+        if trigger == "header" and staff_caller(request) is None:
+            trigger = None
+        if trigger is None:
+            return self.get_response(request)
+
+        timings = current_timings()
+        timings.sql = []
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+            sql, timings.sql = timings.sql, None
+        return self.finish(request, response, trigger, profiler, sql, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        trigger = self.trigger(request)
+        if trigger == "header" and await astaff_caller(request) is None:
+            trigger = None
+        if trigger is None:
+            return await self.get_response(request)
+
+        timings = current_timings()
+        timings.sql = []
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiler.disable()
+            sql, timings.sql = timings.sql, None
+        return self.finish(request, response, trigger, profiler, sql, time.perf_counter() - start)
+
+    def trigger(self, request):
+        """"sample", "header" (if the caller turns out to be staff), or None."""
+        if current_timings() is None:
+            return None
+        if settings.PROFILE_SAMPLE_RATE and random.random() < settings.PROFILE_SAMPLE_RATE:
+            return "sample"
+        if request.META.get("HTTP_X_PROFILE") == "1":
+            return "header"
+        return None
+
+    def finish(self, request, response, trigger, profiler, sql, elapsed):
+        user = getattr(request, "user", None)
+        store = ProfileStore()
+        match = request.resolver_match
+        record = {
+            "id": store.new_id("request"),
+            "kind": "request",
+            "at": _now(),
+            "method": request.method,
+            "path": request.get_full_path(),
+            "endpoint": (match.view_name or match.url_name) if match else "unmatched",
+            "status": response.status_code,
+            "user": getattr(user, "username", None) or None,
+            "trigger": trigger,
+            "duration_ms": round(elapsed * 1000, 3),
+            "db_ms": round(sum(q[3] for q in sql) * 1000, 3),
+            "queries": [
+                {"sql": statement, "params": repr(params)[:500], "many": many, "ms": round(duration * 1000, 3)}
+                for statement, params, many, duration in sql
+            ],
+            "functions": top_functions(profiler),
+        }
+        store.save(record, profiler)
+        response["X-Profile-Id"] = record["id"]
+        return response
@@ -0,0 +1,92 @@
+"""
+Goods received: booking a supplier delivery into a store's stock.
+
+A delivery is one transaction however many lines it has (see pos.stock):
+one locked read of its products with their stock across every store, one
+UPDATE of the store's levels, one bulk_create each of receipt lines and
+RESTOCK movements and, with update_costs, one UPDATE folding the delivered
+unit costs into cost_price as a weighted average over the chain's stock
+before the delivery (cost_price is one price for all stores):
+
+    (on_hand * cost_price + received * unit_cost) / (on_hand + received)
+
+A store's stock below zero counts as none, so a delivery of a product
+that is only on oversold shelves takes the delivered cost.
+"""
+
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .caching import bump_version
+from .db import case_by_pk
+from .models import GoodsReceipt, GoodsReceiptItem, Product, StockLevel, StockMovement
+from .stock import apply_stock_changes
+
+CENTS = Decimal("0.01")
+
+
+class ReceivingError(Exception):
+    """Raised when a delivery can't be booked into stock."""
+
+
+def weighted_cost(on_hand, cost_price, received, unit_cost):
+    on_hand = max(on_hand, 0)
+    return ((on_hand * cost_price + received * unit_cost) / (on_hand + received)).quantize(CENTS)
+
+
+def receive_goods(store, lines, user, supplier, supplier_reference="", update_costs=True):
+    """
+    Book `lines` ([{"product": id, "quantity": n, "unit_cost": Decimal or
+    None}], one per product) into `store`'s stock as a GoodsReceipt.
+    """
+    quantities = {line["product"]: line["quantity"] for line in lines}
+    unit_costs = {line["product"]: line.get("unit_cost") for line in lines}
+
+    on_hand = (
+        StockLevel.objects.filter(product=OuterRef("pk"), quantity__gt=0)
+        .order_by().values("product").annotate(total=Sum("quantity")).values("total")
+    )
+    with transaction.atomic():
+        # Locked so that concurrent deliveries of a product average against each other's costs
+        products = (
+            Product.objects.select_for_update().filter(id__in=quantities).order_by("id")
+            .annotate(on_hand=Coalesce(Subquery(on_hand), Value(0)))
+        )
+        costs, stocked = {}, {}
+        for pk, cost_price, stock in products.values_list("id", "cost_price", "on_hand"):
+            costs[pk], stocked[pk] = cost_price, stock
+        missing = sorted(quantities.keys() - costs.keys())
+        if missing:
+            raise ReceivingError(f"Unknown product(s): {', '.join(map(str, missing))}")
+
+        receipt = GoodsReceipt.objects.create(
+            store=store,
+            supplier=supplier,
+            supplier_reference=supplier_reference,
+            received_by=user,
+            total_cost=sum((qty * unit_costs[pk] for pk, qty in quantities.items() if unit_costs[pk] is not None),
+                           Decimal("0")),
+        )
+        GoodsReceiptItem.objects.bulk_create([
+            GoodsReceiptItem(receipt=receipt, product_id=pk, quantity=qty, unit_cost=unit_costs[pk])
+            for pk, qty in quantities.items()
+        ])
+        apply_stock_changes(quantities, StockMovement.MovementType.RESTOCK, receipt.grn_number, user, store)
+
+        if update_costs:
+            averaged = {
+                pk: weighted_cost(stocked[pk], costs[pk], qty, unit_costs[pk])
+                for pk, qty in quantities.items() if unit_costs[pk] is not None
+            }
+            averaged = {pk: cost for pk, cost in averaged.items() if cost != costs[pk]}
+            if averaged:
+                Product.objects.filter(id__in=averaged).update(
+                    cost_price=case_by_pk(averaged, DecimalField(max_digits=10, decimal_places=2)),
+                    updated_at=timezone.now(),
+                )
+                bump_version(Product)
+    return receipt
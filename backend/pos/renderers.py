@@ -0,0 +1,43 @@
+"""
+orjson-backed drop-ins for DRF's JSONRenderer / JSONParser.
+
+The renderer produces the same bytes as rest_framework's JSONRenderer with the
+default settings (compact separators, UTF-8 output, \\u2028/\\u2029 escaped).
+Types orjson doesn't handle natively the same way — Decimal, datetimes, lazy
+strings, querysets — are delegated to DRF's own JSONEncoder.default. Indented
+output (browsable API, `; indent=` media types) falls back to the stdlib path.
+"""
+
+import orjson
+from rest_framework import parsers, renderers
+from rest_framework.exceptions import ParseError
+from rest_framework.utils import encoders
+
+from .metrics import stage
+
+_encoder = encoders.JSONEncoder()
+_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+class ORJSONRenderer(renderers.JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        with stage("serialize"):
+            if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+                return super().render(data, accepted_media_type, renderer_context)
+
+            ret = orjson.dumps(data, default=_encoder.default, option=_OPTIONS)
+            if b"\xe2\x80" in ret:
+                ret = ret.replace("\u2028".encode(), b"\\u2028").replace("\u2029".encode(), b"\\u2029")
+            return ret
+
+
+class ORJSONParser(parsers.JSONParser):
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError("JSON parse error - %s" % str(exc))
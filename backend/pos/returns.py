@@ -0,0 +1,165 @@
+"""
+Returns & refunds engine.
+
+Cancelling a pending order and refunding a completed one both come down to
+putting order lines back on the shelf of the store that sold them. That
+happens set-based (see pos.stock): one locked read of the affected levels,
+one UPDATE for stock, one UPDATE for the returned quantities on the lines
+and one bulk_create of RETURN movements — all inside a single transaction,
+regardless of how many lines the order has.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Q, Sum
+
+from . import loyalty
+from .db import case_by_pk
+from .models import Order, OrderItem, Payment, StockMovement
+from .stock import apply_stock_changes
+
+CENTS = Decimal("0.01")
+
+
+class ReturnError(Exception):
+    """Raised when a cancel/refund request can't be applied to an order."""
+
+
+def _lock_order(order):
+    return Order.objects.select_for_update().get(pk=order.pk)
+
+
+def _restock(order, items, quantities, user):
+    """Return `quantities` ({OrderItem.id: qty}) of `items` to stock."""
+    per_product = defaultdict(int)
+    for item_id, qty in quantities.items():
+        per_product[items[item_id].product_id] += qty
+
+    movements = apply_stock_changes(
+        per_product, StockMovement.MovementType.RETURN, order.order_number, user, order.store_id
+    )
+    OrderItem.objects.filter(id__in=quantities).update(
+        returned_quantity=F("returned_quantity") + case_by_pk(quantities)
+    )
+    for item_id, qty in quantities.items():
+        items[item_id].returned_quantity += qty
+    return movements
+
+
+def cancel_order(order, user):
+    """Cancel a not-yet-completed order and put all of its lines back on the shelf."""
+    with transaction.atomic():
+        order = _lock_order(order)
+        if order.status != Order.StatusChoices.PENDING:
+            raise ReturnError(f"Cannot cancel a {order.get_status_display().lower()} order")
+
+        items = {item.id: item for item in order.items.all()}
+        outstanding = {pk: item.returnable_quantity for pk, item in items.items() if item.returnable_quantity > 0}
+        if outstanding:
+            _restock(order, items, outstanding, user)
+
+        order.status = Order.StatusChoices.CANCELLED
+        order.save(update_fields=["status", "updated_at"])
+        loyalty.order_cancelled(order, user)
+    return order
+
+
+def _split(order, amount, totals, fully_returned, method=None):
+    """
+    [(method, amount, original payment)] refunding `amount` of `order`:
+    points tendered are given back as points in proportion to the share of
+    the order they paid for (all that's left of them on the last return), the
+    rest goes back to the largest money tender, or to `method` when given.
+    A `method` of loyalty gives the whole amount back as points.
+    """
+    points = Payment.MethodChoices.LOYALTY
+    completed = order.payments.filter(status=Payment.StatusChoices.COMPLETED)
+    outstanding = totals["points_paid"] - totals["points_refunded"]
+    if method == points:
+        in_points = amount
+    elif fully_returned or not order.total_amount:
+        in_points = min(outstanding, amount)
+    else:
+        in_points = min(outstanding, (amount * totals["points_paid"] / order.total_amount).quantize(CENTS))
+    in_money = amount - in_points
+
+    parts = []
+    if in_points > 0:
+        parts.append((points, in_points, completed.filter(method=points).order_by("-amount").first()))
+    if in_money > 0 or not parts:
+        original = completed.exclude(method=points).order_by("-amount").first()
+        parts.append((method or (original.method if original else Payment.MethodChoices.CASH), in_money, original))
+    return parts
+
+
+def refund_order(order, user, lines=None, method=None):
+    """
+    Return goods from a completed order and record the refund.
+
+    `lines` maps OrderItem ids to quantities being returned; leave it out to
+    return everything that hasn't been returned yet. The refund is the
+    returned lines' price with their own VAT rate, less their share of any
+    order-level discount. It is split across the order's tenders (see
+    _split) and written as REFUNDED Payments on the original order, each
+    linked to the payment it reverses; returns them.
+    """
+    with transaction.atomic():
+        order = _lock_order(order)
+        if order.status not in (Order.StatusChoices.COMPLETED, Order.StatusChoices.PARTIALLY_REFUNDED):
+            raise ReturnError("Only completed orders can be refunded")
+        if method == Payment.MethodChoices.LOYALTY and order.customer_id is None:
+            raise ReturnError("Only an order with a customer can be refunded as points")
+
+        items = {item.id: item for item in order.items.all()}
+        if lines is None:
+            quantities = {pk: item.returnable_quantity for pk, item in items.items() if item.returnable_quantity > 0}
+        else:
+            quantities = {}
+            for item_id, qty in lines.items():
+                item = items.get(item_id)
+                if item is None:
+                    raise ReturnError(f"Item {item_id} is not part of order {order.order_number}")
+                if qty <= 0 or qty > item.returnable_quantity:
+                    raise ReturnError(f"Item {item_id}: can return at most {item.returnable_quantity}")
+                quantities[item_id] = qty
+        if not quantities:
+            raise ReturnError("Nothing left to return on this order")
+
+        _restock(order, items, quantities, user)
+        fully_returned = all(item.returnable_quantity == 0 for item in items.values())
+
+        points = Q(method=Payment.MethodChoices.LOYALTY)
+        refunded = Q(status=Payment.StatusChoices.REFUNDED)
+        totals = {
+            name: total or Decimal("0")
+            for name, total in order.payments.aggregate(
+                refunded=Sum("amount", filter=refunded),
+                points_paid=Sum("amount", filter=points & Q(status=Payment.StatusChoices.COMPLETED)),
+                points_refunded=Sum("amount", filter=points & refunded),
+            ).items()
+        }
+        if fully_returned:
+            amount = order.total_amount - totals["refunded"]
+        elif order.subtotal + order.tax_amount:
+            # Each line with its own VAT, less its share of the order-level discount
+            returned_value = sum(
+                items[pk].total_price / items[pk].quantity * qty * (1 + items[pk].tax_rate)
+                for pk, qty in quantities.items()
+            )
+            amount = (returned_value * order.total_amount / (order.subtotal + order.tax_amount)).quantize(CENTS)
+        else:
+            amount = Decimal("0")
+
+        refunds = [
+            Payment.objects.create(
+                order=order, method=tender, amount=part, status=Payment.StatusChoices.REFUNDED, refund_of=original,
+            )
+            for tender, part, original in _split(order, max(amount, Decimal("0")), totals, fully_returned, method)
+        ]
+
+        order.status = Order.StatusChoices.REFUNDED if fully_returned else Order.StatusChoices.PARTIALLY_REFUNDED
+        order.save(update_fields=["status", "updated_at"])
+        loyalty.order_refunded(order, refunds, user)
+    return refunds
@@ -0,0 +1,122 @@
+"""
+Read-replica routing.
+
+Reads go to the primary unless the current request has opted in with
+`replica_reads()` — the ReplicaRoutingMiddleware does that for safe requests
+to views that set `replica_reads = True`. Even then a read stays on the
+primary when:
+
+  - no replica alias is configured,
+  - the primary connection is inside a transaction (read-your-writes),
+  - the replica is lagging more than DATABASE_REPLICA_MAX_LAG seconds or
+    can't be reached.
+
+Writes always go to the primary.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+_replica_reads = ContextVar("replica_reads", default=False)
+
+
+@contextmanager
+def replica_reads():
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    token = _replica_reads.set(False)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def replica_alias():
+    alias = getattr(settings, "DATABASE_REPLICA_ALIAS", "replica")
+    return alias if alias in settings.DATABASES else None
+
+
+def replica_lag(alias):
+    """Seconds the replica is behind the primary (0 where the engine can't tell)."""
+    connection = connections[alias]
+    if connection.vendor != "postgresql":
+        return 0.0
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+            "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+        )
+        return float(cursor.fetchone()[0])
+
+
+class ReplicaHealth:
+    """Per-process, rate-limited view of whether the replica is fit to serve reads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # alias -> (checked_at, healthy), written together once a probe is done
+        self._state = {}
+
+    def _fresh(self, alias):
+        state = self._state.get(alias)
+        interval = getattr(settings, "DATABASE_REPLICA_LAG_CHECK_INTERVAL", 2)
+        if state is not None and time.monotonic() - state[0] < interval:
+            return state
+        return None
+
+    def is_healthy(self, alias):
+        state = self._fresh(alias)
+        if state is not None:
+            return state[1]
+        with self._lock:
+            state = self._fresh(alias)
+            if state is not None:
+                return state[1]  # probed by another thread while this one waited
+            try:
+                healthy = replica_lag(alias) <= getattr(settings, "DATABASE_REPLICA_MAX_LAG", 5)
+            except DatabaseError:
+                healthy = False
+            self._state[alias] = (time.monotonic(), healthy)
+        return healthy
+
+    def reset(self):
+        with self._lock:
+            self._state.clear()
+
+
+health = ReplicaHealth()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get():
+            return None
+        alias = replica_alias()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if not health.is_healthy(alias):
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica follows the primary through replication, never migrate it directly
+        return db != replica_alias()
@@ -0,0 +1,391 @@
+"""
+Fast read path for list and detail endpoints.
+
+ModelSerializer walks its fields for every row — get_attribute, SkipField
+handling, to_representation — and ProductSerializer calls
+request.build_absolute_uri twice per product. The row builders here read
+plain dicts from queryset.values() and apply a mapping compiled once per
+request, producing exactly the data the serializers they mirror would
+(see FastReadTests), so views can opt in with `row_builder` without any
+change to the response.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.http import Http404
+from django.utils import timezone
+from django.utils.encoding import iri_to_uri
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from .images import thumbnail_name
+from .metrics import stage
+from .models import ArchivedOrder, ArchivedOrderItem, ArchivedPayment, Order, OrderItem, Payment
+
+CENTS = Decimal("0.01")
+RATE = Decimal("0.0001")
+
+
+def money(value):
+    # DecimalField(decimal_places=2) with COERCE_DECIMAL_TO_STRING
+    return None if value is None else "{:f}".format(value.quantize(CENTS))
+
+
+def rate(value):
+    # DecimalField(decimal_places=4)
+    return None if value is None else "{:f}".format(value.quantize(RATE))
+
+
+class RowBuilder:
+    """
+    Turns `.values()` dicts into API rows. Subclasses list the columns they
+    need in `values` and build each row in `row()`, keeping the key order of
+    the serializer they replace.
+    """
+    values = ()
+
+    def __init__(self, request):
+        self.request = request
+        self.tz = timezone.get_current_timezone() if settings.USE_TZ else None
+        self.base_uri = request.build_absolute_uri("/")[:-1] if request is not None else None
+
+    def datetime(self, value):
+        # DateTimeField(format=ISO_8601)
+        if not value:
+            return None
+        if self.tz is not None:
+            value = value.astimezone(self.tz)
+        value = value.isoformat()
+        if value.endswith("+00:00"):
+            value = value[:-6] + "Z"
+        return value
+
+    def file_url(self, name):
+        # FileField/ImageField with UPLOADED_FILES_USE_URL; build_absolute_uri
+        # without re-validating the host for every row
+        if not name:
+            return None
+        url = default_storage.url(name)
+        if self.request is None:
+            return url
+        if url.startswith("/") and not url.startswith("//") and "/./" not in url and "/../" not in url:
+            return iri_to_uri(self.base_uri + url)
+        return self.request.build_absolute_uri(url)
+
+    def prepare(self, queryset):
+        return queryset.prefetch_related(None).values(*self.values)
+
+    def prepare_union(self, queryset, archived):
+        """
+        prepare() of hot and archived rows (pos.archive) as one UNION, newest
+        first. Both have the same columns, so the rows come out the same.
+        """
+        return (
+            self.prepare(queryset).order_by()
+            .union(self.prepare(archived).order_by(), all=True)
+            .order_by("-created_at", "-id")
+        )
+
+    def build(self, rows):
+        return [self.row(values) for values in rows]
+
+    def row(self, values):
+        raise NotImplementedError
+
+
+class ProductRows(RowBuilder):
+    """Mirrors ProductSerializer. The queryset must carry pos.stores.with_stock()."""
+    values = (
+        "id", "name", "barcode", "category_id", "category__name", "price", "cost_price",
+        "stock_quantity", "low_stock_threshold", "tax_class", "is_active", "image", "image_sizes", "created_at", "updated_at",
+    )
+
+    def row(self, v):
+        row = {
+            "id": v["id"],
+            "name": v["name"],
+            "barcode": v["barcode"],
+            "category": v["category_id"],
+        }
+        # category.name is skipped entirely, not null, when there's no category
+        if v["category_id"] is not None:
+            row["category_name"] = v["category__name"]
+        image = self.file_url(v["image"])
+        row.update({
+            "price": money(v["price"]),
+            "cost_price": money(v["cost_price"]),
+            "stock_quantity": v["stock_quantity"],
+            "low_stock_threshold": v["low_stock_threshold"],
+            "tax_class": v["tax_class"],
+            "is_active": v["is_active"],
+            "is_low_stock": v["stock_quantity"] <= v["low_stock_threshold"],
+            "image": image,
+            "image_url": image,
+            "image_urls": {
+                str(size): self.file_url(thumbnail_name(v["image"], size)) for size in v["image_sizes"]
+            } if image and self.request is not None else {},
+            "created_at": self.datetime(v["created_at"]),
+            "updated_at": self.datetime(v["updated_at"]),
+        })
+        return row
+
+
+class CustomerRows(RowBuilder):
+    """Mirrors CustomerSerializer."""
+    values = ("id", "name", "phone", "email", "loyalty_points", "created_at")
+
+    def row(self, v):
+        return {
+            "id": v["id"],
+            "name": v["name"],
+            "phone": v["phone"],
+            "email": v["email"],
+            "loyalty_points": v["loyalty_points"],
+            "created_at": self.datetime(v["created_at"]),
+        }
+
+
+class StockMovementRows(RowBuilder):
+    """Mirrors StockMovementSerializer."""
+    values = (
+        "id", "store_id", "product_id", "product__name", "movement_type", "quantity", "previous_stock", "new_stock",
+        "reference", "created_by_id", "created_by__first_name", "created_by__last_name", "created_at",
+    )
+
+    def row(self, v):
+        row = {
+            "id": v["id"],
+            "store": v["store_id"],
+            "product": v["product_id"],
+            "product_name": v["product__name"],
+            "movement_type": v["movement_type"],
+            "quantity": v["quantity"],
+            "previous_stock": v["previous_stock"],
+            "new_stock": v["new_stock"],
+            "reference": v["reference"],
+        }
+        # created_by.get_full_name is skipped when the FK is null
+        if v["created_by_id"] is not None:
+            row["created_by_name"] = f"{v['created_by__first_name']} {v['created_by__last_name']}".strip()
+        row["created_at"] = self.datetime(v["created_at"])
+        return row
+
+
+class OrderRows(RowBuilder):
+    """
+    Mirrors OrderSerializer, including nested items and payments.
+
+    `fields` picks which keys each row carries, in that order. Columns,
+    annotations and the item/payment queries are only fetched for fields
+    that need them, so a slim list never touches order_items or payments.
+    `item_count` and `payment_method` aren't serializer fields: they're the
+    summary the order history shows instead of the nested lists.
+    """
+    FIELDS = (
+        "id", "order_number", "store", "customer", "customer_name", "cashier", "cashier_name", "status",
+        "subtotal", "discount_amount", "tax_amount", "total_amount", "notes", "items", "payments",
+        "created_at", "updated_at",
+    )
+    SUMMARY_FIELDS = (
+        "id", "order_number", "customer", "customer_name", "cashier_name", "status",
+        "total_amount", "item_count", "payment_method", "created_at",
+    )
+    AVAILABLE_FIELDS = FIELDS + ("item_count", "payment_method")
+    MONEY = {"subtotal", "discount_amount", "tax_amount", "total_amount"}
+    DATETIMES = {"created_at", "updated_at"}
+
+    columns = {
+        "id": ("id",),
+        "order_number": ("order_number",),
+        "store": ("store_id",),
+        "customer": ("customer_id",),
+        "customer_name": ("customer_id", "customer__name"),
+        "cashier": ("cashier_id",),
+        "cashier_name": ("cashier_id", "cashier__first_name", "cashier__last_name"),
+        "status": ("status",),
+        "subtotal": ("subtotal",),
+        "discount_amount": ("discount_amount",),
+        "tax_amount": ("tax_amount",),
+        "total_amount": ("total_amount",),
+        "notes": ("notes",),
+        "item_count": ("item_count",),
+        "payment_method": ("payment_method",),
+        "created_at": ("created_at",),
+        "updated_at": ("updated_at",),
+    }
+    item_values = (
+        "id", "order_id", "product_id", "product__name", "quantity", "returned_quantity",
+        "unit_price", "discount", "promotion_id", "promotion_discount", "tax_rate",
+    )
+    payment_values = (
+        "id", "order_id", "method", "amount", "status", "mpesa_phone", "mpesa_checkout_request_id",
+        "mpesa_receipt_number", "mpesa_transaction_date", "cash_tendered", "change_given",
+        "refund_of_id", "created_at", "updated_at",
+    )
+
+    def __init__(self, request, fields=None):
+        super().__init__(request)
+        self.fields = tuple(fields) if fields else self.FIELDS
+        # "id" is always read: the nested lists are grouped by it; "created_at"
+        # orders the archive UNION
+        self.values = tuple(dict.fromkeys(
+            ("id", "created_at") + tuple(c for name in self.fields for c in self.columns.get(name, ()))
+        ))
+        self.archived = False
+
+    def prepare(self, queryset):
+        queryset = queryset.prefetch_related(None)
+        item_model, payment_model = OrderItem, Payment
+        if queryset.model is ArchivedOrder:
+            item_model, payment_model = ArchivedOrderItem, ArchivedPayment
+            self.archived = True
+        if "item_count" in self.fields:
+            # A correlated count rather than Count("items"): no GROUP BY, so the
+            # model ordering survives and only the rows on the page are counted
+            lines = item_model.objects.filter(order=OuterRef("pk")).order_by().values("order")
+            count = Subquery(lines.annotate(n=Count("*")).values("n"))
+            queryset = queryset.annotate(item_count=Coalesce(count, 0))
+        if "payment_method" in self.fields:
+            first_payment = payment_model.objects.filter(order=OuterRef("pk")).order_by("id")
+            queryset = queryset.annotate(payment_method=Subquery(first_payment.values("method")[:1]))
+        return queryset.values(*self.values)
+
+    def build(self, rows):
+        rows = list(rows)
+        ids = [v["id"] for v in rows]
+        items, payments = defaultdict(list), defaultdict(list)
+        # Archived orders keep their ids, so a page can take lines from both tables
+        item_models = (OrderItem, ArchivedOrderItem) if self.archived else (OrderItem,)
+        payment_models = (Payment, ArchivedPayment) if self.archived else (Payment,)
+        if "items" in self.fields:
+            for model in item_models:
+                for v in model.objects.filter(order_id__in=ids).order_by("id").values(*self.item_values):
+                    items[v["order_id"]].append(self.item(v))
+        if "payments" in self.fields:
+            for model in payment_models:
+                for v in model.objects.filter(order_id__in=ids).order_by("id").values(*self.payment_values):
+                    payments[v["order_id"]].append(self.payment(v))
+        return [self.row(v, items[v["id"]], payments[v["id"]]) for v in rows]
+
+    def item(self, v):
+        total = v["unit_price"] * v["quantity"]
+        if v["discount"]:
+            total = total * (1 - v["discount"] / 100)
+        total -= v["promotion_discount"]
+        return {
+            "id": v["id"],
+            "product": v["product_id"],
+            "product_name": v["product__name"],
+            "quantity": v["quantity"],
+            "returned_quantity": v["returned_quantity"],
+            "unit_price": money(v["unit_price"]),
+            "discount": money(v["discount"]),
+            "promotion": v["promotion_id"],
+            "promotion_discount": money(v["promotion_discount"]),
+            "tax_rate": rate(v["tax_rate"]),
+            "total_price": money(total),
+        }
+
+    def payment(self, v):
+        return {
+            "id": v["id"],
+            "order": v["order_id"],
+            "method": v["method"],
+            "amount": money(v["amount"]),
+            "status": v["status"],
+            "mpesa_phone": v["mpesa_phone"],
+            "mpesa_checkout_request_id": v["mpesa_checkout_request_id"],
+            "mpesa_receipt_number": v["mpesa_receipt_number"],
+            "mpesa_transaction_date": self.datetime(v["mpesa_transaction_date"]),
+            "cash_tendered": money(v["cash_tendered"]),
+            "change_given": money(v["change_given"]),
+            "refund_of": v["refund_of_id"],
+            "created_at": self.datetime(v["created_at"]),
+            "updated_at": self.datetime(v["updated_at"]),
+        }
+
+    def row(self, v, items=(), payments=()):
+        row = {}
+        for name in self.fields:
+            if name == "customer_name":
+                # customer.name / cashier.get_full_name are skipped when the FK is null
+                if v["customer_id"] is not None:
+                    row[name] = v["customer__name"]
+            elif name == "cashier_name":
+                if v["cashier_id"] is not None:
+                    row[name] = f"{v['cashier__first_name']} {v['cashier__last_name']}".strip()
+            elif name in ("store", "customer", "cashier"):
+                row[name] = v[name + "_id"]
+            elif name in self.MONEY:
+                row[name] = money(v[name])
+            elif name in self.DATETIMES:
+                row[name] = self.datetime(v[name])
+            elif name == "items":
+                row[name] = items
+            elif name == "payments":
+                row[name] = payments
+            else:
+                row[name] = v[name]
+        return row
+
+
+def requested_fields(request, available, default):
+    """`?fields=a,b` replaces the default field list, `?expand=c,d` adds to it."""
+    fields = request.query_params.get("fields")
+    selected = [f.strip() for f in fields.split(",") if f.strip()] if fields else list(default)
+    for name in request.query_params.get("expand", "").split(","):
+        name = name.strip()
+        if name and name not in selected:
+            selected.append(name)
+    unknown = [f for f in selected if f not in available]
+    if unknown:
+        raise ValidationError({"fields": [f"Unknown field(s): {', '.join(unknown)}"]})
+    return list(dict.fromkeys(selected))
+
+
+def order_data(request, order_id):
+    """Single order in OrderSerializer's shape, in three queries."""
+    builder = OrderRows(request)
+    return builder.build(builder.prepare(Order.objects.filter(pk=order_id)))[0]
+
+
+class FastReadMixin:
+    """
+    Opt-in fast path for `list` and `retrieve`: rows come from
+    `row_builder` instead of the serializer. Writes still go through the
+    regular serializers.
+    """
+    row_builder = None
+
+    def get_row_builder(self):
+        return self.row_builder(self.request)
+
+    def get_rows(self, builder):
+        return builder.prepare(self.filter_queryset(self.get_queryset()))
+
+    def get_row(self, builder, key):
+        return self.get_rows(builder).filter(**{self.lookup_field: key}).first()
+
+    def list(self, request, *args, **kwargs):
+        builder = self.get_row_builder()
+        queryset = self.get_rows(builder)
+        page = self.paginate_queryset(queryset)
+        with stage("serialize"):
+            rows = builder.build(queryset if page is None else page)
+        if page is not None:
+            return self.get_paginated_response(rows)
+        return Response(rows)
+
+    def retrieve(self, request, *args, **kwargs):
+        builder = self.get_row_builder()
+        values = self.get_row(builder, kwargs[self.lookup_url_kwarg or self.lookup_field])
+        if values is None:
+            raise Http404
+        with stage("serialize"):
+            row = builder.build([values])[0]
+        return Response(row)
@@ -0,0 +1,111 @@
+"""
+RFM customer segments.
+
+Every customer with a completed order is scored 1-5 on recency (their last
+order), frequency (orders) and monetary value (paid, net of refunds) by the
+quintile of the score among all customers, and put in a segment by their
+scores. `python manage.py segment_customers` rebuilds the CustomerSegment
+table nightly; the customer endpoints filter on it (?segment=).
+
+The rebuild is set-based whatever the number of customers: one INSERT ...
+SELECT aggregating the orders per customer, a query per metric for its
+quintile cutoffs, and two UPDATEs binning every row against them.
+"""
+
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, Max, Q, Sum, Value, When, Window
+from django.db.models.functions import Coalesce, RowNumber
+from django.utils import timezone
+
+from .caching import bump_version
+from .db import insert_select
+from .models import CustomerSegment, Order, Payment
+
+BINS = 5
+PURCHASE_STATUSES = (Order.StatusChoices.COMPLETED, Order.StatusChoices.PARTIALLY_REFUNDED)
+SCORES = {"last_order_at": "recency_score", "frequency": "frequency_score", "monetary": "monetary_score"}
+
+# First match wins; anyone left over is LOST
+Segment = CustomerSegment.Segment
+RULES = [
+    (Segment.NEW, Q(recency_score__gte=4, frequency=1)),
+    (Segment.CHAMPIONS, Q(recency_score__gte=4, frequency_score__gte=4, monetary_score__gte=4)),
+    (Segment.LOYAL, Q(recency_score__gte=3, frequency_score__gte=3)),
+    (Segment.PROMISING, Q(recency_score__gte=3)),
+    (Segment.AT_RISK, Q(frequency_score__gte=3)),
+    (Segment.HIBERNATING, Q(recency_score=2)),
+]
+
+
+def _totals(now, using):
+    zero = Value(Decimal("0"), output_field=DecimalField())
+    paid = Sum("payments__amount", filter=Q(payments__status=Payment.StatusChoices.COMPLETED))
+    refunded = Sum("payments__amount", filter=Q(payments__status=Payment.StatusChoices.REFUNDED))
+    return (
+        Order.objects.using(using)
+        .filter(status__in=PURCHASE_STATUSES, customer__isnull=False)
+        .values("customer")
+        .annotate(
+            s_last=Max("created_at"),
+            s_frequency=Count("id", distinct=True),
+            s_monetary=Coalesce(paid, zero) - Coalesce(refunded, zero),
+            s_computed_at=Value(now, output_field=CustomerSegment._meta.get_field("computed_at")),
+        )
+        .values("customer", "s_last", "s_frequency", "s_monetary", "s_computed_at")
+        .order_by()
+    )
+
+
+def cutoffs(queryset, field, count):
+    """
+    The values at which `field`'s score steps up. A value scores 1 plus the
+    number of cutoffs it is above: the quintile its rank falls in, with tied
+    values sharing the lowest one (most customers have a single order, and
+    that shouldn't count as average frequency).
+    """
+    # A value is past the bottom k/BINS of the rows once it exceeds the row at that rank
+    positions = [-(-count * k // BINS) for k in range(1, BINS)]
+    ranked = (
+        queryset.annotate(position=Window(RowNumber(), order_by=[F(field).asc(), F("pk").asc()]))
+        .filter(position__in=positions)
+        .values_list("position", field)
+    )
+    values = dict(ranked)
+    return [values[position] for position in positions]
+
+
+def score(field, steps):
+    """CASE binning `field` by `steps`, ascending cutoffs from cutoffs()."""
+    whens = [When(**{f"{field}__gt": step, "then": Value(k + 2)}) for k, step in reversed(list(enumerate(steps)))]
+    return Case(*whens, default=Value(1))
+
+
+def rebuild(using="default"):
+    """Recompute every customer's scores and segment. Returns {segment: customers}."""
+    now = timezone.now()
+    with transaction.atomic(using=using):
+        segments = CustomerSegment.objects.using(using)
+        segments.all().delete()
+        count = insert_select(
+            CustomerSegment, ["customer", "last_order_at", "frequency", "monetary", "computed_at"],
+            _totals(now, using), using,
+        )
+        if count:
+            segments.update(**{
+                name: score(field, cutoffs(segments, field, count)) for field, name in SCORES.items()
+            })
+            segments.update(segment=Case(
+                *[When(rule, then=Value(segment)) for segment, rule in RULES], default=Value(Segment.LOST),
+            ))
+        bump_version(CustomerSegment, using=using)
+    return counts(using)
+
+
+def counts(using="default"):
+    """Customers per segment, every segment included."""
+    found = dict(
+        CustomerSegment.objects.using(using).order_by().values_list("segment").annotate(Count("customer"))
+    )
+    return {segment: found.get(segment, 0) for segment in Segment.values}
@@ -1,6 +1,19 @@
+from collections.abc import Mapping
+from decimal import Decimal
+
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Category, Product, Customer, Order, OrderItem, Payment, StockMovement
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from .models import (
+    Category, Product, Customer, Order, OrderItem, Payment, StockMovement, Promotion, LoyaltyEntry, Store,
+    GoodsReceipt, GoodsReceiptItem,
+)
+from .customers import phone_lookup
+from .images import thumbnail_name
+from .pricing import apply_promotions
+from .stock import deduct_stock, set_levels
+from .stores import current_store
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -9,6 +22,12 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ["id", "username", "first_name", "last_name", "email"]
 
 
+class StoreSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Store
+        fields = ["id", "code", "name"]
+
+
 class CategorySerializer(serializers.ModelSerializer):
     product_count = serializers.SerializerMethodField()
 
@@ -17,34 +36,84 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ["id", "name", "description", "product_count", "created_at"]
 
     def get_product_count(self, obj):
+        # CategoryViewSet annotates this; fall back to a query for single instances
+        if hasattr(obj, "active_product_count"):
+            return obj.active_product_count
         return obj.products.filter(is_active=True).count()
 
 
 class ProductSerializer(serializers.ModelSerializer):
     category_name = serializers.CharField(source="category.name", read_only=True)
-    is_low_stock = serializers.BooleanField(read_only=True)
+    # At the request's store: ProductViewSet annotates it (pos.stores.with_stock), writes set it
+    stock_quantity = serializers.IntegerField(required=False)
+    is_low_stock = serializers.SerializerMethodField()
     image_url = serializers.SerializerMethodField()
+    image_urls = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
         fields = [
             "id", "name", "barcode", "category", "category_name",
             "price", "cost_price", "stock_quantity", "low_stock_threshold",
-            "is_active", "is_low_stock", "image", "image_url",
+            "tax_class", "is_active", "is_low_stock", "image", "image_url", "image_urls",
             "created_at", "updated_at"
         ]
 
+    @transaction.atomic
+    def create(self, validated_data):
+        quantity = validated_data.pop("stock_quantity", 0)
+        product = super().create(validated_data)
+        self.set_stock(product, quantity)
+        return product
+
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        quantity = validated_data.pop("stock_quantity", None)
+        product = super().update(instance, validated_data)
+        if quantity is not None:
+            self.set_stock(product, quantity)
+        return product
+
+    def set_stock(self, product, quantity):
+        set_levels(current_store(self.context["request"]), {product.pk: quantity})
+        product.stock_quantity = quantity
+
+    def get_is_low_stock(self, obj):
+        return obj.stock_quantity <= obj.low_stock_threshold
+
     def get_image_url(self, obj):
         request = self.context.get("request")
         if obj.image and request:
             return request.build_absolute_uri(obj.image.url)
         return None
 
+    def get_image_urls(self, obj):
+        # {"<size>": url} for the thumbnails rendered so far
+        request = self.context.get("request")
+        if not (obj.image and request):
+            return {}
+        return {
+            str(size): request.build_absolute_uri(obj.image.storage.url(thumbnail_name(obj.image.name, size)))
+            for size in obj.image_sizes
+        }
+
 
 class CustomerSerializer(serializers.ModelSerializer):
+    segment = serializers.CharField(source="segment.segment", read_only=True)  # null until segmented
+
     class Meta:
         model = Customer
-        fields = ["id", "name", "phone", "email", "loyalty_points", "created_at"]
+        fields = ["id", "name", "phone", "email", "loyalty_points", "segment", "created_at"]
+        read_only_fields = ["loyalty_points"]  # moved by the ledger (pos.loyalty)
+
+    def validate_phone(self, value):
+        # The same number typed another way is the same customer
+        duplicate = Customer.objects.filter(phone_lookup(value))
+        if value and self.instance is not None:
+            duplicate = duplicate.exclude(pk=self.instance.pk)
+        if value and duplicate.exists():
+            raise serializers.ValidationError("customer with this phone already exists.")
+        return value
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
@@ -53,10 +122,28 @@ class OrderItemSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = OrderItem
-        fields = ["id", "product", "product_name", "quantity", "unit_price", "discount", "total_price"]
+        fields = [
+            "id", "product", "product_name", "quantity", "returned_quantity",
+            "unit_price", "discount", "promotion", "promotion_discount", "tax_rate", "total_price"
+        ]
+
+
+class BasketProductField(serializers.PrimaryKeyRelatedField):
+    """Resolves products from the basket-wide lookup OrderCreateSerializer does up front."""
+
+    def to_internal_value(self, data):
+        products = self.context.get("basket_products")
+        if products is not None:
+            try:
+                return products[int(data)]
+            except (KeyError, TypeError, ValueError):
+                pass
+        return super().to_internal_value(data)
 
 
 class OrderItemCreateSerializer(serializers.ModelSerializer):
+    product = BasketProductField(queryset=Product.objects.all())
+
     class Meta:
         model = OrderItem
         fields = ["product", "quantity", "unit_price", "discount"]
@@ -69,11 +156,11 @@ class PaymentSerializer(serializers.ModelSerializer):
             "id", "order", "method", "amount", "status",
             "mpesa_phone", "mpesa_checkout_request_id", "mpesa_receipt_number",
             "mpesa_transaction_date", "cash_tendered", "change_given",
-            "created_at", "updated_at"
+            "refund_of", "created_at", "updated_at"
         ]
         read_only_fields = [
             "mpesa_checkout_request_id", "mpesa_merchant_request_id",
-            "mpesa_receipt_number", "mpesa_transaction_date"
+            "mpesa_receipt_number", "mpesa_transaction_date", "refund_of"
         ]
 
 
@@ -86,12 +173,12 @@ class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = [
-            "id", "order_number", "customer", "customer_name",
+            "id", "order_number", "store", "customer", "customer_name",
             "cashier", "cashier_name", "status",
             "subtotal", "discount_amount", "tax_amount", "total_amount",
             "notes", "items", "payments", "created_at", "updated_at"
         ]
-        read_only_fields = ["order_number", "cashier", "subtotal", "tax_amount", "total_amount"]
+        read_only_fields = ["order_number", "store", "cashier", "subtotal", "tax_amount", "total_amount"]
 
 
 class OrderCreateSerializer(serializers.ModelSerializer):
@@ -101,32 +188,98 @@ class OrderCreateSerializer(serializers.ModelSerializer):
         model = Order
         fields = ["customer", "discount_amount", "notes", "items"]
 
+    def to_internal_value(self, data):
+        # One query for every product in the basket instead of one per line. A body
+        # or items of the wrong shape skip it and fail validation below with a 400
+        lines = data.get("items") if isinstance(data, Mapping) else None
+        ids = [line.get("product") for line in lines if isinstance(line, Mapping)] if isinstance(lines, list) else []
+        ids = [pk for pk in ids if str(pk).isdigit()]
+        self.context["basket_products"] = Product.objects.in_bulk(ids)
+        return super().to_internal_value(data)
+
+    @transaction.atomic
     def create(self, validated_data):
         items_data = validated_data.pop("items")
         request = self.context.get("request")
-        order = Order.objects.create(cashier=request.user, **validated_data)
-
-        for item_data in items_data:
-            product = item_data["product"]
-            quantity = item_data["quantity"]
-            OrderItem.objects.create(order=order, **item_data)
-            # Deduct stock
-            prev_stock = product.stock_quantity
-            product.stock_quantity -= quantity
-            product.save(update_fields=["stock_quantity"])
-            StockMovement.objects.create(
-                product=product,
-                movement_type=StockMovement.MovementType.SALE,
-                quantity=-quantity,
-                previous_stock=prev_stock,
-                new_stock=product.stock_quantity,
-                reference=order.order_number,
-                created_by=request.user,
-            )
-
-        order.calculate_totals()
+        order = Order.objects.create(store=current_store(request), cashier=request.user, **validated_data)
+
+        items = apply_promotions([OrderItem(order=order, **item_data) for item_data in items_data])
+        items = OrderItem.objects.bulk_create(items)
+        deduct_stock(order, items, request.user)
+
+        order.calculate_totals(items)
         return order
 
+    def to_representation(self, instance):
+        # The till needs the id and totals of the order it just created
+        prefetch_related_objects([instance], "items__product", "payments")
+        return OrderSerializer(instance, context=self.context).data
+
+
+class RefundLineSerializer(serializers.Serializer):
+    item = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class RefundSerializer(serializers.Serializer):
+    # Leave items empty to refund everything still outstanding on the order
+    items = RefundLineSerializer(many=True, required=False)
+    method = serializers.ChoiceField(choices=Payment.MethodChoices.choices, required=False)
+
+    def validate_items(self, value):
+        lines = {}
+        for line in value:
+            lines[line["item"]] = lines.get(line["item"], 0) + line["quantity"]
+        return lines
+
+
+class PromotionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Promotion
+        fields = [
+            "id", "name", "kind", "product", "category", "buy_quantity", "free_quantity",
+            "bundle_price", "percent", "starts_at", "ends_at", "is_active", "created_at",
+        ]
+
+    def validate(self, data):
+        get = lambda name: data.get(name, getattr(self.instance, name, None))
+        if (get("product") is None) == (get("category") is None):
+            raise serializers.ValidationError("A promotion applies to either a product or a category")
+        kind = get("kind")
+        if kind == Promotion.Kind.BOGO and not get("free_quantity"):
+            raise serializers.ValidationError({"free_quantity": "Required for buy X get Y"})
+        if kind == Promotion.Kind.MULTI_BUY and (get("bundle_price") is None or (get("buy_quantity") or 0) < 2):
+            raise serializers.ValidationError({"bundle_price": "Multi-buy needs a bundle price and a bundle of 2 or more"})
+        if kind == Promotion.Kind.PERCENT_OFF and not (0 < (get("percent") or 0) <= 100):
+            raise serializers.ValidationError({"percent": "Must be between 0 and 100"})
+        starts_at, ends_at = get("starts_at"), get("ends_at")
+        if starts_at and ends_at and ends_at <= starts_at:
+            raise serializers.ValidationError({"ends_at": "Must be after starts_at"})
+        return data
+
+
+class CartSerializer(serializers.Serializer):
+    customer = serializers.PrimaryKeyRelatedField(queryset=Customer.objects.all(), allow_null=True, required=False)
+    discount_amount = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal("0"), required=False)
+
+
+class CartLineSerializer(serializers.Serializer):
+    # Scan by barcode, or pick by id from the product grid
+    product = serializers.IntegerField(required=False)
+    barcode = serializers.CharField(max_length=100, required=False)
+    quantity = serializers.IntegerField(min_value=1, default=1)
+
+    def validate(self, data):
+        if ("product" in data) == ("barcode" in data):
+            raise serializers.ValidationError("Give either a product or a barcode")
+        return data
+
+
+class CartQuantitySerializer(serializers.Serializer):
+    # 0 removes the line
+    quantity = serializers.IntegerField(min_value=0)
+    discount = serializers.DecimalField(max_digits=5, decimal_places=2, min_value=Decimal("0"), max_value=Decimal("100"), required=False)
+
 
 class MpesaSTKPushSerializer(serializers.Serializer):
     order_id = serializers.IntegerField()
@@ -134,6 +287,19 @@ class MpesaSTKPushSerializer(serializers.Serializer):
     amount = serializers.DecimalField(max_digits=10, decimal_places=2)
 
 
+class LoyaltyRedeemSerializer(serializers.Serializer):
+    order_id = serializers.IntegerField()
+    points = serializers.IntegerField(min_value=1)
+
+
+class LoyaltyEntrySerializer(serializers.ModelSerializer):
+    order_number = serializers.CharField(source="order.order_number", read_only=True, default=None)
+
+    class Meta:
+        model = LoyaltyEntry
+        fields = ["id", "kind", "points", "order", "order_number", "note", "created_at"]
+
+
 class StockMovementSerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source="product.name", read_only=True)
     created_by_name = serializers.CharField(source="created_by.get_full_name", read_only=True)
@@ -141,7 +307,7 @@ class StockMovementSerializer(serializers.ModelSerializer):
     class Meta:
         model = StockMovement
         fields = [
-            "id", "product", "product_name", "movement_type",
+            "id", "store", "product", "product_name", "movement_type",
             "quantity", "previous_stock", "new_stock",
             "reference", "created_by_name", "created_at"
         ]
@@ -150,4 +316,46 @@ class StockMovementSerializer(serializers.ModelSerializer):
 class StockAdjustmentSerializer(serializers.Serializer):
     product_id = serializers.IntegerField()
     quantity = serializers.IntegerField()
-    reason = serializers.CharField(max_length=200)
\ No newline at end of file
+    reason = serializers.CharField(max_length=200)
+
+
+class GoodsReceiptItemSerializer(serializers.ModelSerializer):
+    product_name = serializers.CharField(source="product.name", read_only=True)
+    # The product's cost after the delivery was averaged in
+    cost_price = serializers.DecimalField(source="product.cost_price", max_digits=10, decimal_places=2, read_only=True)
+
+    class Meta:
+        model = GoodsReceiptItem
+        fields = ["id", "product", "product_name", "quantity", "unit_cost", "cost_price"]
+
+
+class GoodsReceiptSerializer(serializers.ModelSerializer):
+    items = GoodsReceiptItemSerializer(many=True, read_only=True)
+    received_by_name = serializers.CharField(source="received_by.get_full_name", read_only=True, default=None)
+
+    class Meta:
+        model = GoodsReceipt
+        fields = [
+            "id", "grn_number", "store", "supplier", "supplier_reference", "total_cost",
+            "received_by", "received_by_name", "created_at", "items",
+        ]
+
+
+class GoodsReceiptLineSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+    unit_cost = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal("0"), required=False, allow_null=True)
+
+
+class GoodsReceiptCreateSerializer(serializers.Serializer):
+    supplier = serializers.CharField(max_length=200)
+    supplier_reference = serializers.CharField(max_length=100, required=False, allow_blank=True, default="")
+    lines = GoodsReceiptLineSerializer(many=True, allow_empty=False)
+    # Average the lines' unit costs into the products' cost_price
+    update_costs = serializers.BooleanField(default=True)
+
+    def validate_lines(self, value):
+        products = [line["product"] for line in value]
+        if len(set(products)) < len(products):
+            raise serializers.ValidationError("Each product can only be on one line")
+        return value
@@ -0,0 +1,96 @@
+"""
+Set-based stock bookkeeping.
+
+Stock is kept per store (StockLevel). Every stock change is applied the same
+way no matter how many products it touches: one locked read of the store's
+current levels, one UPDATE with a per-row CASE increment and one
+bulk_create of StockMovement rows. Only the store's own level rows are read
+and written, so changes at different branches never contend.
+"""
+
+from collections import defaultdict
+
+from django.db.models import F
+from django.utils import timezone
+
+from .caching import bump_version
+from .db import case_by_pk, insert_rows
+from .models import StockLevel, StockMovement
+
+
+def _locked_levels(store_id, product_ids):
+    return {
+        product_id: (pk, quantity)
+        for pk, product_id, quantity in StockLevel.objects.select_for_update()
+        .filter(store_id=store_id, product_id__in=product_ids)
+        .order_by("product_id")  # consistent lock order between concurrent tills
+        .values_list("id", "product_id", "quantity")
+    }
+
+
+def apply_stock_changes(deltas, movement_type, reference, user, store):
+    """
+    Apply `deltas` ({product_id: signed quantity}) to `store`'s stock and
+    record one movement per product. Must run inside a transaction.
+    """
+    deltas = {pk: qty for pk, qty in deltas.items() if qty}
+    if not deltas:
+        return []
+    store_id = getattr(store, "pk", store)
+
+    current = _locked_levels(store_id, deltas)
+    if len(current) < len(deltas):
+        # First stock of these products at this store
+        StockLevel.objects.bulk_create(
+            [StockLevel(store_id=store_id, product_id=pk) for pk in deltas if pk not in current],
+            ignore_conflicts=True,
+        )
+        current = _locked_levels(store_id, deltas)
+
+    # updated_at too, so catalog delta syncs (pos.async_views.catalog) see the new levels
+    StockLevel.objects.filter(id__in=[pk for pk, _ in current.values()]).update(
+        quantity=F("quantity") + case_by_pk({current[product_id][0]: qty for product_id, qty in deltas.items()}),
+        updated_at=timezone.now(),
+    )
+    bump_version(StockLevel)
+
+    movements = StockMovement.objects.bulk_create([
+        StockMovement(
+            store_id=store_id,
+            product_id=product_id,
+            movement_type=movement_type,
+            quantity=qty,
+            previous_stock=current[product_id][1],
+            new_stock=current[product_id][1] + qty,
+            reference=reference,
+            created_by=user,
+        )
+        for product_id, qty in deltas.items()
+    ])
+    return movements
+
+
+def set_levels(store, levels):
+    """
+    Set `store`'s stock of each product outright ({product_id: quantity}),
+    without movements: for loading a catalog or editing a product, not for
+    trading (use apply_stock_changes).
+    """
+    if not levels:
+        return
+    store_id = getattr(store, "pk", store)
+    now = timezone.now()
+    insert_rows(
+        StockLevel, ["store", "product", "quantity", "updated_at"],
+        [(store_id, pk, qty, now) for pk, qty in levels.items()],
+        unique_fields=["store", "product"], update_fields=["quantity", "updated_at"],
+    )
+    bump_version(StockLevel)
+
+
+def deduct_stock(order, items, user):
+    """Take the lines of a new order off its store's shelf."""
+    deltas = defaultdict(int)
+    for item in items:
+        deltas[item.product_id] -= item.quantity
+    return apply_stock_changes(deltas, StockMovement.MovementType.SALE, order.order_number, user, order.store_id)
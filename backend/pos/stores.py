@@ -0,0 +1,59 @@
+"""
+Stores (branches).
+
+Stock levels, orders, carts and stock movements belong to a store. A request
+works on the store whose code is in its X-Store header (or `?store=`), and
+on DEFAULT_STORE when it names none, so a single-branch install never has
+to. Store rows are read through the cache: resolving the store costs no
+query once it's warm.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from rest_framework.exceptions import ValidationError
+
+from .caching import data_version
+from .models import StockLevel, Store
+
+STORE_HEADER = "X-Store"
+STORE_KEY = "store:{}:{}"
+
+
+def get_store(code):
+    """The active store with this code, or None."""
+    key = STORE_KEY.format(code, data_version(Store))
+    store = cache.get(key)
+    if store is None:
+        store = Store.objects.filter(code=code, is_active=True).first()
+        if store is None and code == settings.DEFAULT_STORE:
+            store, _ = Store.objects.get_or_create(code=code, defaults={"name": settings.DEFAULT_STORE_NAME})
+        if store is None:
+            return None
+        cache.set(key, store, None)
+    return store
+
+
+def store_code(request):
+    return (
+        request.headers.get(STORE_HEADER) or request.GET.get("store") or settings.DEFAULT_STORE
+    ).strip()
+
+
+def current_store(request):
+    """The store `request` works on. Raises ValidationError for an unknown or closed one."""
+    store = getattr(request, "_pos_store", None)
+    if store is None:
+        code = store_code(request)
+        store = get_store(code)
+        if store is None:
+            raise ValidationError({"store": [f"Unknown store {code!r}"]})
+        request._pos_store = store
+    return store
+
+
+def with_stock(queryset, store):
+    """Products annotated with `stock_quantity`, their level at `store` (0 if never stocked there)."""
+    level = StockLevel.objects.filter(store=store, product=OuterRef("pk")).values("quantity")[:1]
+    return queryset.annotate(stock_quantity=Coalesce(Subquery(level), Value(0)))
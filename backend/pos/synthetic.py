@@ -0,0 +1,274 @@
+"""
+Deterministic synthetic history for load and benchmark databases.
+
+Generates a catalog, customers and a run of trading days for a number of
+stores: orders with their items, payments and stock movements. Everything
+comes from one random.Random(seed), so the same arguments always produce the
+same data. The catalog and customers are written with bulk_create; the
+history (orders, items, payments, movements) as plain tuples through
+pos.db.insert_rows, a multi-row INSERT per table and one transaction per
+batch, with primary keys assigned up front so items, payments and movements
+can reference their order without a round trip.
+
+History runs up to END_DATE unless another end date is given, not up to
+today, so a database generated next month holds the same rows.
+
+Each store (store01, store02, ...) has its own cashier account and stock
+levels, and its orders carry the store number in the order number.
+
+Shapes, loosely from a Nairobi supermarket:
+  - trading hours 07:00-22:00, peaks at lunch and 17:00-19:00
+  - Saturdays and month-end paydays busier, December busiest
+  - basket sizes log-normal around 3 lines with a long tail to 40
+  - a few products sell far more often than the rest (Zipf-like)
+"""
+
+import bisect
+import itertools
+import math
+import random
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .db import insert_rows
+from .models import TAX_RATES, Category, Customer, Order, OrderItem, Payment, Product, StockMovement, Store
+from .stock import set_levels
+
+CENTS = Decimal("0.01")
+
+# Share of a day's orders per hour, 07:00-21:00
+HOURLY = {
+    7: 2, 8: 4, 9: 5, 10: 6, 11: 7, 12: 10, 13: 9, 14: 6,
+    15: 6, 16: 7, 17: 10, 18: 11, 19: 9, 20: 5, 21: 3,
+}
+WEEKDAY = [0.9, 0.85, 0.9, 0.95, 1.1, 1.35, 1.0]  # Monday first
+MONTH = {1: 0.85, 4: 1.05, 8: 1.05, 12: 1.3}
+
+
+def _cumulative(weights):
+    return list(itertools.accumulate(weights))
+
+
+# Columns written for each table; rows are tuples in this order
+COLUMNS = {
+    Order: ("id", "order_number", "store", "customer", "cashier", "status", "subtotal", "discount_amount", "tax_amount",
+            "total_amount", "notes", "created_at", "updated_at"),
+    OrderItem: ("id", "order", "product", "quantity", "unit_price", "discount", "returned_quantity",
+                "promotion_discount", "tax_rate"),
+    Payment: ("id", "order", "method", "amount", "status", "mpesa_phone", "mpesa_receipt_number",
+              "mpesa_transaction_date", "cash_tendered", "change_given", "created_at", "updated_at"),
+    StockMovement: ("id", "store", "product", "movement_type", "quantity", "previous_stock", "new_stock",
+                    "reference", "created_by", "created_at"),
+}
+ZERO = Decimal("0")
+END_DATE = date(2025, 12, 31)  # default last day of history
+
+
+class HistoryGenerator:
+    def __init__(self, seed=1, stores=20, days=365, orders_per_day=150, products=5000, customers=50_000,
+                 batch_size=10_000, end_date=None, stdout=None):
+        self.rng = random.Random(seed)
+        self.stores = stores
+        self.days = days
+        self.orders_per_day = orders_per_day
+        self.product_count = products
+        self.customer_count = customers
+        self.batch_size = batch_size
+        self.end_date = end_date or END_DATE
+        self.stdout = stdout
+        self.tz = timezone.get_current_timezone()
+        self.counts = {"orders": 0, "items": 0, "payments": 0, "movements": 0}
+
+    def log(self, message):
+        if self.stdout is not None:
+            self.stdout.write(message)
+
+    # ── Reference data ──────────────────────────────────────────────────────
+
+    def next_id(self, model):
+        last = model.objects.order_by("-pk").values_list("pk", flat=True).first()
+        return itertools.count((last or 0) + 1)
+
+    def seed_reference_data(self):
+        rng = self.rng
+        with transaction.atomic():
+            self.branches = []  # (store id, cashier id)
+            for n in range(1, self.stores + 1):
+                store, _ = Store.objects.get_or_create(code=f"store{n:02d}", defaults={"name": f"Store {n:02d}"})
+                user, _ = User.objects.get_or_create(
+                    username=f"store{n:02d}", defaults={"first_name": "Store", "last_name": f"{n:02d}"}
+                )
+                self.branches.append((store.pk, user.pk))
+
+            categories = [Category(name=f"Synthetic category {n:02d}") for n in range(40)]
+            Category.objects.bulk_create(categories, ignore_conflicts=True)
+            category_ids = list(
+                Category.objects.filter(name__startswith="Synthetic category").order_by("pk")
+                .values_list("pk", flat=True)
+            )
+
+            tax_classes = [Product.TaxClass.STANDARD] * 8 + [Product.TaxClass.ZERO_RATED, Product.TaxClass.EXEMPT]
+            products, opening = [], {}
+            for n in range(self.product_count):
+                price = Decimal(round(math.exp(rng.uniform(math.log(20), math.log(5000))))).quantize(CENTS)
+                products.append(Product(
+                    name=f"Synthetic product {n:06d}", barcode=f"SYN{n:09d}",
+                    category_id=category_ids[n % len(category_ids)], price=price,
+                    cost_price=(price * Decimal(rng.uniform(0.6, 0.85))).quantize(CENTS),
+                    low_stock_threshold=50, tax_class=rng.choice(tax_classes),
+                ))
+                opening[products[-1].barcode] = rng.randint(200, 2000)
+            Product.objects.bulk_create(products, batch_size=self.batch_size, ignore_conflicts=True)
+            self.products = list(
+                Product.objects.filter(barcode__startswith="SYN").order_by("barcode")
+                .values_list("pk", "price", "tax_class", "barcode")
+            )
+
+            customers = [
+                Customer(name=f"Synthetic customer {n:06d}", phone=f"+2547{n:08d}")
+                for n in range(self.customer_count)
+            ]
+            for customer in customers:
+                customer.set_lookup_keys()  # bulk_create doesn't call save()
+            Customer.objects.bulk_create(customers, batch_size=self.batch_size, ignore_conflicts=True)
+            self.customers = list(
+                Customer.objects.filter(name__startswith="Synthetic customer").order_by("pk")
+                .values_list("pk", flat=True)
+            )
+
+        # Zipf-like popularity: product k is picked with weight 1 / (k + 1)^0.9
+        order = list(range(len(self.products)))
+        rng.shuffle(order)
+        weights = [0.0] * len(order)
+        for rank, index in enumerate(order):
+            weights[index] = 1 / (rank + 1) ** 0.9
+        self.popularity = _cumulative(weights)
+        # Every store opens with the same shelf
+        self.stock = {store: {pk: opening[barcode] for pk, _, _, barcode in self.products}
+                      for store, _ in self.branches}
+        self.log(f"  Catalog: {len(self.products)} products, {len(self.customers)} customers, {self.stores} stores")
+
+    # ── Orders ──────────────────────────────────────────────────────────────
+
+    def pick_products(self, lines):
+        rng, total = self.rng, self.popularity[-1]
+        lines = min(lines, len(self.products))
+        chosen = set()
+        while len(chosen) < lines:
+            chosen.add(bisect.bisect_left(self.popularity, rng.random() * total))
+        return [self.products[index] for index in chosen]
+
+    def basket_size(self):
+        return min(40, max(1, int(self.rng.lognormvariate(1.0, 0.7))))
+
+    def day_volume(self, day):
+        factor = WEEKDAY[day.weekday()] * MONTH.get(day.month, 1.0)
+        if day.day >= 28 or day.day <= 2:
+            factor *= 1.2  # payday
+        return max(1, int(self.orders_per_day * factor * self.rng.uniform(0.9, 1.1)))
+
+    def opening_times(self, day, count):
+        hours, cumulative = list(HOURLY), _cumulative(HOURLY.values())
+        stamps = []
+        for _ in range(count):
+            hour = hours[bisect.bisect_left(cumulative, self.rng.random() * cumulative[-1])]
+            seconds = self.rng.randrange(3600)
+            local = datetime.combine(day, time(hour)) + timedelta(seconds=seconds)
+            stamps.append(timezone.make_aware(local, self.tz))
+        stamps.sort()
+        return stamps
+
+    def generate(self):
+        order_ids, item_ids = self.next_id(Order), self.next_id(OrderItem)
+        payment_ids, movement_ids = self.next_id(Payment), self.next_id(StockMovement)
+        buffers = {model: [] for model in COLUMNS}
+        orders, items, payments = buffers[Order], buffers[OrderItem], buffers[Payment]
+        rng = self.rng
+        completed, cancelled_status = Order.StatusChoices.COMPLETED.value, Order.StatusChoices.CANCELLED.value
+        start = self.end_date - timedelta(days=self.days - 1)
+
+        for offset in range(self.days):
+            day = start + timedelta(days=offset)
+            for store, (store_id, cashier) in enumerate(self.branches, 1):
+                for n, created_at in enumerate(self.opening_times(day, self.day_volume(day))):
+                    order_id = next(order_ids)
+                    order_number = f"S{store:02d}{day:%y%m%d}{n:05d}"
+                    cancelled = rng.random() < 0.02
+                    subtotal = tax = ZERO
+                    for product_id, price, tax_class, _ in self.pick_products(self.basket_size()):
+                        quantity = 1 if rng.random() < 0.8 else rng.randint(2, 6)
+                        line, rate = price * quantity, TAX_RATES[tax_class]
+                        subtotal += line
+                        tax += line * rate
+                        items.append((next(item_ids), order_id, product_id, quantity, price, ZERO, 0, ZERO, rate))
+                        if not cancelled:
+                            self.sell(buffers[StockMovement], movement_ids, store_id, product_id, quantity,
+                                      order_number, cashier, created_at)
+
+                    subtotal, tax = subtotal.quantize(CENTS), tax.quantize(CENTS)
+                    total = subtotal + tax
+                    customer = rng.choice(self.customers) if self.customers and rng.random() < 0.35 else None
+                    orders.append((
+                        order_id, order_number, store_id, customer, cashier, cancelled_status if cancelled else completed,
+                        subtotal, ZERO, tax, total, "", created_at, created_at,
+                    ))
+                    if not cancelled:
+                        payments.append(self.payment(next(payment_ids), order_id, total, created_at))
+
+                    if len(items) >= self.batch_size:
+                        self.flush(buffers)
+            self.log(f"  {day}: {self.counts['orders'] + len(orders):,} orders")
+        self.flush(buffers)
+        self.finish()
+        return self.counts
+
+    def payment(self, pk, order_id, total, created_at):
+        paid_at = created_at + timedelta(seconds=self.rng.randint(20, 180))
+        if self.rng.random() < 0.6:
+            phone = f"2547{self.rng.randrange(10**8):08d}"
+            return (pk, order_id, "mpesa", total, "completed", phone, f"SYN{pk:010d}", paid_at, None, None,
+                    paid_at, paid_at)
+        tendered = Decimal(math.ceil(total / 50) * 50)
+        return (pk, order_id, "cash", total, "completed", None, None, None, tendered, tendered - total,
+                paid_at, paid_at)
+
+    def sell(self, movements, ids, store_id, product_id, quantity, order_number, cashier, created_at):
+        shelf = self.stock[store_id]
+        stock = shelf[product_id]
+        if stock < quantity + 50:
+            # Shelf restocked before the sale, the way a store manager would
+            restock = self.rng.randint(500, 2000)
+            movements.append((next(ids), store_id, product_id, "restock", restock, stock, stock + restock,
+                              "Synthetic GRN", cashier, created_at))
+            stock += restock
+        movements.append((next(ids), store_id, product_id, "sale", -quantity, stock, stock - quantity,
+                          order_number, cashier, created_at))
+        shelf[product_id] = stock - quantity
+
+    def flush(self, buffers):
+        with transaction.atomic():
+            for model, rows in buffers.items():
+                insert_rows(model, COLUMNS[model], rows)
+        self.counts["orders"] += len(buffers[Order])
+        self.counts["items"] += len(buffers[OrderItem])
+        self.counts["payments"] += len(buffers[Payment])
+        self.counts["movements"] += len(buffers[StockMovement])
+        for rows in buffers.values():
+            rows.clear()
+
+    def finish(self):
+        """Each store's closing stock levels, and sequences past the ids we assigned."""
+        with transaction.atomic():
+            for store_id, shelf in self.stock.items():
+                set_levels(store_id, shelf)
+
+        statements = connection.ops.sequence_reset_sql(no_style(), [Order, OrderItem, Payment, StockMovement])
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
@@ -1,3 +1,1814 @@
-from django.test import TestCase
+import csv
+import importlib.util
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import async_views, jobs, loyalty, routers, segments
+from .backends.sqlite3.base import DEFAULT_PRAGMAS, DatabaseWrapper as TunedSQLiteWrapper
+from .authentication import CachedJWTAuthentication, users
+from .benchmarks import compare
+from .caching import bump_version
+from .customers import normalize_phone, phone_lookup, type_ahead
+from .images import serve_media, thumbnail_name
+from .metrics import exposition, registry
+from .models import (
+    ArchivedOrder, ArchivedOrderItem, ArchivedPayment, ArchivedStockMovement, Category, Customer, CustomerSegment, Job,
+    GoodsReceipt, LoyaltyEntry, Order, OrderItem, Payment, Product, Promotion, StockLevel, StockMovement, Store,
+)
+from .renderers import ORJSONParser, ORJSONRenderer
+from .pricing import PricingEngine, get_engine
+from .returns import cancel_order, refund_order
+from .profiling import ProfileStore
+from .stock import apply_stock_changes, set_levels
+from .stores import get_store, with_stock
+from .rows import OrderRows, ProductRows, StockMovementRows
+from .serializers import OrderSerializer, ProductSerializer, StockMovementSerializer
+from .synthetic import END_DATE, HistoryGenerator
+
+
+def main_store():
+    return get_store(settings.DEFAULT_STORE)
+
+
+def stocked(product, quantity, store=None):
+    """`product`, with `quantity` on the shelf at `store` (the default store)."""
+    set_levels(store or main_store(), {product.pk: quantity})
+    return product
+
+
+def stock_of(product, store=None):
+    return StockLevel.objects.get(store=store or main_store(), product=product).quantity
+
+
+# ─── Query budgets ────────────────────────────────────────────────────────────
+# Every endpoint runs against a small and a larger dataset (or basket). The
+# number of queries has to stay inside the endpoint's budget and must not
+# change with the size of the data — an N+1 shows up as a failing test here
+# instead of a slow till in the shop.
+
+class QueryBudgetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("cashier", password="x", first_name="Jane", last_name="Cashier")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.categories = [Category.objects.create(name=f"Category {i}") for i in range(3)]
+        self.serial = 0
+
+    def product(self):
+        self.serial += 1
+        return stocked(Product.objects.create(
+            name=f"Product {self.serial}", barcode=f"59{self.serial:06d}", price=Decimal("100"),
+            category=self.categories[self.serial % 3], image=f"products/p{self.serial}.webp",
+        ), 50)
+
+    def order(self, lines, status=Order.StatusChoices.COMPLETED):
+        self.serial += 1
+        customer = Customer.objects.create(name=f"Customer {self.serial}", phone=f"07{self.serial:08d}")
+        order = Order.objects.create(store=main_store(), customer=customer, cashier=self.user, status=status)
+        items = [OrderItem.objects.create(order=order, product=self.product(), quantity=2, unit_price=Decimal("100"))
+                 for _ in range(lines)]
+        order.calculate_totals()
+        if status == Order.StatusChoices.COMPLETED:
+            Payment.objects.create(order=order, method="cash", amount=order.total_amount, status="completed")
+        for item in items:
+            item.product.stock_movements.create(
+                store=order.store, movement_type="sale", quantity=-2, previous_stock=52, new_stock=50,
+                reference=order.order_number, created_by=self.user,
+            )
+        return order
+
+    def seed(self, orders):
+        for _ in range(orders):
+            self.order(lines=3)
+
+    def count_queries(self, method, url, data=None):
+        cache.clear()
+        main_store()  # store rows stay cached on a running till
+        with CaptureQueriesContext(connection) as queries:
+            res = getattr(self.client, method)(url, data, format="json")
+        self.assertLess(res.status_code, 400, res.content)
+        return len(queries)
+
+    def assert_budget(self, budget, small, large):
+        self.assertLessEqual(small, budget, f"{small} queries, budget is {budget}")
+        self.assertEqual(small, large, f"query count grows with data: {small} -> {large}")
+
+    def assert_read_budget(self, budget, url):
+        self.seed(2)
+        small = self.count_queries("get", url)
+        self.seed(8)
+        large = self.count_queries("get", url)
+        self.assert_budget(budget, small, large)
+
+    # Reads
+
+    def test_category_list(self):
+        self.assert_read_budget(2, "/api/categories/")
+
+    def test_product_list(self):
+        self.assert_read_budget(2, "/api/products/")
+
+    def test_product_barcode_scan(self):
+        self.seed(1)
+        self.assert_read_budget(1, "/api/products/?barcode=59000001")
+
+    def test_product_detail(self):
+        self.seed(1)
+        self.assert_read_budget(1, f"/api/products/{Product.objects.first().id}/")
+
+    def test_customer_list(self):
+        self.assert_read_budget(2, "/api/customers/")
+
+    def test_order_list(self):
+        self.assert_read_budget(2, "/api/orders/")
+
+    def test_order_list_expanded(self):
+        self.assert_read_budget(4, "/api/orders/?expand=items,payments")
+
+    def test_order_detail(self):
+        self.seed(1)
+        self.assert_read_budget(3, f"/api/orders/{Order.objects.first().id}/")
+
+    def test_stock_movement_list(self):
+        self.assert_read_budget(2, "/api/stock-movements/")
+
+    def test_dashboard(self):
+        self.assert_read_budget(5, "/api/dashboard/")
+
+    # Writes — budgets must not depend on the number of lines
+
+    def basket(self, lines):
+        return {"items": [
+            {"product": self.product().id, "quantity": 1, "unit_price": "100.00", "discount": "0"}
+            for _ in range(lines)
+        ]}
+
+    def test_checkout(self):
+        small = self.count_queries("post", "/api/orders/", self.basket(2))
+        large = self.count_queries("post", "/api/orders/", self.basket(12))
+        # 13 includes compiling the promotion index: count_queries starts cold
+        self.assert_budget(13, small, large)
+
+    def test_malformed_checkout_bodies_are_rejected(self):
+        for body in ([1, 2], "basket", 7, {"items": 5}, {"items": "abc"}, {"items": [1, None, "x"]},
+                     {"items": {"product": 1}}, {"items": [{"product": [1], "quantity": 1, "unit_price": "1"}]}):
+            res = self.client.post("/api/orders/", body, format="json")
+            self.assertEqual(res.status_code, 400, body)
+        self.assertFalse(Order.objects.exists())
+
+    def test_cash_payment(self):
+        small = self.count_queries("post", "/api/payments/cash/",
+                                   {"order_id": self.order(2, "pending").id, "cash_tendered": 5000})
+        large = self.count_queries("post", "/api/payments/cash/",
+                                   {"order_id": self.order(12, "pending").id, "cash_tendered": 5000})
+        # 9 includes what's already paid, the points earned and their ledger entry
+        self.assert_budget(9, small, large)
+
+    def test_cancel(self):
+        small = self.count_queries("post", f"/api/orders/{self.order(2, 'pending').id}/cancel/")
+        large = self.count_queries("post", f"/api/orders/{self.order(12, 'pending').id}/cancel/")
+        self.assert_budget(14, small, large)
+
+    def test_refund(self):
+        small = self.count_queries("post", f"/api/orders/{self.order(2).id}/refund/", {})
+        large = self.count_queries("post", f"/api/orders/{self.order(12).id}/refund/", {})
+        self.assert_budget(18, small, large)
+
+    def test_adjust_stock(self):
+        self.seed(1)
+        self.assert_budget(
+            6,  # the level is locked for the change, inside a savepoint
+            self.count_queries("post", "/api/products/adjust_stock/",
+                               {"product_id": Product.objects.first().id, "quantity": 5, "reason": "Count"}),
+            self.count_queries("post", "/api/products/adjust_stock/",
+                               {"product_id": Product.objects.last().id, "quantity": 5, "reason": "Count"}),
+        )
+
+    def test_goods_receipt(self):
+        def delivery(lines):
+            return {"supplier": "Bidco", "lines": [
+                {"product": self.product().id, "quantity": 24, "unit_cost": "80.00"} for _ in range(lines)
+            ]}
+
+        small = self.count_queries("post", "/api/goods-receipts/", delivery(2))
+        large = self.count_queries("post", "/api/goods-receipts/", delivery(30))
+        # 12 includes the averaged cost_price UPDATE and re-reading the receipt for the response
+        self.assert_budget(12, small, large)
+
+    def test_mpesa_callback(self):
+        def callback(order):
+            payment = Payment.objects.create(order=order, method="mpesa", amount=order.total_amount,
+                                             mpesa_checkout_request_id=f"ws_CO_{order.id}")
+            return {"Body": {"stkCallback": {
+                "ResultCode": 0, "CheckoutRequestID": payment.mpesa_checkout_request_id,
+                "CallbackMetadata": {"Item": [{"Name": "MpesaReceiptNumber", "Value": f"RCP{order.id}"}]},
+            }}}
+
+        small = self.count_queries("post", "/api/payments/mpesa/callback/", callback(self.order(2, "pending")))
+        large = self.count_queries("post", "/api/payments/mpesa/callback/", callback(self.order(12, "pending")))
+        self.assert_budget(7, small, large)
+
+    @override_settings(JOBS_INLINE=False)
+    def test_mpesa_stk_push(self):
+        order = self.order(2, "pending")
+        small = self.count_queries("post", "/api/payments/mpesa/stk-push/",
+                                   {"order_id": order.id, "phone_number": "0712345678", "amount": "100"})
+        self.seed(5)
+        large = self.count_queries("post", "/api/payments/mpesa/stk-push/",
+                                   {"order_id": order.id, "phone_number": "0712345678", "amount": "100"})
+        # The order, the payment and its job, with a savepoint around the last two
+        self.assert_budget(5, small, large)
+
+
+# ─── Returns ──────────────────────────────────────────────────────────────────
+
+class ReturnsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("cashier", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.tea = stocked(Product.objects.create(name="Tea 250g", price=Decimal("100")), 10)
+        self.milk = stocked(Product.objects.create(name="Milk 500ml", price=Decimal("50")), 10)
+
+    def order(self, status=Order.StatusChoices.COMPLETED):
+        # 2 x 100 + 1 x 50, 16% VAT: 290.00
+        order = Order.objects.create(store=main_store(), cashier=self.user, status=status)
+        self.tea_line = OrderItem.objects.create(order=order, product=self.tea, quantity=2, unit_price=Decimal("100"))
+        self.milk_line = OrderItem.objects.create(order=order, product=self.milk, quantity=1, unit_price=Decimal("50"))
+        order.calculate_totals()
+        if status == Order.StatusChoices.COMPLETED:
+            self.paid = Payment.objects.create(order=order, method="cash", amount=order.total_amount, status="completed")
+        return order
+
+    def refund(self, order, items=None):
+        data = {"items": [{"item": pk, "quantity": qty} for pk, qty in items.items()]} if items else {}
+        return self.client.post(f"/api/orders/{order.id}/refund/", data, format="json")
+
+    def test_partial_then_full_refund(self):
+        order = self.order()
+        res = self.refund(order, {self.tea_line.id: 1})
+        self.assertEqual(res.status_code, 200, res.content)
+        [refund] = res.data["refunds"]
+        self.assertEqual((refund["amount"], refund["method"], refund["status"]), ("116.00", "cash", "refunded"))
+        self.assertEqual(res.data["order"]["status"], "partially_refunded")
+        self.assertEqual((stock_of(self.tea), stock_of(self.milk)), (11, 10))
+        movement = StockMovement.objects.get(product=self.tea)
+        self.assertEqual((movement.movement_type, movement.quantity, movement.new_stock, movement.reference),
+                         ("return", 1, 11, order.order_number))
+
+        # The rest comes to what's left of the total
+        res = self.refund(order)
+        self.assertEqual((res.data["refunds"][0]["amount"], res.data["order"]["status"]), ("174.00", "refunded"))
+        self.assertEqual((stock_of(self.tea), stock_of(self.milk)), (12, 11))
+        self.assertEqual(order.payments.filter(status="refunded", refund_of=self.paid).count(), 2)
+        self.assertEqual(sorted(OrderItem.objects.filter(order=order).values_list("returned_quantity", flat=True)),
+                         [1, 2])
+
+    def test_refunds_use_each_lines_own_tax(self):
+        # 100 at 16% VAT and 100 exempt, less 21.60 off the order: 194.40
+        order = Order.objects.create(store=main_store(), cashier=self.user, discount_amount=Decimal("21.60"))
+        OrderItem.objects.create(order=order, product=self.tea, quantity=1, unit_price=Decimal("100"))
+        exempt = OrderItem.objects.create(order=order, product=self.milk, quantity=1, unit_price=Decimal("100"),
+                                          tax_rate=Decimal("0"))
+        order.calculate_totals()
+        Payment.objects.create(order=order, method="cash", amount=order.total_amount, status="completed")
+        order.status = Order.StatusChoices.COMPLETED
+        order.save()
+
+        # 100 less a tenth of the discount (its share of the 216.00 charged before it)
+        self.assertEqual(self.refund(order, {exempt.id: 1}).data["refunds"][0]["amount"], "90.00")
+        self.assertEqual(self.refund(order).data["refunds"][0]["amount"], "104.40")
+
+    def test_refunding_twice_or_too_much_is_rejected(self):
+        order = self.order()
+        res = self.refund(order, {self.tea_line.id: 3})
+        self.assertEqual((res.status_code, res.data["error"]), (400, f"Item {self.tea_line.id}: can return at most 2"))
+        self.assertEqual(self.refund(order).status_code, 200)
+        res = self.refund(order)
+        self.assertEqual((res.status_code, res.data["error"]), (400, "Only completed orders can be refunded"))
+        self.assertEqual(order.payments.filter(status="refunded").count(), 1)
+        self.assertEqual(stock_of(self.tea), 12)
+
+    def test_points_refunds_need_a_customer(self):
+        order = self.order()
+        res = self.client.post(f"/api/orders/{order.id}/refund/", {"method": "loyalty"}, format="json")
+        self.assertEqual((res.status_code, res.data["error"]),
+                         (400, "Only an order with a customer can be refunded as points"))
+        self.assertEqual((order.payments.filter(status="refunded").count(), stock_of(self.tea)), (0, 10))
+
+    def test_cancel_puts_everything_back_once(self):
+        order = self.order(status=Order.StatusChoices.PENDING)
+        res = self.client.post(f"/api/orders/{order.id}/cancel/")
+        self.assertEqual((res.status_code, res.data["status"]), (200, "cancelled"))
+        self.assertEqual((stock_of(self.tea), stock_of(self.milk)), (12, 11))
+        self.assertEqual(self.client.post(f"/api/orders/{order.id}/cancel/").status_code, 400)
+        self.assertEqual(StockMovement.objects.filter(movement_type="return").count(), 2)
+
+
+# ─── Carts ────────────────────────────────────────────────────────────────────
+
+class CartTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("cashier", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.products = [
+            stocked(Product.objects.create(name=f"Product {i}", barcode=f"61{i:06d}", price=Decimal("99.99")), 100)
+            for i in range(12)
+        ]
+        self.cart = self.client.post("/api/carts/", {}, format="json").data["id"]
+
+    def post(self, url, data=None):
+        return self.client.post(f"/api/carts/{self.cart}/{url}", data or {}, format="json")
+
+    def queries(self, method, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            res = getattr(self.client, method)(f"/api/carts/{self.cart}/{url}", data, format="json")
+        self.assertLess(res.status_code, 400, res.content)
+        return len(queries), res
+
+    def test_line_operations_return_running_totals(self):
+        self.post("lines/", {"barcode": "61000000", "quantity": 2})
+        res = self.post("lines/", {"product": self.products[1].id})
+        self.assertEqual(
+            (res.data["subtotal"], res.data["tax_amount"], res.data["total_amount"]),
+            ("299.97", "48.00", "347.97"),
+        )
+        res = self.client.patch(f"/api/carts/{self.cart}/lines/{self.products[0].id}/",
+                                {"quantity": 4, "discount": "10"}, format="json")
+        self.assertEqual(res.data["line"]["total_price"], "359.96")
+        self.assertEqual(res.data["subtotal"], "459.95")
+        res = self.client.delete(f"/api/carts/{self.cart}/lines/{self.products[0].id}/")
+        self.assertEqual((res.data["item_count"], res.data["subtotal"]), (1, "99.99"))
+
+    def test_price_is_snapshotted_at_scan_time(self):
+        self.post("lines/", {"product": self.products[0].id})
+        Product.objects.filter(pk=self.products[0].pk).update(price=Decimal("150"))
+        res = self.post("lines/", {"product": self.products[0].id})
+        self.assertEqual((res.data["line"]["quantity"], res.data["line"]["unit_price"]), (2, "99.99"))
+
+    def test_cart_survives_cache_eviction(self):
+        self.post("lines/", {"product": self.products[0].id, "quantity": 3})
+        cache.clear()
+        res = self.client.get(f"/api/carts/{self.cart}/")
+        self.assertEqual((res.data["lines"][0]["quantity"], res.data["subtotal"]), (3, "299.97"))
+
+    def test_checkout_matches_order_totals(self):
+        for product in self.products[:3]:
+            self.post("lines/", {"product": product.id, "quantity": 3})
+        self.client.patch(f"/api/carts/{self.cart}/lines/{self.products[0].id}/",
+                          {"quantity": 3, "discount": "12.5"}, format="json")
+        self.client.patch(f"/api/carts/{self.cart}/", {"discount_amount": "5"}, format="json")
+        res = self.post("checkout/")
+        self.assertEqual(res.status_code, 201, res.content)
+
+        order = Order.objects.get(pk=res.data["id"])
+        totals = (order.subtotal, order.tax_amount, order.total_amount)
+        order.calculate_totals()
+        order.refresh_from_db()
+        self.assertEqual(totals, (order.subtotal, order.tax_amount, order.total_amount))
+        self.assertEqual(stock_of(self.products[0]), 97)
+        self.assertEqual(self.post("checkout/").status_code, 404)
+
+    def test_foreign_cart_is_not_found(self):
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user("other", password="x"))
+        self.assertEqual(other.get(f"/api/carts/{self.cart}/").status_code, 404)
+
+    def test_query_budgets(self):
+        get_engine()  # warm on a running till
+        new_line, _ = self.queries("post", "lines/", {"product": self.products[0].id})
+        repeat, _ = self.queries("post", "lines/", {"product": self.products[0].id})
+        change, _ = self.queries("patch", f"lines/{self.products[0].id}/", {"quantity": 5})
+        self.assertEqual((new_line, repeat, change), (2, 1, 1))
+
+        small, _ = self.queries("post", "checkout/")
+        self.cart = self.client.post("/api/carts/", {}, format="json").data["id"]
+        for product in self.products:
+            self.post("lines/", {"product": product.id})
+        large, _ = self.queries("post", "checkout/")
+        self.assertEqual(small, large)
+        self.assertLessEqual(small, 12)
+
+
+# ─── Pricing ──────────────────────────────────────────────────────────────────
+
+class PricingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("cashier", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.snacks = Category.objects.create(name="Snacks")
+        self.crisps = stocked(Product.objects.create(name="Crisps", category=self.snacks, price=Decimal("99.99")), 100)
+        self.bread = stocked(Product.objects.create(name="Bread", price=Decimal("65"),
+                                                    tax_class=Product.TaxClass.ZERO_RATED), 100)
+
+    def promote(self, kind, **fields):
+        return Promotion.objects.create(name=kind, kind=kind, **fields)
+
+    def saving(self, product, quantity, at=None):
+        line = PricingEngine.compile(at).price_line(product.id, product.category_id, quantity, product.price,
+                                                    product.tax_rate)
+        return line.promotion, line.promotion_discount
+
+    def test_rule_kinds(self):
+        bogo = self.promote("bogo", product=self.crisps, buy_quantity=2, free_quantity=1)
+        self.assertEqual(self.saving(self.crisps, 7), (bogo.id, Decimal("199.98")))
+        bogo.delete()
+        multi = self.promote("multi_buy", product=self.crisps, buy_quantity=3, bundle_price=Decimal("250"))
+        self.assertEqual(self.saving(self.crisps, 7), (multi.id, Decimal("99.94")))
+        self.assertEqual(self.saving(self.bread, 7), (None, Decimal("0")))
+
+    def test_best_rule_wins_across_product_and_category(self):
+        category = self.promote("percent_off", category=self.snacks, percent=Decimal("10"))
+        bogo = self.promote("bogo", product=self.crisps, buy_quantity=1, free_quantity=1)
+        self.assertEqual(self.saving(self.crisps, 1), (category.id, Decimal("10.00")))
+        self.assertEqual(self.saving(self.crisps, 2), (bogo.id, Decimal("99.99")))
+
+    def test_time_boxed_rules(self):
+        now = timezone.now()
+        later = self.promote("percent_off", product=self.crisps, percent=Decimal("50"),
+                             starts_at=now + timezone.timedelta(hours=1), ends_at=now + timezone.timedelta(hours=2))
+        self.assertEqual(self.saving(self.crisps, 1, at=now), (None, Decimal("0")))
+        self.assertEqual(PricingEngine.compile(now).valid_until, later.starts_at)
+        self.assertEqual(self.saving(self.crisps, 1, at=now + timezone.timedelta(minutes=90))[0], later.id)
+        self.assertEqual(self.saving(self.crisps, 1, at=now + timezone.timedelta(hours=3))[0], None)
+
+    def test_engine_is_rebuilt_when_promotions_change(self):
+        self.assertIsNone(get_engine().best_rule(self.crisps.id, self.snacks.id, 1, self.crisps.price)[0])
+        rule = self.promote("percent_off", category=self.snacks, percent=Decimal("5"))
+        self.assertEqual(get_engine().best_rule(self.crisps.id, self.snacks.id, 1, self.crisps.price)[0].id, rule.id)
+        with CaptureQueriesContext(connection) as queries:
+            get_engine()
+        self.assertEqual(len(queries), 0)
+
+    def test_checkout_applies_promotions_and_tax_classes(self):
+        self.promote("bogo", product=self.crisps, buy_quantity=2, free_quantity=1)
+        res = self.client.post("/api/orders/", {"items": [
+            {"product": self.crisps.id, "quantity": 3, "unit_price": "99.99"},
+            {"product": self.bread.id, "quantity": 2, "unit_price": "65.00"},
+        ]}, format="json")
+        self.assertEqual(res.status_code, 201, res.content)
+        self.assertEqual(
+            (res.data["subtotal"], res.data["tax_amount"], res.data["total_amount"]),
+            ("329.98", "32.00", "361.98"),
+        )
+        crisps = res.data["items"][0]
+        self.assertEqual((crisps["promotion_discount"], crisps["tax_rate"]), ("99.99", "0.1600"))
+
+    def test_cart_totals_match_the_order(self):
+        self.promote("multi_buy", product=self.crisps, buy_quantity=3, bundle_price=Decimal("250"))
+        cart = self.client.post("/api/carts/", {}, format="json").data["id"]
+        self.client.post(f"/api/carts/{cart}/lines/", {"product": self.crisps.id, "quantity": 4}, format="json")
+        res = self.client.post(f"/api/carts/{cart}/lines/", {"product": self.bread.id}, format="json")
+        self.assertEqual((res.data["subtotal"], res.data["tax_amount"]), ("414.99", "56.00"))
+
+        order = Order.objects.get(pk=self.client.post(f"/api/carts/{cart}/checkout/").data["id"])
+        totals = (order.subtotal, order.tax_amount, order.total_amount)
+        order.calculate_totals()
+        order.refresh_from_db()
+        self.assertEqual(totals, (order.subtotal, order.tax_amount, order.total_amount))
+
+
+# ─── Product images ───────────────────────────────────────────────────────────
+
+@override_settings(JOBS_INLINE=True, PRODUCT_IMAGE_SIZES=(64, 160))
+class ImagePipelineTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+        self.user = User.objects.create_user("manager", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def png(self, color="red"):
+        buf = io.BytesIO()
+        Image.new("RGB", (819, 1024), color).save(buf, "PNG")
+        return SimpleUploadedFile("tshirt-819x1024.png", buf.getvalue(), content_type="image/png")
+
+    def upload(self, name, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post("/api/products/", {"name": name, "price": "500", "is_active": True, "image": image},
+                                   format="multipart")
+        self.assertEqual(res.status_code, 201, res.content)
+        return Product.objects.get(pk=res.data["id"])
+
+    def test_identical_images_are_stored_once(self):
+        first, second = self.upload("Tee", self.png()), self.upload("Tee 2", self.png())
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r"^products/[0-9a-f]{2}/[0-9a-f]{64}\.png$")
+        self.assertNotEqual(self.upload("Tee 3", self.png("blue")).image.name, first.image.name)
+        files = [f for _, _, names in os.walk(settings.MEDIA_ROOT) for f in names if f.endswith(".png")]
+        self.assertEqual(len(files), 2)
+
+    def test_thumbnails_are_rendered_and_exposed(self):
+        product = self.upload("Tee", self.png())
+        self.assertEqual(product.image_sizes, [64, 160])
+        for size in (64, 160):
+            with Image.open(product.image.storage.path(thumbnail_name(product.image.name, size))) as thumb:
+                self.assertEqual((thumb.format, max(thumb.size)), ("WEBP", size))
+
+        urls = self.client.get(f"/api/products/{product.id}/").data["image_urls"]
+        self.assertEqual(sorted(urls), ["160", "64"])
+        self.assertTrue(urls["64"].endswith(thumbnail_name(product.image.name, 64)))
+
+    def test_content_addressed_files_are_cached_forever(self):
+        product = self.upload("Tee", self.png())
+        request = APIRequestFactory().get("/")
+        thumb = serve_media(request, thumbnail_name(product.image.name, 64), document_root=settings.MEDIA_ROOT)
+        self.assertEqual(thumb["Cache-Control"], "public, max-age=31536000, immutable")
+
+    def test_replacing_the_image_resets_thumbnails(self):
+        product = self.upload("Tee", self.png())
+        product.image.save("new.png", self.png("green"), save=True)
+        product.refresh_from_db()
+        self.assertEqual(product.image_sizes, [])
+
+
+# ─── Synthetic data ───────────────────────────────────────────────────────────
+
+class SyntheticDataTests(TestCase):
+    def generate(self):
+        generator = HistoryGenerator(seed=3, stores=2, days=3, orders_per_day=8, products=40, customers=10,
+                                     batch_size=25, end_date=date(2025, 12, 27))
+        generator.seed_reference_data()
+        return generator.generate()
+
+    def test_history_is_consistent(self):
+        counts = self.generate()
+        self.assertEqual(counts["orders"], Order.objects.count())
+        self.assertEqual(counts["items"], OrderItem.objects.count())
+        tz = timezone.get_current_timezone()
+        for order in Order.objects.prefetch_related("items", "payments"):
+            self.assertEqual(order.subtotal, sum(item.total_price for item in order.items.all()))
+            self.assertTrue(7 <= order.created_at.astimezone(tz).hour < 22)
+            paid = [p.amount for p in order.payments.all()]
+            self.assertEqual(paid, [] if order.status == Order.StatusChoices.CANCELLED else [order.total_amount])
+        for level in StockLevel.objects.filter(product__barcode__startswith="SYN"):
+            last = level.product.stock_movements.filter(store=level.store).order_by("-id").first()
+            self.assertEqual(level.quantity, last.new_stock if last else level.quantity)
+        self.assertEqual(set(Order.objects.values_list("store__code", flat=True)), {"store01", "store02"})
+
+    def test_same_seed_same_history(self):
+        self.generate()
+        first = list(Order.objects.order_by("id").values_list("order_number", "customer", "total_amount", "created_at"))
+        Order.objects.all().delete()
+        self.generate()
+        again = list(Order.objects.order_by("id").values_list("order_number", "customer", "total_amount", "created_at"))
+        self.assertEqual(first, again)
+
+    def test_tiny_catalog_without_customers(self):
+        # Baskets larger than the catalog, nobody to sell to, and no end date
+        generator = HistoryGenerator(seed=5, stores=1, days=2, orders_per_day=20, products=2, customers=0)
+        generator.seed_reference_data()
+        generator.generate()
+        tz = timezone.get_current_timezone()
+        self.assertEqual(max(o.created_at.astimezone(tz).date() for o in Order.objects.all()), END_DATE)
+        self.assertFalse(Order.objects.exclude(customer=None).exists())
+        self.assertLessEqual(max(o.items.count() for o in Order.objects.all()), 2)
+
+
+# ─── Benchmarks ───────────────────────────────────────────────────────────────
+
+class BenchmarkCompareTests(TestCase):
+    def test_p95_regressions_beyond_tolerance_are_flagged(self):
+        baseline = {"small": {"scan": {"p95_ms": 2.0}, "checkout": {"p95_ms": 10.0}, "gone": {"p95_ms": 1.0}}}
+        results = {"small": {"scan": {"p95_ms": 2.4}, "checkout": {"p95_ms": 13.0}, "new": {"p95_ms": 5.0}}}
+        rows = {row["scenario"]: row for row in compare(results, baseline, tolerance=0.25)}
+        self.assertEqual(sorted(rows), ["checkout", "scan"])
+        self.assertEqual((rows["scan"]["change"], rows["scan"]["regressed"]), (0.2, False))
+        self.assertEqual((rows["checkout"]["change"], rows["checkout"]["regressed"]), (0.3, True))
+
+
+# ─── Metrics ──────────────────────────────────────────────────────────────────
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        registry.reset()
+        self.user = User.objects.create_user("cashier", password="x")
+        self.staff = User.objects.create_user("manager", password="x", is_staff=True)
+        self.client = APIClient()
+
+    def test_server_timing_header(self):
+        self.client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get("/api/orders/")
+        timing = dict(part.split(";", 1) for part in res["Server-Timing"].split(", "))
+        self.assertEqual(sorted(timing), ["app", "db", "external", "serialize", "total"])
+        self.assertIn(f'desc="{len(queries)} queries"', timing["db"])
+
+    def test_histograms_per_endpoint(self):
+        self.client.force_authenticate(self.user)
+        for _ in range(3):
+            self.client.get("/api/orders/")
+        self.assertEqual(self.client.get("/api/metrics/").status_code, 403)
+
+        self.client.force_authenticate(self.staff)
+        body = self.client.get("/api/metrics/").content.decode()
+        self.assertIn('pos_request_duration_seconds_count{endpoint="order-list",method="GET"} 3', body)
+        self.assertIn('pos_request_duration_seconds_bucket{endpoint="order-list",method="GET",le="+Inf"} 3', body)
+        self.assertIn('pos_requests_total{endpoint="order-list",method="GET",status="200"} 3', body)
+
+    @override_settings(METRICS_TOKEN="scrape-me")
+    def test_scraper_token(self):
+        self.assertEqual(self.client.get("/api/metrics/", HTTP_AUTHORIZATION="Bearer scrape-me").status_code, 200)
+        self.assertEqual(self.client.get("/api/metrics/", HTTP_AUTHORIZATION="Bearer wrong").status_code, 401)
+
+    def test_worker_snapshots_are_summed(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.client.force_authenticate(self.user)
+        with override_settings(METRICS_DIR=directory, METRICS_FLUSH_SECONDS=0):
+            self.client.get("/api/orders/")
+            # Another worker's snapshot, as if it had handled the same request twice
+            with open(os.path.join(directory, f"worker-{os.getpid()}.json")) as f:
+                snapshot = json.load(f)
+            for name, labels, counts, total in snapshot["histograms"]:
+                counts[:] = [n * 2 for n in counts]
+            with open(os.path.join(directory, "worker-1.json"), "w") as f:
+                json.dump(snapshot, f)
+            body = exposition()
+        self.assertIn('pos_request_duration_seconds_count{endpoint="order-list",method="GET"} 3', body)
+
+
+# ─── Profiling ────────────────────────────────────────────────────────────────
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.enterContext(override_settings(PROFILE_DIR=directory))
+        self.store = ProfileStore()
+        self.staff = User.objects.create_user("manager", password="x", is_staff=True)
+        self.cashier = User.objects.create_user("cashier", password="x")
+        self.client = APIClient()
+
+    def login(self, user):
+        # A real token: the middleware checks it before the view's own authentication runs
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(user).access_token}")
+
+    def test_staff_can_profile_a_request(self):
+        self.login(self.staff)
+        res = self.client.get("/api/orders/", HTTP_X_PROFILE="1")
+        record = self.store.get(res["X-Profile-Id"])
+        self.assertEqual((record["endpoint"], record["status"], record["trigger"]), ("order-list", 200, "header"))
+        self.assertTrue(record["queries"] and record["functions"])
+        self.assertTrue(os.path.exists(os.path.join(self.store.directory, record["id"] + ".prof")))
+
+        out = io.StringIO()
+        call_command("profiles", stdout=out)
+        self.assertIn(record["id"], out.getvalue())
+
+    def test_header_is_ignored_for_other_users(self):
+        with mock.patch("pos.profiling.cProfile.Profile") as profile:
+            self.assertEqual(self.client.get("/api/orders/", HTTP_X_PROFILE="1").status_code, 401)
+            self.client.credentials(HTTP_AUTHORIZATION="Bearer not-a-token")
+            self.client.get("/api/orders/", HTTP_X_PROFILE="1")
+            self.login(self.cashier)
+            res = self.client.get("/api/orders/", HTTP_X_PROFILE="1")
+            # async endpoints as well
+            self.client.get(f"/api/async/scan/{uuid.uuid4().hex[:8]}/", HTTP_X_PROFILE="1")
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn("X-Profile-Id", res)
+        profile.assert_not_called()
+        self.assertEqual(self.store.records(), [])
+
+    def test_async_requests_can_be_profiled(self):
+        self.login(self.staff)
+        res = self.client.get("/api/async/catalog/", HTTP_X_PROFILE="1")
+        self.assertEqual(self.store.get(res["X-Profile-Id"])["trigger"], "header")
+
+    @override_settings(PROFILE_SAMPLE_RATE=1.0, PROFILE_MAX_FILES=3)
+    def test_sampling_and_rotation(self):
+        self.client.force_authenticate(self.cashier)
+        ids = [self.client.get("/api/orders/")["X-Profile-Id"] for _ in range(5)]
+        self.assertEqual([r["id"] for r in self.store.records()], ids[2:])
+
+        # Each kind keeps its own newest records
+        store = ProfileStore()
+        for n in range(4):
+            store.save({"id": self.store.new_id("query"), "kind": "query", "sql": f"SELECT {n}"})
+        self.assertEqual([r["id"] for r in self.store.records("request")], ids[2:])
+        self.assertEqual([r["sql"] for r in self.store.records("query")], ["SELECT 1", "SELECT 2", "SELECT 3"])
+
+    @override_settings(SLOW_QUERY_MS=0)
+    def test_slow_queries_are_logged_with_their_plan(self):
+        with self.assertLogs("pos.slow_queries", "WARNING"):
+            list(Order.objects.filter(status="completed"))
+        record = next(r for r in self.store.records("query") if 'FROM "pos_order"' in r["sql"])
+        self.assertTrue(record["explain"])
+        self.assertFalse(any(line.startswith("EXPLAIN failed") for line in record["explain"]))
+
+
+# ─── Response cache ───────────────────────────────────────────────────────────
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("cashier", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(name="Dairy")
+        self.product = Product.objects.create(name="Milk", category=self.category, price=Decimal("75"))
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        return res, len(queries)
+
+    def test_repeat_read_is_served_without_queries(self):
+        first, _ = self.get("/api/products/")
+        second, queries = self.get("/api/products/")
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(queries, 0)
+        self.assertEqual(first.data, second.data)
+
+    def test_query_params_are_part_of_the_key(self):
+        self.get("/api/products/")
+        res, _ = self.get("/api/products/?search=milk")
+        self.assertEqual(res["X-Cache"], "MISS")
+
+    def test_save_invalidates_dependent_endpoints(self):
+        self.get("/api/products/")
+        self.get("/api/categories/")
+        self.category.name = "Dairy & Eggs"
+        self.category.save()
+        products, _ = self.get("/api/products/")
+        categories, _ = self.get("/api/categories/")
+        self.assertEqual(products["X-Cache"], "MISS")
+        self.assertEqual(categories["X-Cache"], "MISS")
+        self.assertEqual(products.data["results"][0]["category_name"], "Dairy & Eggs")
+
+    def test_set_based_update_invalidates(self):
+        self.get("/api/products/")
+        StockLevel.objects.bulk_create([StockLevel(store=main_store(), product=self.product, quantity=5)])
+        bump_version(StockLevel)
+        res, _ = self.get("/api/products/")
+        self.assertEqual(res.data["results"][0]["stock_quantity"], 5)
+
+
+# ─── Tuned SQLite backend ─────────────────────────────────────────────────────
+
+class TunedSQLiteTests(TestCase):
+    def connect(self, pragmas=None):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        wrapper = TunedSQLiteWrapper({
+            **connection.settings_dict, "ENGINE": "pos.backends.sqlite3",
+            "NAME": os.path.join(directory, "tills.sqlite3"), "OPTIONS": {"pragmas": pragmas or {}},
+        }, alias="tuned")
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def pragma(self, wrapper, name):
+        with wrapper.cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    def test_new_connections_get_the_pragmas(self):
+        wrapper = self.connect({"busy_timeout": 1234})
+        self.assertEqual(
+            [self.pragma(wrapper, name) for name in ("journal_mode", "synchronous", "busy_timeout", "temp_store")],
+            ["wal", 1, 1234, 2],  # synchronous NORMAL, temp_store MEMORY
+        )
+        self.assertEqual(self.pragma(wrapper, "cache_size"), DEFAULT_PRAGMAS["cache_size"])
+
+    def test_transactions_take_the_write_lock_up_front(self):
+        wrapper = self.connect()
+        wrapper.ensure_connection()
+        # What transaction.atomic() does on entry
+        wrapper.set_autocommit(False, force_begin_transaction_with_broken_autocommit=True)
+        self.addCleanup(wrapper.rollback)
+        # Nothing written yet, but another writer is already locked out
+        other = sqlite3.connect(wrapper.settings_dict["NAME"], timeout=0)
+        self.addCleanup(other.close)
+        with self.assertRaisesRegex(sqlite3.OperationalError, "locked"):
+            other.execute("BEGIN IMMEDIATE")
+
+
+# ─── Read replica routing ─────────────────────────────────────────────────────
+# Run with a second alias configured, e.g.
+#     DB_REPLICA_NAME=replica.sqlite3 python manage.py test pos
+# The replica mirrors the test database, so it needs committed data
+# (TransactionTestCase) to see what the test wrote.
+
+HAS_REPLICA = "replica" in settings.DATABASES
+
+
+class ReplicaHealthTests(TestCase):
+    def test_callers_during_the_first_probe_wait_for_its_result(self):
+        health, probing, release = routers.ReplicaHealth(), threading.Event(), threading.Event()
+
+        def slow_lag(alias):
+            probing.set()
+            release.wait(5)
+            return 0.0
+
+        results = []
+        with mock.patch.object(routers, "replica_lag", side_effect=slow_lag) as lag:
+            first = threading.Thread(target=lambda: results.append(health.is_healthy("replica")))
+            first.start()
+            probing.wait(5)
+            second = threading.Thread(target=lambda: results.append(health.is_healthy("replica")))
+            second.start()
+            release.set()
+            first.join(5)
+            second.join(5)
+        self.assertEqual((results, lag.call_count), ([True, True], 1))
+
+
+@skipUnless(HAS_REPLICA, "no replica alias configured")
+class ReplicaRoutingTests(TransactionTestCase):
+    databases = {"default", "replica"} if HAS_REPLICA else {"default"}
+
+    def setUp(self):
+        cache.clear()
+        routers.health.reset()
+        self.user = User.objects.create_user("cashier", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.order = Order.objects.create(store=main_store(), cashier=self.user)
+
+    def tearDown(self):
+        routers.health.reset()
+
+    def queries_per_alias(self, method, url):
+        with CaptureQueriesContext(connections["default"]) as primary, \
+                CaptureQueriesContext(connections["replica"]) as replica:
+            res = getattr(self.client, method)(url)
+        self.assertLess(res.status_code, 400)
+        return len(primary), len(replica)
+
+    def test_report_reads_go_to_replica(self):
+        primary, replica = self.queries_per_alias("get", "/api/orders/")
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_till_endpoints_stay_on_primary(self):
+        primary, replica = self.queries_per_alias("get", "/api/products/")
+        self.assertEqual(replica, 0)
+
+    def test_client_is_pinned_to_primary_after_a_write(self):
+        self.queries_per_alias("post", f"/api/orders/{self.order.id}/cancel/")
+        primary, replica = self.queries_per_alias("get", "/api/orders/")
+        self.assertEqual(replica, 0)
+
+    def test_async_report_reads_go_to_replica(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user).access_token}")
+        primary, replica = self.queries_per_alias("get", "/api/async/dashboard/")
+        self.assertGreater(replica, 0)
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        with mock.patch.object(routers, "replica_lag", return_value=settings.DATABASE_REPLICA_MAX_LAG + 1):
+            primary, replica = self.queries_per_alias("get", "/api/dashboard/")
+        self.assertEqual(replica, 0)
+        self.assertGreater(primary, 0)
+
+
+# ─── Cached JWT users ─────────────────────────────────────────────────────────
+
+class CachedAuthTests(TestCase):
+    def setUp(self):
+        users.clear()
+        cache.clear()
+        self.user = User.objects.create_user("till1", password="x")
+        Product.objects.create(name="Milk", barcode="5900001", price=Decimal("75"))
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user).access_token}")
+
+    def scan(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get("/api/products/?barcode=5900001")
+        return res, [q["sql"] for q in queries]
+
+    def test_repeat_requests_do_no_auth_queries(self):
+        res, first = self.scan()
+        self.assertEqual(res.status_code, 200)
+        res, second = self.scan()
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(first) - len(second), 1)
+        self.assertFalse([sql for sql in second if "auth_user" in sql])
+
+    def test_deactivation_evicts_the_cached_user(self):
+        self.scan()
+        self.user.is_active = False
+        self.user.save()
+        res, _ = self.scan()
+        self.assertEqual(res.status_code, 401)
+
+    def test_views_get_their_own_instance(self):
+        auth = CachedJWTAuthentication()
+        token = auth.get_validated_token(str(RefreshToken.for_user(self.user).access_token))
+        first, second = auth.get_user(token), auth.get_user(token)
+        self.assertEqual(first, second)
+        self.assertIsNot(first, second)
+        self.assertIsNot(second, users.get(self.user.id))
+
+
+# ─── Fast read path ───────────────────────────────────────────────────────────
+
+class FastReadTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("cashier", password="x", first_name="Jane", last_name="Wanjiku")
+        dairy = Category.objects.create(name="Dairy")
+        self.products = [
+            stocked(Product.objects.create(name="Milk 500ml", category=dairy, price=Decimal("75"),
+                                           image="products/milk fresh ü.webp", image_sizes=[64, 320]), 4),
+            Product.objects.create(name="Maziwa \u2028 lala", price=Decimal("1850.5"), cost_price=Decimal("1400")),
+        ]
+        customer = Customer.objects.create(name="Alice", phone="0712345001")
+        for cust in (customer, None):
+            order = Order.objects.create(store=main_store(), customer=cust, cashier=self.user, discount_amount=Decimal("10"))
+            OrderItem.objects.create(order=order, product=self.products[0], quantity=3, unit_price=Decimal("75"),
+                                     discount=Decimal("12.5"))
+            OrderItem.objects.create(order=order, product=self.products[1], quantity=1, unit_price=Decimal("1850.50"))
+            order.calculate_totals()
+            Payment.objects.create(order=order, method="mpesa", amount=order.total_amount, status="completed",
+                                   mpesa_phone="254712345001", mpesa_transaction_date=timezone.now())
+        Order.objects.create(store=main_store(), cashier=None)
+        self.request = Request(APIRequestFactory().get("/api/products/"))
+
+    def assert_same_bytes(self, serializer_data, rows):
+        self.assertEqual(JSONRenderer().render(serializer_data), ORJSONRenderer().render(rows))
+
+    def test_product_rows_match_serializer(self):
+        qs = with_stock(Product.objects.select_related("category").order_by("id"), main_store())
+        builder = ProductRows(self.request)
+        self.assert_same_bytes(
+            ProductSerializer(qs, many=True, context={"request": self.request}).data,
+            builder.build(builder.prepare(qs)),
+        )
+
+    def test_stock_movement_rows_match_serializer(self):
+        with transaction.atomic():
+            apply_stock_changes({self.products[0].id: 5}, "restock", "GRN-1", self.user, main_store())
+            apply_stock_changes({self.products[1].id: -1}, "sale", "Till", None, main_store())
+        qs = StockMovement.objects.select_related("product", "created_by").order_by("id")
+        builder = StockMovementRows(self.request)
+        self.assert_same_bytes(StockMovementSerializer(qs, many=True).data, builder.build(builder.prepare(qs)))
+
+    def test_order_rows_match_serializer(self):
+        qs = Order.objects.select_related("customer", "cashier").prefetch_related("items__product", "payments")
+        builder = OrderRows(self.request)
+        self.assert_same_bytes(
+            OrderSerializer(qs, many=True, context={"request": self.request}).data,
+            builder.build(builder.prepare(qs)),
+        )
+
+    def test_order_list_is_slim_by_default(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        row = next(r for r in client.get("/api/orders/").data["results"] if r["customer"])
+        self.assertEqual(list(row), [
+            "id", "order_number", "customer", "customer_name", "cashier_name", "status",
+            "total_amount", "item_count", "payment_method", "created_at",
+        ])
+        self.assertEqual((row["item_count"], row["payment_method"]), (2, "mpesa"))
+        detail = client.get(f"/api/orders/{row['id']}/").data
+        self.assertEqual(list(detail), list(OrderRows.FIELDS))
+
+    def test_sparse_fields_and_expand(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            rows = client.get("/api/orders/?fields=order_number,total_amount&expand=items").data["results"]
+        self.assertEqual(len(queries), 3)
+        self.assertEqual([list(r) for r in rows], [["order_number", "total_amount", "items"]] * 3)
+        self.assertEqual(sorted(len(r["items"]) for r in rows), [0, 2, 2])
+        res = client.get("/api/orders/?fields=order_number,mpesa_secret")
+        self.assertEqual(res.status_code, 400)
+
+    def test_renderer_matches_stdlib_renderer(self):
+        data = {"a": Decimal("1.50"), "b": [1, 2.5, None, True], "c": timezone.now(), "d": "line\u2029sep", 1: "x"}
+        self.assertEqual(JSONRenderer().render(data), ORJSONRenderer().render(data))
+
+    def test_parser_round_trip(self):
+        import io
+        body = ORJSONRenderer().render({"items": [{"product": 1, "quantity": 2}]})
+        self.assertEqual(ORJSONParser().parse(io.BytesIO(body)), {"items": [{"product": 1, "quantity": 2}]})
+
+
+# ─── Async endpoints ──────────────────────────────────────────────────────────
+
+class AsyncEndpointTests(TestCase):
+    def setUp(self):
+        users.clear()
+        cache.clear()
+        registry.reset()
+        self.user = User.objects.create_user("till1", password="x")
+        self.milk = stocked(Product.objects.create(name="Milk", barcode="5900001", price=Decimal("75")), 10)
+        Product.objects.create(name="Old stock", barcode="5900002", price=Decimal("20"), is_active=False)
+        Customer.objects.create(name="Alice Njeri", phone="0712345001")
+        Customer.objects.create(name="Bob Otieno", phone="0722000002")
+        self.order = Order.objects.create(store=main_store(), cashier=self.user, total_amount=Decimal("75"))
+        self.payment = Payment.objects.create(order=self.order, method="mpesa", amount=Decimal("75"))
+        token = f"Bearer {RefreshToken.for_user(self.user).access_token}"
+        self.headers = {"Authorization": token}
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=token)
+
+    async def get(self, path, data=None, headers=None):
+        return await AsyncClient().get(path, data, headers=self.headers if headers is None else headers)
+
+    async def test_scan_matches_the_product_endpoint(self):
+        res = await self.get("/api/async/scan/5900001/")
+        self.assertEqual(res.status_code, 200)
+        listed = await sync_to_async(self.client.get)("/api/products/?barcode=5900001")
+        self.assertEqual(json.loads(res.content), json.loads(listed.content)["results"][0])
+        self.assertIn("db;dur=", res["Server-Timing"])
+        self.assertIn('endpoint="async-scan"', exposition())
+
+        self.assertEqual((await self.get("/api/async/scan/5900002/")).status_code, 404)
+        self.assertEqual((await self.get("/api/async/scan/5900001/", headers={})).status_code, 401)
+        res = await self.get("/api/async/scan/5900001/", headers={"Authorization": "Bearer nope"})
+        self.assertEqual(res.status_code, 401)
+
+    async def test_dashboard_matches_the_sync_endpoint(self):
+        res = await self.get("/api/async/dashboard/")
+        sync = await sync_to_async(self.client.get)("/api/dashboard/")
+        self.assertEqual(res.content, sync.content)
+
+    def test_catalog_delta_sync(self):
+        full = self.client.get("/api/async/catalog/").json()
+        self.assertTrue(full["full"])
+        self.assertEqual([p["barcode"] for p in full["products"]], ["5900001"])
+
+        later = timezone.now() + async_views.SYNC_OVERLAP
+        with mock.patch("django.utils.timezone.now", return_value=later + timedelta(seconds=1)):
+            apply_stock_changes({self.milk.id: -2}, "sale", "T1", self.user, main_store())
+        delta = self.client.get("/api/async/catalog/", {"since": later.isoformat()}).json()
+        self.assertFalse(delta["full"])
+        self.assertEqual([(p["barcode"], p["stock_quantity"]) for p in delta["products"]], [("5900001", 8)])
+        self.assertEqual(self.client.get("/api/async/catalog/?since=yesterday").status_code, 400)
+
+    async def test_customer_lookup(self):
+        res = await self.get("/api/async/customers/lookup/", {"q": "ALI"})
+        self.assertEqual([c["phone"] for c in json.loads(res.content)["results"]], ["0712345001"])
+        res = await self.get("/api/async/customers/lookup/", {"q": "+25472"})
+        self.assertEqual([c["name"] for c in json.loads(res.content)["results"]], ["Bob Otieno"])
+        res = await self.get("/api/async/customers/lookup/", {"phone": "+254 712 345 001"})
+        self.assertEqual(list(json.loads(res.content)["results"][0]),
+                         ["id", "name", "phone", "email", "loyalty_points", "created_at"])
+        self.assertEqual((await self.get("/api/async/customers/lookup/")).status_code, 400)
+
+    @override_settings(PAYMENT_STATUS_POLL_SECONDS=0.01)
+    async def test_payment_status_long_poll(self):
+        url = f"/api/async/payments/{self.payment.id}/status/"
+        polls = []
+
+        async def settle_on_second_poll(seconds):
+            polls.append(seconds)
+            if len(polls) == 2:
+                await Payment.objects.filter(pk=self.payment.pk).aupdate(status="completed",
+                                                                        mpesa_receipt_number="QWE123")
+
+        with mock.patch.object(async_views.asyncio, "sleep", settle_on_second_poll):
+            res = await self.get(url, {"wait": "5"})
+        body = json.loads(res.content)
+        self.assertEqual((body["status"], body["mpesa_receipt_number"], body["order_status"]),
+                         ("completed", "QWE123", "pending"))
+        self.assertEqual(len(polls), 2)
+
+        pending = await Payment.objects.acreate(order=self.order, method="mpesa", amount=Decimal("1"))
+        res = await self.get(f"/api/async/payments/{pending.id}/status/", {"wait": "0.02"})
+        self.assertEqual(json.loads(res.content)["status"], "pending")
+        self.assertEqual((await self.get(url, {"wait": "nan"})).status_code, 400)
+        self.assertEqual((await self.get("/api/async/payments/999999/status/")).status_code, 404)
+
+
+# ─── Customer lookup ──────────────────────────────────────────────────────────
+
+class CustomerLookupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("cashier", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.wanjiku = Customer.objects.create(name="Wanjikũ  Kamau", phone="0712 345 678")
+        Customer.objects.create(name="Wanjiru Otieno", phone="+254722000111")
+        Customer.objects.create(name="Kamau Njoroge", phone="733000222")
+
+    def test_phone_numbers_are_normalized(self):
+        for typed in ("0712345678", "+254712345678", "254 712-345-678", "712345678"):
+            self.assertEqual(normalize_phone(typed), "254712345678", typed)
+        self.assertEqual((normalize_phone("07"), normalize_phone("abc")), ("2547", ""))
+        self.assertEqual((self.wanjiku.phone_normalized, self.wanjiku.name_key), ("254712345678", "wanjiku kamau"))
+
+        for typed in ("0712345678", "+254 712 345 678", "254712345678"):
+            res = self.client.get("/api/customers/", {"phone": typed})
+            self.assertEqual([c["id"] for c in res.data["results"]], [self.wanjiku.id], typed)
+        self.assertEqual(self.client.get("/api/customers/", {"phone": "n/a"}).data["results"], [])
+
+        res = self.client.post("/api/customers/", {"name": "Again", "phone": "+254712345678"}, format="json")
+        self.assertEqual(res.status_code, 400)
+        self.wanjiku.phone = "0799000333"
+        self.wanjiku.save(update_fields=["phone"])
+        self.assertEqual(Customer.objects.get(pk=self.wanjiku.pk).phone_normalized, "254799000333")
+
+    def test_type_ahead_matches_name_and_number_prefixes(self):
+        def names(term):
+            res = self.client.get("/api/customers/", {"search": term})
+            return [c["name"] for c in res.data["results"]]
+
+        self.assertEqual(names("wanji"), ["Wanjikũ  Kamau", "Wanjiru Otieno"])
+        self.assertEqual(names("Wanjiku k"), ["Wanjikũ  Kamau"])
+        self.assertEqual(names("0722"), ["Wanjiru Otieno"])
+        self.assertEqual(names("+2547"), ["Kamau Njoroge", "Wanjikũ  Kamau", "Wanjiru Otieno"])
+        self.assertEqual(names("njoroge"), [])
+
+    @skipUnless(connection.vendor == "sqlite", "reads SQLite's query plan")
+    def test_lookups_use_the_indexes(self):
+        with connection.cursor() as cursor:
+            def plan(q):
+                sql, params = Customer.objects.filter(q).values("id").query.sql_with_params()
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+                return " ".join(row[-1] for row in cursor.fetchall())
+
+            self.assertNotIn("SCAN", plan(phone_lookup("0712345678")))
+            self.assertNotIn("SCAN", plan(type_ahead("wanj")))
+            self.assertNotIn("SCAN", plan(type_ahead("0712")))
+
+
+# ─── Background jobs ──────────────────────────────────────────────────────────
+
+calls = []
+
+
+@jobs.task(queue="test", max_attempts=2, backoff=60, on_failure=lambda kwargs, error: calls.append(("failed", kwargs)))
+def record_call(value, fail=False):
+    calls.append(("run", value))
+    if fail:
+        raise RuntimeError("boom")
+
+
+@override_settings(JOBS_INLINE=False)
+class JobQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+        self.user = User.objects.create_user("cashier", password="x")
+
+    def age(self, job, **fields):
+        # Move a job's times into the past instead of waiting
+        Job.objects.filter(pk=job.pk).update(**fields)
+
+    def test_each_job_is_claimed_once(self):
+        first, second = record_call.delay(value=1), record_call.delay(value=2)
+        self.assertEqual([j.pk for j in jobs.claim("a")], [first.pk])
+        self.assertEqual([j.pk for j in jobs.claim("b", limit=5)], [second.pk])
+        self.assertEqual(jobs.claim("c"), [])
+        self.assertEqual(jobs.claim("d", queues=["payments"]), [])
+
+        self.assertEqual(jobs.Worker(queues=["test"]).run_once(), 0)
+        self.age(first, locked_until=timezone.now() - timedelta(seconds=1))
+        job = jobs.claim("e")[0]
+        self.assertEqual((job.pk, job.attempts), (first.pk, 2))
+        self.assertTrue(jobs.execute(job))
+        self.assertEqual(calls, [("run", 1)])
+        self.assertEqual(Job.objects.get(pk=first.pk).status, Job.StatusChoices.DONE)
+
+    def test_stale_worker_cannot_overwrite_a_reclaimed_job(self):
+        job = record_call.delay(value=1)
+        stale = jobs.claim("a")[0]
+        self.age(job, locked_until=timezone.now() - timedelta(seconds=1))
+        fresh = jobs.claim("b")[0]
+        jobs.execute(stale)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.StatusChoices.RUNNING)
+        jobs.execute(fresh)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.StatusChoices.DONE)
+
+    def test_failures_back_off_then_fail_for_good(self):
+        job = record_call.delay(value=1, fail=True)
+        with self.assertLogs("pos.jobs", "WARNING"):
+            self.assertFalse(jobs.execute(jobs.claim("a")[0]))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.StatusChoices.QUEUED, 1))
+        self.assertGreaterEqual(job.run_at, timezone.now() + timedelta(seconds=29))
+        self.assertIn("RuntimeError: boom", job.last_error)
+        self.assertEqual(jobs.claim("a"), [])
+
+        self.age(job, run_at=timezone.now())
+        with self.assertLogs("pos.jobs", "ERROR"):
+            self.assertFalse(jobs.execute(jobs.claim("a")[0]))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.StatusChoices.FAILED, 2))
+        self.assertEqual(calls, [("run", 1), ("run", 1), ("failed", {"value": 1, "fail": True})])
+
+        call_command("run_workers", "--retry-failed", stdout=io.StringIO())
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.StatusChoices.QUEUED)
+
+    @override_settings(JOBS_INLINE=True)
+    def test_inline_jobs_run_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertIsNone(record_call.delay(value=3))
+            self.assertEqual(calls, [])
+        self.assertEqual(calls, [("run", 3)])
+        self.assertFalse(Job.objects.exists())
+
+    @mock.patch("pos.mpesa.requests")
+    def test_stk_push_is_sent_from_a_job(self, daraja):
+        daraja.get.return_value.json.return_value = {"access_token": "token"}
+        daraja.post.return_value.json.return_value = {
+            "ResponseCode": "0", "CheckoutRequestID": "ws_CO_1", "MerchantRequestID": "m-1",
+        }
+        order = Order.objects.create(store=main_store(), cashier=self.user)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        res = client.post("/api/payments/mpesa/stk-push/",
+                          {"order_id": order.id, "phone_number": "0712345678", "amount": "100"}, format="json")
+        self.assertEqual(res.status_code, 202)
+        daraja.post.assert_not_called()
+
+        worker = jobs.Worker(queues=["payments"])
+        self.assertEqual(worker.run_once(), 1)
+        payment = Payment.objects.get(pk=res.data["payment_id"])
+        self.assertEqual((payment.mpesa_checkout_request_id, payment.mpesa_phone), ("ws_CO_1", "254712345678"))
+        self.assertEqual(daraja.post.call_args.kwargs["json"]["PhoneNumber"], "254712345678")
+
+        daraja.post.return_value.json.return_value = {"ResponseCode": "1", "ResponseDescription": "Rejected"}
+        res = client.post("/api/payments/mpesa/stk-push/",
+                          {"order_id": order.id, "phone_number": "0712345678", "amount": "100"}, format="json")
+        with self.assertLogs("pos.mpesa", "WARNING"):
+            worker.run_once()
+        self.assertEqual(Payment.objects.get(pk=res.data["payment_id"]).status, Payment.StatusChoices.FAILED)
+
+
+@override_settings(JOBS_INLINE=False)
+class RunWorkersTests(TransactionTestCase):
+    def test_burst_runs_everything_due(self):
+        calls.clear()
+        for value in range(5):
+            record_call.delay(value=value)
+        out = io.StringIO()
+        call_command("run_workers", "--burst", "--threads", "2", "--batch", "2", stdout=out)
+        self.assertEqual(sorted(value for _, value in calls), [0, 1, 2, 3, 4])
+        self.assertEqual(Job.objects.filter(status=Job.StatusChoices.DONE).count(), 5)
+
+        call_command("run_workers", "--status", stdout=out)
+        self.assertRegex(out.getvalue(), r"test\s+0\s+0\s+5\s+0")
+
+
+# ─── Loyalty ──────────────────────────────────────────────────────────────────
+
+@override_settings(JOBS_INLINE=True, LOYALTY_SPEND_PER_POINT=100, LOYALTY_POINT_VALUE=1)
+class LoyaltyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("cashier", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.customer = Customer.objects.create(name="Njeri", phone="0712345001", loyalty_points=50)
+        self.product = stocked(Product.objects.create(name="Rice 5kg", price=Decimal("150")), 100)
+
+    def order(self, quantity=2, customer=True):
+        order = Order.objects.create(store=main_store(), customer=self.customer if customer else None, cashier=self.user)
+        OrderItem.objects.create(order=order, product=self.product, quantity=quantity, unit_price=Decimal("150"),
+                                 tax_rate=Decimal("0"))
+        order.calculate_totals()
+        return order
+
+    def pay(self, url, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(url, data, format="json")
+        return res
+
+    def balance(self):
+        self.customer.refresh_from_db()
+        return self.customer.loyalty_points
+
+    def test_completed_orders_earn_points_once(self):
+        order = self.order(quantity=3)
+        res = self.pay("/api/payments/cash/", {"order_id": order.id, "cash_tendered": 500})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.balance(), 54)
+        with self.captureOnCommitCallbacks(execute=True):
+            loyalty.order_completed(Order.objects.get(pk=order.pk))
+        self.assertEqual(list(order.loyalty_entries.values_list("kind", "points")), [("earn", 4)])
+        self.assertEqual(self.balance(), 54)
+
+        self.pay("/api/payments/cash/", {"order_id": self.order(customer=False).id, "cash_tendered": 300})
+        self.assertEqual(LoyaltyEntry.objects.count(), 1)
+
+    @override_settings(JOBS_INLINE=False, LOYALTY_FOLD_BATCH=2)
+    def test_entries_fold_in_batches_behind_one_job(self):
+        other = Customer.objects.create(name="Bob", phone="0722345002")
+        for customer, points in ((self.customer, 5), (other, 7), (self.customer, -3), (other, 1), (other, 2)):
+            LoyaltyEntry.objects.create(customer=customer, kind="adjust", points=points)
+            loyalty.schedule_fold()
+        self.assertEqual(Job.objects.filter(task=loyalty.fold_ledger.name).count(), 1)
+        self.assertEqual(loyalty.available_points(self.customer.pk), 52)
+
+        # Claim, sum and one UPDATE of the balances, inside a savepoint
+        with self.assertNumQueries(6):
+            self.assertEqual(loyalty.fold_batch(), 2)
+        self.assertEqual((self.balance(), Customer.objects.get(pk=other.pk).loyalty_points), (55, 7))
+        loyalty.fold_ledger()
+        self.assertEqual((self.balance(), Customer.objects.get(pk=other.pk).loyalty_points), (52, 10))
+        self.assertFalse(LoyaltyEntry.objects.filter(batch=None).exists())
+        self.assertEqual(loyalty.fold_batch(), 0)
+
+    def test_points_are_tendered_as_a_payment(self):
+        order = self.order()
+        res = self.pay("/api/payments/loyalty/", {"order_id": order.id, "points": 80})
+        self.assertEqual((res.status_code, res.data["error"]), (400, "Customer has 50 point(s)"))
+
+        res = self.pay("/api/payments/loyalty/", {"order_id": order.id, "points": 40})
+        self.assertEqual((res.data["payment"]["method"], res.data["payment"]["amount"]), ("loyalty", "40.00"))
+        self.assertEqual(res.data["order"]["status"], "pending")
+        self.assertEqual(self.balance(), 10)
+
+        res = self.pay("/api/payments/cash/", {"order_id": order.id, "cash_tendered": 300})
+        self.assertEqual((res.data["payment"]["amount"], res.data["change"]), ("260.00", 40.0))
+        # Earned on the 260 paid in cash, not on the points
+        self.assertEqual(self.balance(), 12)
+        self.assertEqual(self.client.get(f"/api/customers/{self.customer.id}/loyalty/").data["available"], 12)
+
+    def test_returns_take_back_points_and_cancelling_gives_them_back(self):
+        order = self.order(quantity=4)
+        self.pay("/api/payments/cash/", {"order_id": order.id, "cash_tendered": 600})
+        self.assertEqual(self.balance(), 56)
+        with self.captureOnCommitCallbacks(execute=True):
+            refund_order(order, self.user, lines={order.items.get().id: 3})
+        self.assertEqual(self.balance(), 51)
+
+        pending = self.order()
+        self.pay("/api/payments/loyalty/", {"order_id": pending.id, "points": 30})
+        self.assertEqual(self.balance(), 21)
+        with self.captureOnCommitCallbacks(execute=True):
+            cancel_order(pending, self.user)
+        self.assertEqual(self.balance(), 51)
+        self.assertEqual(pending.payments.get().status, Payment.StatusChoices.CANCELLED)
+
+    def test_deleting_an_order_unlinks_its_entries(self):
+        order = self.order(quantity=4)
+        self.pay("/api/payments/cash/", {"order_id": order.id, "cash_tendered": 600})
+        self.assertEqual(self.client.delete(f"/api/orders/{order.id}/").status_code, 204)
+        self.assertEqual(list(LoyaltyEntry.objects.values_list("order", "points")), [(None, 6)])
+        self.assertEqual(self.balance(), 56)
+
+    def test_refunds_give_points_back_as_points(self):
+        self.customer.loyalty_points = 150
+        self.customer.save()
+        order = self.order(quantity=2)  # 300
+        self.pay("/api/payments/loyalty/", {"order_id": order.id, "points": 100})
+        self.pay("/api/payments/cash/", {"order_id": order.id, "cash_tendered": 200})
+        self.assertEqual(self.balance(), 52)
+
+        # Half the goods: half of each tender
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(f"/api/orders/{order.id}/refund/",
+                                   {"items": [{"item": order.items.get().id, "quantity": 1}]}, format="json")
+        self.assertEqual(sorted((r["method"], r["amount"]) for r in res.data["refunds"]),
+                         [("cash", "100.00"), ("loyalty", "50.00")])
+        self.assertEqual(self.balance(), 101)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            refunds = refund_order(order, self.user)
+        self.assertEqual(sorted((r.method, r.amount, r.refund_of.method) for r in refunds),
+                         [("cash", Decimal("100.00"), "cash"), ("loyalty", Decimal("50.00"), "loyalty")])
+        # 200 in cash and 100 points back in all; the 2 points the cash earned are taken back
+        self.assertEqual(loyalty.available_points(self.customer.pk), 150)
+        self.assertEqual(self.balance(), 150)
+
+    def test_recompute_applies_a_new_rule_to_past_orders(self):
+        for quantity in (2, 3):
+            self.pay("/api/payments/cash/", {"order_id": self.order(quantity=quantity).id, "cash_tendered": 500})
+        self.pay("/api/payments/loyalty/", {"order_id": self.order().id, "points": 20})
+        self.assertEqual(self.balance(), 50 + 3 + 4 - 20)
+
+        out = io.StringIO()
+        call_command("recompute_loyalty", "--spend-per-point", "50", "--dry-run", stdout=out)
+        self.assertIn("2 order(s) earn 15 point(s)", out.getvalue())
+        self.assertEqual(self.balance(), 37)
+        # Balances that predate the ledger aren't in it: only the change from here on is checked
+        LoyaltyEntry.objects.create(customer=self.customer, kind="adjust", points=50, batch=uuid.uuid4())
+        with override_settings(LOYALTY_SPEND_PER_POINT=50):
+            call_command("recompute_loyalty", stdout=out)
+        self.assertEqual(self.balance(), 50 + 6 + 9 - 20)
+
+
+# ─── Customer segments ────────────────────────────────────────────────────────
+
+class SegmentTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("marketing", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        now = timezone.now()
+        self.customers = {}
+        for name, ages, amount, refunded in (
+            ("Amina", [timedelta(days=1)] * 6, 1000, 0),  # recent, frequent, big spender
+            ("Baraka", [timedelta(days=2)] * 5, 100, 0),
+            ("Chebet", [timedelta(hours=3)], 300, 0),
+            ("Daudi", [timedelta(days=200)] * 4, 800, 0),
+            ("Esther", [timedelta(days=400)], 50, 20),
+        ):
+            customer = self.customers[name] = Customer.objects.create(name=name)
+            for age in ages:
+                order = Order.objects.create(store=main_store(), customer=customer, status="completed", total_amount=amount)
+                Payment.objects.create(order=order, method="cash", amount=amount, status="completed")
+                if refunded:
+                    Payment.objects.create(order=order, method="cash", amount=refunded, status="refunded")
+                Order.objects.filter(pk=order.pk).update(created_at=now - age)
+        # Orders that never went through don't count
+        Order.objects.create(store=main_store(), customer=self.customers["Esther"], status="cancelled", total_amount=900)
+        Order.objects.create(store=main_store(), customer=Customer.objects.create(name="Fatuma"), status="pending", total_amount=10)
+
+    def test_customers_are_binned_by_quintile(self):
+        # Savepoint, delete, INSERT ... SELECT, a cutoff query per metric, two UPDATEs and the counts
+        with self.assertNumQueries(10):
+            counts = segments.rebuild()
+        self.assertEqual(counts, {
+            "champions": 1, "loyal": 1, "new": 1, "promising": 0, "at_risk": 1, "hibernating": 0, "lost": 1,
+        })
+        rows = {
+            row.customer.name: (row.recency_score, row.frequency_score, row.monetary_score, row.segment)
+            for row in CustomerSegment.objects.select_related("customer")
+        }
+        self.assertEqual(rows, {
+            "Amina": (4, 5, 5, "champions"),
+            "Baraka": (3, 4, 3, "loyal"),
+            "Chebet": (5, 1, 2, "new"),  # one order ties with Esther's: both take the lowest score
+            "Daudi": (2, 3, 4, "at_risk"),
+            "Esther": (1, 1, 1, "lost"),
+        })
+        esther = CustomerSegment.objects.get(customer=self.customers["Esther"])
+        self.assertEqual((esther.frequency, esther.monetary), (1, Decimal("30.00")))
+
+        # Rebuilding replaces the rows rather than adding to them
+        segments.rebuild()
+        self.assertEqual(CustomerSegment.objects.count(), 5)
+
+    def test_customer_endpoints_filter_by_segment(self):
+        self.assertEqual(self.client.get("/api/customers/", {"segment": "new"}).data["results"], [])
+        out = io.StringIO()
+        call_command("segment_customers", stdout=out)
+        self.assertIn("5 customer(s) segmented", out.getvalue())
+
+        # The rebuild invalidates cached customer lists
+        res = self.client.get("/api/customers/", {"segment": "new"})
+        self.assertEqual([(c["name"], c["segment"]) for c in res.data["results"]], [("Chebet", "new")])
+        fatuma = self.client.get(f"/api/customers/{Customer.objects.get(name='Fatuma').pk}/")
+        self.assertIsNone(fatuma.data["segment"])
+        res = self.client.get("/api/customers/segments/")
+        self.assertEqual(res.data["segments"]["champions"], 1)
+        self.assertIsNotNone(res.data["computed_at"])
+
+
+
+# ─── Stores ───────────────────────────────────────────────────────────────────
+
+class StoreTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("cashier", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.branch = Store.objects.create(code="westlands", name="Westlands")
+        self.sugar = stocked(Product.objects.create(name="Sugar 2kg", barcode="5900010", price=Decimal("250")), 10)
+        stocked(self.sugar, 3, self.branch)
+
+    def at(self, code):
+        self.client.credentials(HTTP_X_STORE=code)
+
+    def test_stock_is_per_store(self):
+        self.assertEqual(self.client.get("/api/products/").data["results"][0]["stock_quantity"], 10)
+        self.at("westlands")
+        res = self.client.get("/api/products/")
+        self.assertEqual(res["X-Cache"], "MISS")  # not the default store's cached page
+        self.assertEqual((res.data["results"][0]["stock_quantity"], res.data["results"][0]["is_low_stock"]), (3, True))
+
+        cart = self.client.post("/api/carts/", {}, format="json").data["id"]
+        self.client.post(f"/api/carts/{cart}/lines/", {"product": self.sugar.id, "quantity": 2}, format="json")
+        order = self.client.post(f"/api/carts/{cart}/checkout/", {}, format="json").data
+        self.assertEqual(order["store"], self.branch.id)
+        self.assertEqual((stock_of(self.sugar), stock_of(self.sugar, self.branch)), (10, 1))
+        self.assertEqual(self.client.get("/api/products/").data["results"][0]["stock_quantity"], 1)
+
+    def test_orders_and_movements_are_scoped_to_the_store(self):
+        Order.objects.create(store=main_store(), cashier=self.user)
+        order = Order.objects.create(store=self.branch, cashier=self.user)
+        with transaction.atomic():
+            apply_stock_changes({self.sugar.id: 5}, "restock", "GRN-1", self.user, self.branch)
+        self.at("westlands")
+        self.assertEqual([o["id"] for o in self.client.get("/api/orders/").data["results"]], [order.id])
+        movements = self.client.get("/api/stock-movements/").data["results"]
+        self.assertEqual([(m["reference"], m["new_stock"]) for m in movements], [("GRN-1", 8)])
+        self.at("main")
+        self.assertEqual(self.client.get("/api/stock-movements/").data["results"], [])
+
+    def test_unknown_or_closed_store_is_rejected(self):
+        self.at("nowhere")
+        self.assertEqual(self.client.get("/api/products/").status_code, 400)
+        Store.objects.filter(pk=self.branch.pk).update(is_active=False)
+        bump_version(Store)
+        res = self.client.get("/api/orders/", {"store": "westlands"})
+        self.assertEqual(res.status_code, 400)
+        self.assertIn("store", res.data)
+        self.at("")
+        self.assertEqual([s["code"] for s in self.client.get("/api/stores/").data], ["main"])
+
+    def test_async_scan_uses_the_store(self):
+        token = f"Bearer {RefreshToken.for_user(self.user).access_token}"
+        res = self.client.get("/api/async/scan/5900010/", HTTP_AUTHORIZATION=token, HTTP_X_STORE="westlands")
+        self.assertEqual(res.json()["stock_quantity"], 3)
+        res = self.client.get("/api/async/scan/5900010/", HTTP_AUTHORIZATION=token, HTTP_X_STORE="nowhere")
+        self.assertEqual(res.status_code, 400)
+
+
+# ─── Archive ──────────────────────────────────────────────────────────────────
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("cashier", password="x", first_name="Jane", last_name="Cashier")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.product = stocked(Product.objects.create(name="Tea 500g", price=Decimal("320")), 100)
+        self.customer = Customer.objects.create(name="Wanjiru", phone="0712345009")
+        now = timezone.now()
+        self.old = [self.order(now - timedelta(days=400)), self.order(now - timedelta(days=390), "cancelled")]
+        self.pending = self.order(now - timedelta(days=395), "pending")
+        self.recent = self.order(now - timedelta(days=2))
+
+    def order(self, created_at, status="completed"):
+        order = Order.objects.create(store=main_store(), customer=self.customer, cashier=self.user, status=status)
+        OrderItem.objects.create(order=order, product=self.product, quantity=2, unit_price=Decimal("320"))
+        order.calculate_totals()
+        paid = Payment.objects.create(order=order, method="cash", amount=order.total_amount, status="completed")
+        Payment.objects.create(order=order, method="cash", amount=Decimal("50"), status="refunded", refund_of=paid)
+        LoyaltyEntry.objects.create(customer=self.customer, order=order, kind="earn", points=7)
+        with transaction.atomic():
+            apply_stock_changes({self.product.id: -2}, "sale", order.order_number, self.user, main_store())
+        Order.objects.filter(pk=order.pk).update(created_at=created_at)
+        StockMovement.objects.filter(reference=order.order_number).update(created_at=created_at)
+        return order
+
+    def history(self):
+        since = (timezone.localdate() - timedelta(days=401)).isoformat()
+        return (
+            self.client.get("/api/orders/", {"date_from": since, "expand": "items,payments"}).json(),
+            self.client.get(f"/api/orders/{self.old[0].id}/").json(),
+            self.client.get("/api/stock-movements/", {"date_from": since}).json(),
+        )
+
+    def test_old_history_moves_and_reads_the_same(self):
+        before = self.history()
+        self.assertEqual(before[0]["count"], 4)
+        out = io.StringIO()
+        call_command("archive_history", stdout=out)
+        self.assertRegex(out.getvalue(), r"orders\s+2\b")
+
+        self.assertEqual(set(Order.objects.values_list("id", flat=True)), {self.pending.id, self.recent.id})
+        self.assertEqual(StockMovement.objects.count(), 1)
+        self.assertEqual(list(ArchivedOrder.objects.values_list("id", flat=True)), [o.id for o in self.old[::-1]])
+        self.assertEqual(ArchivedPayment.objects.exclude(refund_of=None).count(), 2)
+        # Points earned on archived orders stay on the ledger, with their order id
+        self.assertEqual(sorted(LoyaltyEntry.objects.exclude(order_id__in=Order.objects.values("id"))
+                                .values_list("order_id", flat=True)), [o.id for o in self.old])
+        entries = self.client.get(f"/api/customers/{self.customer.id}/loyalty/").json()["entries"]
+        self.assertEqual(sorted((e["order"], e["order_number"]) for e in entries)[:2], [(o.id, None) for o in self.old])
+        with self.captureOnCommitCallbacks(execute=True):
+            loyalty.recompute()
+        self.assertEqual(LoyaltyEntry.objects.filter(order_id__in=[o.id for o in self.old]).count(), 2)
+
+        self.assertEqual(self.history(), before)
+        # Without a date range, only the hot tables are read
+        self.assertEqual(self.client.get("/api/orders/").json()["count"], 2)
+        self.assertEqual(self.client.get("/api/orders/?date_from=2999-01-01").json()["count"], 0)
+
+    def test_dates_that_dont_exist_are_rejected(self):
+        for url in ("/api/orders/", "/api/stock-movements/"):
+            res = self.client.get(url, {"date_from": "2024-02-30"})
+            self.assertEqual((res.status_code, res.json()), (400, {"date_from": ["Enter a valid date (YYYY-MM-DD)."]}))
+            self.assertEqual(self.client.get(url, {"date_to": "yesterday"}).status_code, 400)
+
+    def test_archive_tables_mirror_the_hot_ones(self):
+        for hot, cold in ((Order, ArchivedOrder), (OrderItem, ArchivedOrderItem), (Payment, ArchivedPayment),
+                          (StockMovement, ArchivedStockMovement)):
+            fields = [f.column for f in hot._meta.concrete_fields]
+            self.assertEqual([f.column for f in cold._meta.concrete_fields][:len(fields)], fields)
+
+
+# ─── Product import ───────────────────────────────────────────────────────────
+
+HAS_OPENPYXL = importlib.util.find_spec("openpyxl") is not None
+
+
+class ImportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user("manager", password="x", is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.drinks = Category.objects.create(name="Drinks")
+        self.soda = stocked(Product.objects.create(
+            name="Soda 500ml", barcode="6001", category=self.drinks, price=Decimal("60"), cost_price=Decimal("40"),
+        ), 12)
+        self.water = Product.objects.create(name="Water 1l", barcode="6002", price=Decimal("50"))
+
+    def upload(self, text, name="catalog.csv"):
+        content = text if isinstance(text, bytes) else text.encode()
+        return self.client.post("/api/products/import/", {"file": SimpleUploadedFile(name, content)})
+
+    def test_creates_updates_and_skips_unchanged_rows(self):
+        self.client.get("/api/products/")
+        res = self.upload(
+            "Barcode,Name,Category,Price,Cost Price,Stock Quantity\n"
+            "6001,,,65.00,,20\n"                      # price change and a stock count
+            "6002,Water 1l,,50,,\n"                   # as it is
+            "6003,Juice 1l,Juice,180,120,8\n"         # new, in a new category
+            "6004,Crisps,Snacks,abc,,\n"              # bad price
+            "6005,,,,,\n"                             # new without name and price
+            "6003,Juice 1l,Juice,180,120,8\n"         # duplicate
+            "\n"
+        )
+        self.assertEqual(res.status_code, 200)
+        report = res.data
+        self.assertEqual(
+            {k: report[k] for k in ("rows", "created", "updated", "unchanged", "failed")},
+            {"rows": 6, "created": 1, "updated": 1, "unchanged": 1, "failed": 3},
+        )
+        self.assertEqual([(e["row"], sorted(e["errors"])) for e in report["errors"]], [
+            (5, ["price"]), (7, ["barcode"]), (6, ["name", "price"]),
+        ])
+
+        self.soda.refresh_from_db()
+        self.assertEqual((self.soda.name, self.soda.price, self.soda.cost_price), ("Soda 500ml", Decimal("65"), 40))
+        self.assertEqual(self.soda.category, self.drinks)
+        juice = Product.objects.get(barcode="6003")
+        self.assertEqual((juice.category.name, juice.price, stock_of(juice), stock_of(self.soda)), ("Juice", 180, 8, 20))
+        # The cached catalog sees the new prices
+        prices = {p["barcode"]: p["price"] for p in self.client.get("/api/products/").data["results"]}
+        self.assertEqual(prices, {"6001": "65.00", "6002": "50.00", "6003": "180.00"})
+
+    def test_batches_and_dry_run_command(self):
+        lines = "".join(f"70{i:02d},Item {i},Bulk,{10 + i},,{i}\n" for i in range(25))
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as file:
+            file.write("barcode,name,category,price,cost_price,stock_quantity\n" + lines)
+        self.addCleanup(os.remove, file.name)
+        out = io.StringIO()
+        call_command("import_products", file.name, "--batch", "10", "--dry-run", stdout=out)
+        self.assertIn("25 created", out.getvalue())
+        self.assertFalse(Product.objects.filter(barcode__startswith="70").exists())
+
+        call_command("import_products", file.name, "--batch", "10", stdout=io.StringIO())
+        self.assertEqual(Product.objects.filter(category__name="Bulk").count(), 25)
+        self.assertEqual(stock_of(Product.objects.get(barcode="7024")), 24)
+
+    def test_rejects_bad_files_and_non_staff(self):
+        self.assertEqual(self.client.post("/api/products/import/").status_code, 400)
+        self.assertIn("Unknown column", self.upload("barcode,colour\n6001,red\n").data["error"])
+        self.assertIn("Unsupported", self.upload("x", name="catalog.pdf").data["error"])
+        self.client.force_authenticate(User.objects.create_user("cashier", password="x"))
+        self.assertEqual(self.upload("barcode,price\n6001,1\n").status_code, 403)
+        self.assertEqual(Product.objects.get(barcode="6001").price, 60)
+
+    def test_stock_only_changes_are_counted(self):
+        res = self.upload("barcode,stock_quantity\n6001,12\n6002,0\n6001,\n")
+        self.assertEqual((res.data["updated"], res.data["unchanged"]), (0, 2))
+        res = self.upload("barcode,stock_quantity\n6001,15\n6002,4\n")
+        self.assertEqual((res.data["updated"], res.data["unchanged"]), (2, 0))
+        self.assertEqual((stock_of(self.soda), stock_of(self.water)), (15, 4))
+
+    def test_unreadable_files_and_out_of_range_numbers(self):
+        res = self.upload("barcode,name\n6002,Caf\u00e9 latte\n".encode("cp1252"))
+        self.assertEqual((res.status_code, res.data["error"]), (400, "The file isn't UTF-8 text: save it as CSV UTF-8"))
+        res = self.upload("barcode,name\n6002," + "x" * (csv.field_size_limit() + 1) + "\n")
+        self.assertEqual(res.status_code, 400)
+        self.assertIn("field larger than field limit", res.data["error"])
+
+        res = self.upload(
+            "barcode,price,cost_price,stock_quantity,low_stock_threshold\n"
+            "6001,NaN,,,\n"
+            "6002,,Infinity,1e30,-1e9999\n"
+            "6003,,,2147483648,nan\n"
+        )
+        self.assertEqual([(e["row"], e["errors"]) for e in res.data["errors"]], [
+            (2, {"price": ["A valid number is required."]}),
+            (3, {"cost_price": ["A valid number is required."],
+                 "stock_quantity": ["Must be between -2147483648 and 2147483647."],
+                 "low_stock_threshold": ["Must be between -2147483648 and 2147483647."]}),
+            (4, {"stock_quantity": ["Must be between -2147483648 and 2147483647."],
+                 "low_stock_threshold": ["A valid integer is required."]}),
+        ])
+        self.assertEqual(Product.objects.get(barcode="6001").price, 60)
+
+    @skipUnless(HAS_OPENPYXL, "openpyxl is not installed")
+    def test_xlsx(self):
+        from openpyxl import Workbook
+        workbook = Workbook()
+        workbook.active.append(["barcode", "name", "price", "is_active"])
+        workbook.active.append([6002, "Water 1l", 55.5, "no"])
+        file = io.BytesIO()
+        workbook.save(file)
+        res = self.client.post("/api/products/import/", {"file": SimpleUploadedFile("prices.xlsx", file.getvalue())})
+        self.assertEqual(res.data["updated"], 1)
+        self.water.refresh_from_db()
+        self.assertEqual((self.water.price, self.water.is_active), (Decimal("55.50"), False))
+
+
+# ─── Goods received ───────────────────────────────────────────────────────────
+
+class GoodsReceiptTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("storekeeper", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.oil = stocked(Product.objects.create(
+            name="Cooking oil 1l", barcode="6101", price=Decimal("320"), cost_price=Decimal("250"),
+        ), 30)
+        self.flour = Product.objects.create(name="Flour 2kg", barcode="6102", price=Decimal("210"), cost_price=Decimal("150"))
+
+    def receive(self, lines, **data):
+        return self.client.post("/api/goods-receipts/", {"supplier": "Bidco", "lines": lines, **data}, format="json")
+
+    def test_delivery_restocks_and_averages_costs(self):
+        self.client.get("/api/products/")
+        res = self.receive([
+            {"product": self.oil.id, "quantity": 10, "unit_cost": "270.00"},
+            {"product": self.flour.id, "quantity": 20, "unit_cost": "160.00"},
+        ], supplier_reference="INV-889")
+        self.assertEqual(res.status_code, 201, res.content)
+        receipt = res.data
+        self.assertEqual((receipt["supplier_reference"], receipt["total_cost"]), ("INV-889", "5900.00"))
+
+        # (30 * 250 + 10 * 270) / 40; flour had no stock here, so it takes the delivered cost
+        self.assertEqual({i["product"]: i["cost_price"] for i in receipt["items"]},
+                         {self.oil.id: "255.00", self.flour.id: "160.00"})
+        self.assertEqual((stock_of(self.oil), stock_of(self.flour)), (40, 20))
+        movements = StockMovement.objects.filter(reference=receipt["grn_number"])
+        self.assertEqual({(m.movement_type, m.previous_stock, m.new_stock) for m in movements},
+                         {("restock", 30, 40), ("restock", 0, 20)})
+        costs = {p["id"]: p["cost_price"] for p in self.client.get("/api/products/").data["results"]}
+        self.assertEqual(costs[self.oil.id], "255.00")
+
+    def test_costs_are_optional(self):
+        res = self.receive([{"product": self.oil.id, "quantity": 5}, {"product": self.flour.id, "quantity": 1,
+                                                                          "unit_cost": "1.00"}], update_costs=False)
+        self.assertEqual(res.data["total_cost"], "1.00")
+        self.oil.refresh_from_db()
+        self.flour.refresh_from_db()
+        self.assertEqual((self.oil.cost_price, self.flour.cost_price, stock_of(self.oil)), (250, 150, 35))
+
+    def test_bad_deliveries_change_nothing(self):
+        self.assertEqual(self.receive([{"product": self.oil.id, "quantity": 1},
+                                       {"product": self.oil.id, "quantity": 2}]).status_code, 400)
+        self.assertEqual(self.receive([{"product": self.oil.id, "quantity": 0}]).status_code, 400)
+        res = self.receive([{"product": self.oil.id, "quantity": 5}, {"product": 999999, "quantity": 5}])
+        self.assertEqual((res.status_code, res.data["error"]), (400, "Unknown product(s): 999999"))
+        self.assertEqual((stock_of(self.oil), GoodsReceipt.objects.count()), (30, 0))
+
+    def test_receipts_are_per_store(self):
+        self.receive([{"product": self.oil.id, "quantity": 5}])
+        Store.objects.create(code="westlands", name="Westlands")
+        self.client.credentials(HTTP_X_STORE="westlands")
+        self.receive([{"product": self.oil.id, "quantity": 7}], supplier="Unga Ltd")
+        self.assertEqual([r["supplier"] for r in self.client.get("/api/goods-receipts/").data["results"]],
+                         ["Unga Ltd"])
+        self.assertEqual(stock_of(self.oil, get_store("westlands")), 7)
+
+    def test_costs_average_over_the_whole_chain(self):
+        branch = Store.objects.create(code="westlands", name="Westlands")
+        stocked(self.oil, 10, branch)
+        stocked(self.flour, -5, branch)
+        res = self.receive([
+            {"product": self.oil.id, "quantity": 10, "unit_cost": "270.00"},
+            {"product": self.flour.id, "quantity": 20, "unit_cost": "160.00"},
+        ])
+        # (30 + 10 on hand) * 250 + 10 * 270 over 50; the oversold branch counts as no flour
+        self.assertEqual({i["product"]: i["cost_price"] for i in res.data["items"]},
+                         {self.oil.id: "254.00", self.flour.id: "160.00"})
+
+    def test_dates_that_dont_exist_are_rejected(self):
+        res = self.client.get("/api/goods-receipts/", {"date_from": "2024-02-30"})
+        self.assertEqual((res.status_code, res.json()), (400, {"date_from": ["Enter a valid date (YYYY-MM-DD)."]}))
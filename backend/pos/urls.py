@@ -1,25 +1,36 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from . import async_views
 from .views import (
     LoginView,
+    StoreViewSet,
     CategoryViewSet,
     ProductViewSet,
     CustomerViewSet,
     OrderViewSet,
+    CartViewSet,
+    PromotionViewSet,
     StockMovementViewSet,
+    GoodsReceiptViewSet,
     MpesaSTKPushView,
     MpesaCallbackView,
     MpesaQueryView,
     CashPaymentView,
+    LoyaltyPaymentView,
     DashboardView,
+    MetricsView,
 )
 
 router = DefaultRouter()
+router.register(r"stores", StoreViewSet)
 router.register(r"categories", CategoryViewSet)
 router.register(r"products", ProductViewSet)
 router.register(r"customers", CustomerViewSet)
 router.register(r"orders", OrderViewSet)
+router.register(r"carts", CartViewSet, basename="cart")
+router.register(r"promotions", PromotionViewSet)
 router.register(r"stock-movements", StockMovementViewSet)
+router.register(r"goods-receipts", GoodsReceiptViewSet)
 
 urlpatterns = [
     # Auth — must come before router
@@ -28,12 +39,23 @@ urlpatterns = [
     # Dashboard
     path("dashboard/", DashboardView.as_view(), name="dashboard"),
 
+    # Prometheus scrape target
+    path("metrics/", MetricsView.as_view(), name="metrics"),
+
     # Payments — must come before router include
     path("payments/cash/", CashPaymentView.as_view(), name="cash-payment"),
+    path("payments/loyalty/", LoyaltyPaymentView.as_view(), name="loyalty-payment"),
     path("payments/mpesa/stk-push/", MpesaSTKPushView.as_view(), name="mpesa-stk-push"),
     path("payments/mpesa/callback/", MpesaCallbackView.as_view(), name="mpesa-callback"),
     path("payments/mpesa/query/<str:checkout_request_id>/", MpesaQueryView.as_view(), name="mpesa-query"),
 
+    # Async reads, served natively under ASGI (see pos.async_views)
+    path("async/scan/<str:barcode>/", async_views.scan, name="async-scan"),
+    path("async/catalog/", async_views.catalog, name="async-catalog"),
+    path("async/customers/lookup/", async_views.customer_lookup, name="async-customer-lookup"),
+    path("async/payments/<int:pk>/status/", async_views.payment_status, name="async-payment-status"),
+    path("async/dashboard/", async_views.dashboard, name="async-dashboard"),
+
     # Router — last so it doesn't swallow the paths above
     path("", include(router.urls)),
 ]
\ No newline at end of file
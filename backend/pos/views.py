@@ -1,27 +1,47 @@
 import requests
-import base64
 import json
 from datetime import datetime
 from decimal import Decimal
 
 from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse
 from django.utils import timezone
-from django.db.models import Sum, Count
+from django.db.models import Sum, Count, F, Max, Q
 from django.contrib.auth.models import User
 
-from rest_framework import viewsets, status, permissions
+from rest_framework import mixins, viewsets, status, permissions
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
 
-from .models import Category, Product, Customer, Order, OrderItem, Payment, StockMovement
+from .models import (
+    Category, Product, Customer, CustomerSegment, Order, OrderItem, Payment, StockLevel, StockMovement, Store,
+    Promotion, LoyaltyEntry, ArchivedOrder, ArchivedStockMovement, GoodsReceipt,
+)
 from .serializers import (
     CategorySerializer, ProductSerializer, CustomerSerializer,
     OrderSerializer, OrderCreateSerializer, PaymentSerializer,
     MpesaSTKPushSerializer, StockMovementSerializer, StockAdjustmentSerializer,
-    UserSerializer
+    LoyaltyRedeemSerializer, LoyaltyEntrySerializer,
+    UserSerializer, RefundSerializer, StoreSerializer,
+    CartSerializer, CartLineSerializer, CartQuantitySerializer, PromotionSerializer,
+    GoodsReceiptSerializer, GoodsReceiptCreateSerializer,
 )
+from . import carts, loyalty, segments
+from .archive import ArchiveReadMixin, date_range
+from .receiving import ReceivingError, receive_goods
+from .returns import ReturnError, cancel_order, refund_order
+from .caching import CachedResponseMixin
+from .customers import normalize_phone, phone_lookup, type_ahead
+from .imports import CatalogImportError, import_products
+from .metrics import MetricsTokenOrStaff, exposition, stage
+from .mpesa import base_url, generate_password, get_mpesa_access_token, send_stk_push
+from .rows import FastReadMixin, OrderRows, ProductRows, StockMovementRows, order_data, requested_fields
+from .stock import apply_stock_changes
+from .stores import current_store, with_stock
 
 
 # ─── Auth ──────────────────────────────────────────────────────────────────────
@@ -44,23 +64,38 @@ class LoginView(APIView):
         return Response({"error": "Invalid credentials"}, status=status.HTTP_401_UNAUTHORIZED)
 
 
+# ─── Store ─────────────────────────────────────────────────────────────────────
+
+class StoreViewSet(viewsets.ReadOnlyModelViewSet):
+    """The branches a till can name in its X-Store header."""
+    queryset = Store.objects.filter(is_active=True)
+    serializer_class = StoreSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = None
+
+
 # ─── Category ──────────────────────────────────────────────────────────────────
 
-class CategoryViewSet(viewsets.ModelViewSet):
-    queryset = Category.objects.all()
+class CategoryViewSet(CachedResponseMixin, viewsets.ModelViewSet):
+    queryset = Category.objects.annotate(
+        active_product_count=Count("products", filter=Q(products__is_active=True))
+    )
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAuthenticated]
+    cache_models = (Category, Product)
 
 
 # ─── Product ───────────────────────────────────────────────────────────────────
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(CachedResponseMixin, FastReadMixin, viewsets.ModelViewSet):
     queryset = Product.objects.select_related("category").filter(is_active=True)
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticated]
+    cache_models = (Product, Category, StockLevel)
+    row_builder = ProductRows
 
     def get_queryset(self):
-        qs = super().get_queryset()
+        qs = with_stock(super().get_queryset(), current_store(self.request))
         search = self.request.query_params.get("search")
         category = self.request.query_params.get("category")
         barcode = self.request.query_params.get("barcode")
@@ -73,7 +108,6 @@ class ProductViewSet(viewsets.ModelViewSet):
         if barcode:
             qs = qs.filter(barcode=barcode)
         if low_stock == "true":
-            from django.db.models import F
             qs = qs.filter(stock_quantity__lte=F("low_stock_threshold"))
         return qs
 
@@ -83,50 +117,100 @@ class ProductViewSet(viewsets.ModelViewSet):
         serializer.is_valid(raise_exception=True)
         data = serializer.validated_data
 
+        store = current_store(request)
         try:
-            product = Product.objects.get(id=data["product_id"])
+            product = with_stock(Product.objects.select_related("category"), store).get(id=data["product_id"])
         except Product.DoesNotExist:
             return Response({"error": "Product not found"}, status=404)
 
-        prev = product.stock_quantity
-        product.stock_quantity += data["quantity"]
-        product.save(update_fields=["stock_quantity"])
-
-        StockMovement.objects.create(
-            product=product,
-            movement_type=StockMovement.MovementType.ADJUSTMENT if data["quantity"] != 0 else StockMovement.MovementType.RESTOCK,
-            quantity=data["quantity"],
-            previous_stock=prev,
-            new_stock=product.stock_quantity,
-            reference=data["reason"],
-            created_by=request.user,
-        )
+        with transaction.atomic():
+            movements = apply_stock_changes(
+                {product.id: data["quantity"]}, StockMovement.MovementType.ADJUSTMENT,
+                data["reason"], request.user, store,
+            )
+        if movements:
+            product.stock_quantity = movements[0].new_stock
         return Response(ProductSerializer(product).data)
 
+    @action(detail=False, methods=["post"], url_path="import", permission_classes=[permissions.IsAdminUser])
+    def import_file(self, request):
+        """Create and update products from an uploaded CSV/XLSX catalog (see pos.imports)."""
+        upload = request.FILES.get("file")
+        if upload is None:
+            return Response({"error": "Upload the catalog as 'file' (CSV or XLSX)"}, status=400)
+        try:
+            report = import_products(upload, upload.name, current_store(request))
+        except CatalogImportError as exc:
+            return Response({"error": str(exc)}, status=400)
+        return Response(report)
+
 
 # ─── Customer ──────────────────────────────────────────────────────────────────
 
-class CustomerViewSet(viewsets.ModelViewSet):
-    queryset = Customer.objects.all()
+class CustomerViewSet(CachedResponseMixin, viewsets.ModelViewSet):
+    queryset = Customer.objects.select_related("segment")
     serializer_class = CustomerSerializer
     permission_classes = [permissions.IsAuthenticated]
+    cache_models = (Customer, CustomerSegment)
 
     def get_queryset(self):
         qs = super().get_queryset()
-        search = self.request.query_params.get("search")
+        search = self.request.query_params.get("search", "").strip()
         phone = self.request.query_params.get("phone")
+        segment = self.request.query_params.get("segment")
         if search:
-            qs = qs.filter(name__icontains=search)
+            # Prefix of the name or the number, served by their indexes
+            qs = qs.filter(type_ahead(search, qs.db)).order_by("name_key", "id")
         if phone:
-            qs = qs.filter(phone=phone)
+            qs = qs.filter(phone_lookup(phone))
+        if segment:
+            qs = qs.filter(segment__segment=segment)
+        return qs
+
+    @action(detail=False, methods=["get"])
+    def segments(self, request):
+        """Customers per RFM segment as of the last `segment_customers` run."""
+        computed_at = CustomerSegment.objects.aggregate(at=Max("computed_at"))["at"]
+        return Response({"computed_at": computed_at, "segments": segments.counts()})
+
+    @action(detail=True, methods=["get"])
+    def loyalty(self, request, pk=None):
+        """Balance, points available to tender (unfolded entries included) and the latest entries."""
+        customer = self.get_object()
+        entries = LoyaltyEntry.objects.filter(customer=customer).select_related("order").order_by("-created_at", "-id")
+        return Response({
+            "balance": customer.loyalty_points,
+            "available": loyalty.available_points(customer.pk),
+            "entries": LoyaltyEntrySerializer(entries[:50], many=True).data,
+        })
+
+
+# ─── Promotions ────────────────────────────────────────────────────────────────
+
+class PromotionViewSet(viewsets.ModelViewSet):
+    queryset = Promotion.objects.select_related("product", "category")
+    serializer_class = PromotionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if self.request.query_params.get("running"):
+            now = timezone.now()
+            qs = qs.filter(is_active=True).filter(
+                Q(starts_at__isnull=True) | Q(starts_at__lte=now),
+                Q(ends_at__isnull=True) | Q(ends_at__gt=now),
+            )
         return qs
 
 
 # ─── Order ─────────────────────────────────────────────────────────────────────
 
-class OrderViewSet(viewsets.ModelViewSet):
-    queryset = Order.objects.select_related("customer", "cashier").prefetch_related("items", "payments")
+class OrderViewSet(ArchiveReadMixin, FastReadMixin, viewsets.ModelViewSet):
+    queryset = Order.objects.select_related("customer", "cashier").prefetch_related("items__product", "payments")
     permission_classes = [permissions.IsAuthenticated]
+    replica_reads = True
+    row_builder = OrderRows
+    archive_model = ArchivedOrder
 
     def get_serializer_class(self):
         if self.action == "create":
@@ -134,10 +218,15 @@ class OrderViewSet(viewsets.ModelViewSet):
         return OrderSerializer
 
     def get_queryset(self):
-        qs = super().get_queryset()
+        qs = self.filter_history(super().get_queryset().filter(store=current_store(self.request)))
+        if self.action in ("cancel", "refund"):
+            # The returns engine re-reads the order under a lock
+            qs = qs.prefetch_related(None)
+        return qs
+
+    def filter_history(self, qs):
         status_filter = self.request.query_params.get("status")
-        date_from = self.request.query_params.get("date_from")
-        date_to = self.request.query_params.get("date_to")
+        date_from, date_to = date_range(self.request)
         if status_filter:
             qs = qs.filter(status=status_filter)
         if date_from:
@@ -151,47 +240,129 @@ class OrderViewSet(viewsets.ModelViewSet):
         ctx["request"] = self.request
         return ctx
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        loyalty.orders_deleted(Order.objects.filter(pk=instance.pk))
+        instance.delete()
+
+    def get_row_builder(self):
+        # Lists default to the order-history summary, detail to the full order
+        default = OrderRows.SUMMARY_FIELDS if self.action == "list" else OrderRows.FIELDS
+        return OrderRows(self.request, requested_fields(self.request, OrderRows.AVAILABLE_FIELDS, default))
+
     @action(detail=True, methods=["post"])
     def cancel(self, request, pk=None):
-        order = self.get_object()
-        if order.status == Order.StatusChoices.COMPLETED:
-            return Response({"error": "Cannot cancel a completed order"}, status=400)
-        order.status = Order.StatusChoices.CANCELLED
-        order.save()
-        # Restore stock
-        for item in order.items.all():
-            prev = item.product.stock_quantity
-            item.product.stock_quantity += item.quantity
-            item.product.save(update_fields=["stock_quantity"])
-            StockMovement.objects.create(
-                product=item.product,
-                movement_type=StockMovement.MovementType.RETURN,
-                quantity=item.quantity,
-                previous_stock=prev,
-                new_stock=item.product.stock_quantity,
-                reference=order.order_number,
-                created_by=request.user,
+        try:
+            order = cancel_order(self.get_object(), request.user)
+        except ReturnError as e:
+            return Response({"error": str(e)}, status=400)
+        return Response(order_data(request, order.pk))
+
+    @action(detail=True, methods=["post"])
+    def refund(self, request, pk=None):
+        serializer = RefundSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        try:
+            refunds = refund_order(
+                self.get_object(), request.user,
+                lines=data.get("items") or None,
+                method=data.get("method"),
             )
-        return Response(OrderSerializer(order).data)
+        except ReturnError as e:
+            return Response({"error": str(e)}, status=400)
+        return Response({
+            "refunds": PaymentSerializer(refunds, many=True).data,
+            "order": order_data(request, refunds[0].order_id),
+        })
 
 
-# ─── M-Pesa ────────────────────────────────────────────────────────────────────
+# ─── Cart ──────────────────────────────────────────────────────────────────────
+
+class CartViewSet(viewsets.ViewSet):
+    """
+    Server-side basket for a till: open a cart, scan lines into it and check
+    it out as an order. Line operations answer with the changed line and the
+    cart's running totals.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    lookup_value_regex = "[0-9a-fA-F-]{36}"
+
+    def get_cart(self, pk):
+        cart = carts.get_cart(pk, self.request.user)
+        if cart is None:
+            raise NotFound("Cart not found")
+        return cart
+
+    def line_response(self, cart, line):
+        return Response({**carts.totals_data(cart), "line": carts.line_data(line) if line else None})
+
+    def create(self, request):
+        serializer = CartSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        cart = carts.open_cart(request.user, current_store(request), **serializer.validated_data)
+        return Response(carts.cart_data(cart), status=status.HTTP_201_CREATED)
+
+    def retrieve(self, request, pk=None):
+        return Response(carts.cart_data(self.get_cart(pk)))
+
+    def partial_update(self, request, pk=None):
+        serializer = CartSerializer(data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        try:
+            cart = carts.update_cart(self.get_cart(pk), **serializer.validated_data)
+        except carts.CartConflict as e:
+            return Response({"error": str(e)}, status=409)
+        return Response(carts.cart_data(cart))
 
-def get_mpesa_access_token():
-    url = "https://sandbox.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
-    if not settings.MPESA_ENVIRONMENT == "sandbox":
-        url = "https://api.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
+    def destroy(self, request, pk=None):
+        carts.discard_cart(self.get_cart(pk))
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
-    credentials = f"{settings.MPESA_CONSUMER_KEY}:{settings.MPESA_CONSUMER_SECRET}"
-    encoded = base64.b64encode(credentials.encode()).decode()
-    response = requests.get(url, headers={"Authorization": f"Basic {encoded}"})
-    return response.json().get("access_token")
+    @action(detail=True, methods=["post"])
+    def lines(self, request, pk=None):
+        serializer = CartLineSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        cart = self.get_cart(pk)
+        try:
+            line = carts.add_item(cart, data["quantity"], product_id=data.get("product"), barcode=data.get("barcode"))
+        except carts.CartConflict as e:
+            return Response({"error": str(e)}, status=409)
+        except carts.CartError as e:
+            return Response({"error": str(e)}, status=400)
+        return self.line_response(cart, line)
+
+    @action(detail=True, methods=["patch", "delete"], url_path=r"lines/(?P<product_id>\d+)")
+    def line(self, request, pk=None, product_id=None):
+        cart = self.get_cart(pk)
+        try:
+            if request.method == "DELETE":
+                carts.remove_item(cart, product_id)
+                line = None
+            else:
+                serializer = CartQuantitySerializer(data=request.data)
+                serializer.is_valid(raise_exception=True)
+                line = carts.set_quantity(cart, product_id, **serializer.validated_data)
+        except carts.CartConflict as e:
+            return Response({"error": str(e)}, status=409)
+        except carts.CartError as e:
+            return Response({"error": str(e)}, status=400)
+        return self.line_response(cart, line)
 
+    @action(detail=True, methods=["post"])
+    def checkout(self, request, pk=None):
+        try:
+            order = carts.checkout(self.get_cart(pk), request.user)
+        except carts.CartConflict as e:
+            return Response({"error": str(e)}, status=409)
+        except carts.CartError as e:
+            return Response({"error": str(e)}, status=400)
+        return Response(order_data(request, order.pk), status=status.HTTP_201_CREATED)
 
-def generate_password(shortcode, passkey, timestamp):
-    data = f"{shortcode}{passkey}{timestamp}"
-    return base64.b64encode(data.encode()).decode()
 
+# ─── M-Pesa ────────────────────────────────────────────────────────────────────
 
 class MpesaSTKPushView(APIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -206,65 +377,22 @@ class MpesaSTKPushView(APIView):
         except Order.DoesNotExist:
             return Response({"error": "Order not found"}, status=404)
 
-        phone = str(data["phone_number"]).strip()
-        # Normalize: 07xx -> 2547xx
-        if phone.startswith("0"):
-            phone = "254" + phone[1:]
-        elif phone.startswith("+"):
-            phone = phone[1:]
-
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        shortcode = settings.MPESA_SHORTCODE
-        passkey = settings.MPESA_PASSKEY
-        password = generate_password(shortcode, passkey, timestamp)
-
-        amount = int(data["amount"])
-        callback_url = settings.MPESA_CALLBACK_URL
+        phone = normalize_phone(data["phone_number"])
 
-        base_url = "https://sandbox.safaricom.co.ke" if settings.MPESA_ENVIRONMENT == "sandbox" else "https://api.safaricom.co.ke"
-
-        try:
-            access_token = get_mpesa_access_token()
-            payload = {
-                "BusinessShortCode": shortcode,
-                "Password": password,
-                "Timestamp": timestamp,
-                "TransactionType": "CustomerPayBillOnline",
-                "Amount": amount,
-                "PartyA": phone,
-                "PartyB": shortcode,
-                "PhoneNumber": phone,
-                "CallBackURL": callback_url,
-                "AccountReference": order.order_number,
-                "TransactionDesc": f"Payment for {order.order_number}",
-            }
-            response = requests.post(
-                f"{base_url}/mpesa/stkpush/v1/processrequest",
-                json=payload,
-                headers={"Authorization": f"Bearer {access_token}"}
+        # The push itself goes out from a job; the till follows the payment's status
+        with transaction.atomic():
+            payment = Payment.objects.create(
+                order=order,
+                method=Payment.MethodChoices.MPESA,
+                amount=data["amount"],
+                status=Payment.StatusChoices.PENDING,
+                mpesa_phone=phone,
             )
-            res_data = response.json()
-
-            if res_data.get("ResponseCode") == "0":
-                payment = Payment.objects.create(
-                    order=order,
-                    method=Payment.MethodChoices.MPESA,
-                    amount=data["amount"],
-                    status=Payment.StatusChoices.PENDING,
-                    mpesa_phone=phone,
-                    mpesa_checkout_request_id=res_data.get("CheckoutRequestID"),
-                    mpesa_merchant_request_id=res_data.get("MerchantRequestID"),
-                )
-                return Response({
-                    "message": "STK push sent successfully",
-                    "checkout_request_id": res_data.get("CheckoutRequestID"),
-                    "payment_id": payment.id,
-                })
-            else:
-                return Response({"error": res_data.get("errorMessage", "STK push failed")}, status=400)
-
-        except Exception as e:
-            return Response({"error": str(e)}, status=500)
+            send_stk_push.delay(payment_id=payment.id)
+        return Response({
+            "message": "STK push queued",
+            "payment_id": payment.id,
+        }, status=status.HTTP_202_ACCEPTED)
 
 
 class MpesaCallbackView(APIView):
@@ -294,6 +422,7 @@ class MpesaCallbackView(APIView):
                 if total_paid >= order.total_amount:
                     order.status = Order.StatusChoices.COMPLETED
                     order.save()
+                    loyalty.order_completed(order)
             else:
                 payment.status = Payment.StatusChoices.FAILED
                 payment.save()
@@ -311,7 +440,6 @@ class MpesaQueryView(APIView):
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
         shortcode = settings.MPESA_SHORTCODE
         password = generate_password(shortcode, settings.MPESA_PASSKEY, timestamp)
-        base_url = "https://sandbox.safaricom.co.ke" if settings.MPESA_ENVIRONMENT == "sandbox" else "https://api.safaricom.co.ke"
 
         try:
             access_token = get_mpesa_access_token()
@@ -321,11 +449,12 @@ class MpesaQueryView(APIView):
                 "Timestamp": timestamp,
                 "CheckoutRequestID": checkout_request_id,
             }
-            response = requests.post(
-                f"{base_url}/mpesa/stkpushquery/v1/query",
-                json=payload,
-                headers={"Authorization": f"Bearer {access_token}"}
-            )
+            with stage("external"):
+                response = requests.post(
+                    f"{base_url()}/mpesa/stkpushquery/v1/query",
+                    json=payload,
+                    headers={"Authorization": f"Bearer {access_token}"}
+                )
             return Response(response.json())
         except Exception as e:
             return Response({"error": str(e)}, status=500)
@@ -345,22 +474,51 @@ class CashPaymentView(APIView):
         except Order.DoesNotExist:
             return Response({"error": "Order not found"}, status=404)
 
-        change = cash_tendered - order.total_amount
+        # Points may already cover part of the order
+        paid = order.payments.filter(status=Payment.StatusChoices.COMPLETED).aggregate(Sum("amount"))["amount__sum"]
+        due = order.total_amount - (paid or Decimal("0"))
+        change = cash_tendered - due
         payment = Payment.objects.create(
             order=order,
             method=Payment.MethodChoices.CASH,
-            amount=order.total_amount,
+            amount=due,
             status=Payment.StatusChoices.COMPLETED,
             cash_tendered=cash_tendered,
             change_given=max(change, Decimal("0")),
         )
         order.status = Order.StatusChoices.COMPLETED
         order.save()
+        loyalty.order_completed(order, request.user)
 
         return Response({
             "payment": PaymentSerializer(payment).data,
             "change": float(max(change, Decimal("0"))),
-            "order": OrderSerializer(order).data,
+            "order": order_data(request, order.pk),
+        })
+
+
+# ─── Loyalty Payment ───────────────────────────────────────────────────────────
+
+class LoyaltyPaymentView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = LoyaltyRedeemSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        try:
+            order = Order.objects.get(id=data["order_id"])
+        except Order.DoesNotExist:
+            return Response({"error": "Order not found"}, status=404)
+
+        try:
+            payment = loyalty.redeem(order, data["points"], request.user)
+        except loyalty.LoyaltyError as e:
+            return Response({"error": str(e)}, status=400)
+        return Response({
+            "payment": PaymentSerializer(payment).data,
+            "order": order_data(request, order.pk),
         })
 
 
@@ -368,38 +526,104 @@ class CashPaymentView(APIView):
 
 class DashboardView(APIView):
     permission_classes = [permissions.IsAuthenticated]
+    replica_reads = True
 
     def get(self, request):
+        store = current_store(request)
         today = timezone.now().date()
-        today_orders = Order.objects.filter(created_at__date=today, status=Order.StatusChoices.COMPLETED)
-        today_sales = today_orders.aggregate(total=Sum("total_amount"))["total"] or 0
-        today_count = today_orders.count()
-
-        low_stock = Product.objects.filter(is_active=True).extra(
-            where=["stock_quantity <= low_stock_threshold"]
-        ).count()
+        orders = Order.objects.filter(store=store)
+        today_stats = orders.filter(
+            created_at__date=today, status=Order.StatusChoices.COMPLETED
+        ).aggregate(total=Sum("total_amount"), count=Count("id"))
+        product_stats = with_stock(Product.objects.filter(is_active=True), store).aggregate(
+            total=Count("id"),
+            low_stock=Count("id", filter=Q(stock_quantity__lte=F("low_stock_threshold"))),
+        )
 
-        recent_orders = Order.objects.select_related("customer", "cashier").order_by("-created_at")[:10]
+        rows = OrderRows(request, OrderRows.SUMMARY_FIELDS)
+        recent_orders = rows.build(rows.prepare(orders.order_by("-created_at"))[:10])
 
         return Response({
-            "today_sales": float(today_sales),
-            "today_orders": today_count,
-            "low_stock_count": low_stock,
-            "total_products": Product.objects.filter(is_active=True).count(),
-            "recent_orders": OrderSerializer(recent_orders, many=True).data,
+            "today_sales": float(today_stats["total"] or 0),
+            "today_orders": today_stats["count"],
+            "low_stock_count": product_stats["low_stock"],
+            "total_products": product_stats["total"],
+            "recent_orders": recent_orders,
         })
 
 
+# ─── Metrics ───────────────────────────────────────────────────────────────────
+
+class MetricsView(APIView):
+    permission_classes = [MetricsTokenOrStaff]
+
+    def perform_authentication(self, request):
+        # The scraper's bearer token isn't a JWT; only look for a user when it isn't the metrics token
+        token = getattr(settings, "METRICS_TOKEN", "")
+        if not (token and request.META.get("HTTP_AUTHORIZATION") == f"Bearer {token}"):
+            request.user
+
+    def get(self, request):
+        return HttpResponse(exposition(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 # ─── Stock Movements ───────────────────────────────────────────────────────────
 
-class StockMovementViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = StockMovement.objects.select_related("product", "created_by").order_by("-created_at")
+class StockMovementViewSet(ArchiveReadMixin, FastReadMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = StockMovement.objects.select_related("product", "created_by").order_by("-created_at", "-id")
     serializer_class = StockMovementSerializer
     permission_classes = [permissions.IsAuthenticated]
+    replica_reads = True
+    row_builder = StockMovementRows
+    archive_model = ArchivedStockMovement
 
     def get_queryset(self):
-        qs = super().get_queryset()
+        return self.filter_history(super().get_queryset().filter(store=current_store(self.request)))
+
+    def filter_history(self, qs):
         product_id = self.request.query_params.get("product")
+        date_from, date_to = date_range(self.request)
         if product_id:
             qs = qs.filter(product_id=product_id)
-        return qs
\ No newline at end of file
+        if date_from:
+            qs = qs.filter(created_at__date__gte=date_from)
+        if date_to:
+            qs = qs.filter(created_at__date__lte=date_to)
+        return qs
+
+
+# ─── Goods Received ────────────────────────────────────────────────────────────
+
+class GoodsReceiptViewSet(mixins.CreateModelMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = GoodsReceipt.objects.select_related("received_by").prefetch_related("items__product")
+    serializer_class = GoodsReceiptSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        qs = super().get_queryset().filter(store=current_store(self.request))
+        supplier = self.request.query_params.get("supplier")
+        date_from, date_to = date_range(self.request)
+        if supplier:
+            qs = qs.filter(supplier__icontains=supplier)
+        if date_from:
+            qs = qs.filter(created_at__date__gte=date_from)
+        if date_to:
+            qs = qs.filter(created_at__date__lte=date_to)
+        return qs
+
+    def create(self, request):
+        """Book a whole supplier delivery into the store's stock (see pos.receiving)."""
+        serializer = GoodsReceiptCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        try:
+            receipt = receive_goods(
+                current_store(request), data["lines"], request.user,
+                supplier=data["supplier"],
+                supplier_reference=data["supplier_reference"],
+                update_costs=data["update_costs"],
+            )
+        except ReceivingError as e:
+            return Response({"error": str(e)}, status=400)
+        return Response(GoodsReceiptSerializer(self.get_queryset().get(pk=receipt.pk)).data, status=201)
\ No newline at end of file
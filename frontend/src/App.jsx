@@ -6,9 +6,15 @@ const API = axios.create({ baseURL: "http://localhost:8000/api" });
 API.interceptors.request.use((cfg) => {
   const token = localStorage.getItem("access");
   if (token) cfg.headers.Authorization = `Bearer ${token}`;
+  // Branch this till belongs to; the server's default store when unset
+  const store = localStorage.getItem("store");
+  if (store) cfg.headers["X-Store"] = store;
   return cfg;
 });
 
+// Smallest rendered thumbnail for a tile, falling back to the original
+const thumb = (p, size) => p.image_urls?.[size] || p.image_url;
+
 const AuthCtx = createContext(null);
 export const useAuth = () => useContext(AuthCtx);
 
@@ -249,7 +255,7 @@ function Products() {
         {products.map(p => (
           <div key={p.id} className={`product-card${p.is_low_stock ? " low-stock" : ""}`}>
             {p.image_url
-              ? <img src={p.image_url} alt={p.name} className="product-img" />
+              ? <img src={thumb(p, 320)} alt={p.name} className="product-img" loading="lazy" />
               : <div className="product-img-placeholder"><i className="bi bi-image"></i></div>}
             <div className="product-body">
               <div className="product-name">{p.name}</div>
@@ -373,7 +379,7 @@ function POSTerminal() {
         setCart([]); setPayModal(false); setCustomer(null); setCashTendered("");
       } else if (payMethod === "mpesa") {
         const { data } = await API.post("/payments/mpesa/stk-push/", { order_id: order.id, phone_number: mpesaPhone, amount: order.total_amount });
-        setMpesaStatus({ checkoutId: data.checkout_request_id, orderId: order.id, message: "STK push sent! Ask customer to check their phone." });
+        setMpesaStatus({ paymentId: data.payment_id, orderId: order.id, message: "STK push sent! Ask customer to check their phone." });
       }
     } catch (e) {
       alert("Error processing payment: " + (e.response?.data?.error || e.message));
@@ -382,12 +388,15 @@ function POSTerminal() {
   };
 
   const pollMpesa = async () => {
-    if (!mpesaStatus?.checkoutId) return;
+    if (!mpesaStatus?.paymentId) return;
     try {
-      const { data } = await API.get(`/payments/mpesa/query/${mpesaStatus.checkoutId}/`);
-      if (data.ResultCode === "0" || data.ResultCode === 0) {
+      // Waits server-side for the callback, so one click covers the usual delay
+      const { data } = await API.get(`/async/payments/${mpesaStatus.paymentId}/status/?wait=20`);
+      if (data.status === "completed") {
         setMpesaStatus(p => ({ ...p, message: "✅ Payment confirmed!" }));
         setTimeout(() => { setCart([]); setPayModal(false); setCustomer(null); setMpesaPhone(""); setMpesaStatus(null); }, 2000);
+      } else if (data.status === "failed" || data.status === "cancelled") {
+        setMpesaStatus(p => ({ ...p, message: "❌ Payment failed or was cancelled. Try again or take another payment method." }));
       } else {
         setMpesaStatus(p => ({ ...p, message: "Still pending — ask customer to complete payment on their phone." }));
       }
@@ -444,7 +453,7 @@ function POSTerminal() {
           {products.map(p => (
             <button key={p.id} className="pos-product-btn" onClick={() => addToCart(p)} disabled={p.stock_quantity <= 0}>
               <div className="ppb-img">
-                {p.image_url ? <img src={p.image_url} alt={p.name} /> : <span className="ppb-img-placeholder"><i className="bi bi-image"></i></span>}
+                {p.image_url ? <img src={thumb(p, 160)} alt={p.name} loading="lazy" /> : <span className="ppb-img-placeholder"><i className="bi bi-image"></i></span>}
               </div>
               <div className="ppb-inner">
                 <div className="ppb-name">{p.name}</div>
@@ -617,15 +626,15 @@ function Orders() {
             </thead>
             <tbody>
               {orders.map(o => (
-                <tr key={o.id} className="clickable" onClick={() => setSelected(o)}>
+                <tr key={o.id} className="clickable" onClick={() => API.get(`/orders/${o.id}/`).then(r => setSelected(r.data))}>
                   <td><code>{o.order_number}</code></td>
                   <td>{o.customer_name || <span style={{ color: "var(--text-3)" }}>Walk-in</span>}</td>
-                  <td>{o.items?.length || 0} items</td>
+                  <td>{o.item_count || 0} items</td>
                   <td><strong>KSh {parseFloat(o.total_amount).toLocaleString()}</strong></td>
                   <td>
-                    {o.payments?.[0]?.method === "mpesa"
+                    {o.payment_method === "mpesa"
                       ? <><i className="bi bi-phone"></i> M-Pesa</>
-                      : o.payments?.[0]?.method === "cash"
+                      : o.payment_method === "cash"
                       ? <><i className="bi bi-cash"></i> Cash</>
                       : "—"}
                   </td>